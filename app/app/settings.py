@@ -9,7 +9,9 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import json
 import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,6 +28,12 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# API workers authenticate with tokens only, so with API_ONLY set they leave
+# out the admin and everything only the admin and the browsable API use:
+# sessions, messages, static files, CSRF and clickjacking protection. The
+# admin keeps being served by deployments without it.
+API_ONLY = os.getenv('API_ONLY', '0') == '1'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -36,7 +44,6 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'rest_framework.authtoken',
     'core',
     'user',
     'recipe',
@@ -44,6 +51,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,6 +61,25 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if API_ONLY:
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS if app not in (
+            'django.contrib.admin',
+            'django.contrib.sessions',
+            'django.contrib.messages',
+            'django.contrib.staticfiles',
+        )
+    ]
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE if middleware not in (
+            'django.contrib.sessions.middleware.SessionMiddleware',
+            'django.middleware.csrf.CsrfViewMiddleware',
+            'django.contrib.auth.middleware.AuthenticationMiddleware',
+            'django.contrib.messages.middleware.MessageMiddleware',
+            'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        )
+    ]
+
 ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
@@ -86,11 +114,65 @@ DATABASES = {
     }
 
 }
+
+# Read replicas, given as a comma separated list of hosts sharing the
+# primary's credentials. Safe requests read from them, see
+# core.middleware.ReplicaRoutingMiddleware.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv(
+        'DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+
+# Number of hash partitions by user for the recipe, tag and ingredient
+# tables, 0 keeps them unpartitioned. Applied by a migration on new
+# databases, use the partition_core_tables command for existing data.
+CORE_TABLE_PARTITIONS = int(os.getenv('CORE_TABLE_PARTITIONS', 0))
+
+# Seconds a client keeps reading from the primary after a write
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+
+PASSWORD_HASHER_CHOICES = {
+    'argon2': 'core.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'core.hashers.TunedBCryptSHA256PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'argon2')
+
+# The first hasher is used for new passwords, the others are still accepted
+# and their hashes get upgraded on the next successful login.
+PASSWORD_HASHERS = [PASSWORD_HASHER_CHOICES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CHOICES.items()
+    if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', 65536))
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', 1))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+# Upper bound on password hashes computed at the same time in one worker,
+# so login bursts can't take every core away from the rest of the API.
+PASSWORD_HASHING_CONCURRENCY = int(
+    os.getenv('PASSWORD_HASHING_CONCURRENCY', 2)
+)
+PASSWORD_HASHING_TIMEOUT = float(os.getenv('PASSWORD_HASHING_TIMEOUT', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -128,4 +210,212 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Seconds media responses may be cached for. Uploads are content addressed
+# and never change once written.
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# When set, media is sent by the front end server (nginx internal location)
+# through X-Accel-Redirect instead of being read by Django.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+
+# Storage of recipe images (see core.storage): the local filesystem under
+# MEDIA_ROOT, or 'core.storage.S3Storage' for an S3 compatible object store
+RECIPE_IMAGE_STORAGE = os.getenv(
+    'RECIPE_IMAGE_STORAGE', 'core.storage.ContentAddressedStorage'
+)
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+# Set for S3 compatible stores other than AWS, e.g. MinIO
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+S3_REGION = os.getenv('S3_REGION') or None
+# Base URL images are served from (bucket website or CDN). When empty,
+# image URLs are presigned and valid for S3_URL_EXPIRY seconds.
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', '')
+S3_URL_EXPIRY = 60 * 60
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# Seconds a queued file must have gone unused before reap_deleted_files
+# deletes it. Stored files are touched whenever an upload or confirm-image
+# reuses them, so this covers references that are not committed yet.
+FILE_REAPER_MIN_AGE = int(os.getenv('FILE_REAPER_MIN_AGE', 3600))
+
+# Direct image uploads: the largest accepted image and how long upload
+# URLs stay valid, in seconds
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_UPLOAD_URL_EXPIRY = 15 * 60
+# Images with more pixels than this are not decoded, as a small compressed
+# file can expand to far more memory than its size suggests
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 50 * 1000 * 1000))
+
+# Most bits the perceptual hashes of two recipe images may differ in for
+# them to be reported as the same photo (see recipe.images)
+IMAGE_DUPLICATE_DISTANCE = 5
+
+# Recipe image thumbnails (see recipe.thumbnails). Only these (width,
+# height) sizes are rendered, in these formats, the first being the default.
+THUMBNAIL_SIZES = [
+    (64, 64), (128, 128), (256, 256), (512, 512), (320, 180), (640, 360),
+]
+THUMBNAIL_FORMATS = ['webp', 'jpeg', 'png']
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', '/vol/web/thumbnails')
+THUMBNAIL_CACHE_MAX_SIZE = int(
+    os.getenv('THUMBNAIL_CACHE_MAX_SIZE', 512 * 1024 * 1024)
+)
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', os.cpu_count() or 2))
+# Most renders queued or running at once, more are answered with 503
+THUMBNAIL_QUEUE_SIZE = int(
+    os.getenv('THUMBNAIL_QUEUE_SIZE', THUMBNAIL_WORKERS * 4)
+)
+# Seconds a request waits for its thumbnail before giving up
+THUMBNAIL_TIMEOUT = 10
+
 AUTH_USER_MODEL = 'core.User'
+
+# Response compression (see core.middleware.CompressionMiddleware)
+
+# Content codings in order of preference
+COMPRESSION_ENCODINGS = os.getenv(
+    'COMPRESSION_ENCODINGS', 'zstd,br,gzip'
+).split(',')
+# Smaller responses aren't worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/msgpack',
+    'application/cbor',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/javascript',
+    'application/javascript',
+    'image/svg+xml',
+)
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Throttling buckets with THROTTLE_BACKEND 'cache'. Point it at a cache
+    # every worker shares for them to cover more than one worker.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+    },
+    # Local to each worker: a revoked token keeps working on the other
+    # workers until AUTH_TOKEN_CACHE_TIMEOUT runs out, so keep that short
+    # unless this is pointed at a cache shared by every worker.
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+    },
+}
+
+# Admin changelists of tables with more rows than this show PostgreSQL's
+# row estimate instead of counting them
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(
+    os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000)
+)
+
+# Most users whose recipe indexes (see recipe.indexes) each worker keeps
+RECIPE_INDEX_MAX_USERS = int(os.getenv('RECIPE_INDEX_MAX_USERS', 1000))
+
+# Filter recipes by tags and ingredients with the in-memory bitmap index
+# instead of joining the through tables
+RECIPE_BITMAP_INDEX = os.getenv('RECIPE_BITMAP_INDEX', '0') == '1'
+
+# Serve recipes from the detail payload stored on each recipe row (see
+# recipe.details). Run refresh_recipe_details after turning it back on.
+RECIPE_DETAIL_CACHE = os.getenv('RECIPE_DETAIL_CACHE', '1') == '1'
+# Most recipes refreshed at once when a tag or ingredient is renamed
+RECIPE_DETAIL_BATCH_SIZE = int(os.getenv('RECIPE_DETAIL_BATCH_SIZE', 500))
+
+# Tags and ingredients every new user starts with. A JSON file with the
+# same keys can be given in STARTER_CATALOGUE_FILE instead.
+STARTER_CATALOGUE = {
+    'tags': [
+        'Breakfast', 'Lunch', 'Dinner', 'Dessert', 'Snack',
+        'Vegetarian', 'Vegan', 'Quick',
+    ],
+    'ingredients': [
+        'Salt', 'Black pepper', 'Olive oil', 'Butter', 'Garlic', 'Onion',
+        'Eggs', 'Milk', 'Flour', 'Sugar', 'Rice', 'Tomatoes',
+    ],
+}
+if os.getenv('STARTER_CATALOGUE_FILE'):
+    with open(os.environ['STARTER_CATALOGUE_FILE']) as catalogue_file:
+        STARTER_CATALOGUE = json.load(catalogue_file)
+
+# Background jobs (see core.jobs)
+
+# Run jobs right away in the thread queueing them instead of batching them
+# in the background
+JOBS_EAGER = os.getenv('JOBS_EAGER', '0') == '1'
+# Seconds the job runner waits for more items before running a batch
+JOBS_INTERVAL = float(os.getenv('JOBS_INTERVAL', 0.5))
+# Most items handed to one call of a job
+JOBS_BATCH_SIZE = int(os.getenv('JOBS_BATCH_SIZE', 500))
+
+# Authentication tokens
+
+AUTH_TOKEN_TTL = timedelta(days=int(os.getenv('AUTH_TOKEN_TTL_DAYS', 30)))
+# Seconds a token lookup is cached, which is also how long a revoked token
+# may keep working on workers other than the one revoking it
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 5))
+AUTH_TOKEN_LAST_USED_INTERVAL = int(
+    os.getenv('AUTH_TOKEN_LAST_USED_INTERVAL', 60)
+)
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+# MessagePack and CBOR are offered next to JSON, see core.renderers
+api_renderers = [
+    'rest_framework.renderers.JSONRenderer',
+    'core.renderers.MessagePackRenderer',
+    'core.renderers.CBORRenderer',
+]
+if not API_ONLY:
+    api_renderers.insert(1, 'rest_framework.renderers.BrowsableAPIRenderer')
+api_parsers = [
+    'rest_framework.parsers.JSONParser',
+    'rest_framework.parsers.FormParser',
+    'rest_framework.parsers.MultiPartParser',
+    'core.renderers.MessagePackParser',
+    'core.renderers.CBORParser',
+]
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': api_renderers,
+    'DEFAULT_PARSER_CLASSES': api_parsers,
+    # Token buckets per client and scope, see core.throttling
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.ReadThrottle',
+        'core.throttling.WriteThrottle',
+        'core.throttling.UploadThrottle',
+        'core.throttling.WorkerThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.getenv('READ_RATE', '1200/min'),
+        'write': os.getenv('WRITE_RATE', '120/min'),
+        'upload': os.getenv('UPLOAD_RATE', '20/min'),
+        'login_ip': os.getenv('LOGIN_IP_RATE', '30/min'),
+        'login_email': os.getenv('LOGIN_EMAIL_RATE', '10/min'),
+        # All clients of a worker together (see core.throttling), off
+        # unless set
+        'worker': os.getenv('WORKER_RATE') or None,
+    },
+}
+
+if API_ONLY:
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = [
+        'core.authentication.ExpiringTokenAuthentication',
+    ]
+
+# Keep throttling buckets in process memory ('local'), or in the
+# THROTTLE_CACHE cache to share them between nodes ('cache')
+THROTTLE_BACKEND = os.getenv('THROTTLE_BACKEND', 'local')
+THROTTLE_CACHE = 'throttle'
@@ -1,10 +1,73 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 
 from core import models
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes the row count of an unfiltered changelist on a
+    big table from PostgreSQL's statistics instead of running COUNT(*)"""
+
+    def estimated_count(self):
+        """Return the planner's row estimate for the listed table,
+        including its partitions, or None if there is none"""
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT SUM(GREATEST(reltuples, 0)) FROM pg_class '
+                'WHERE oid = %s::regclass OR oid IN ('
+                'SELECT inhrelid FROM pg_inherits '
+                'WHERE inhparent = %s::regclass)',
+                [self.object_list.model._meta.db_table] * 2
+            )
+            estimate = cursor.fetchone()[0]
+
+        return None if estimate is None else int(estimate)
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = self.estimated_count()
+            if (estimate is not None and
+                    estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD):
+                return estimate
+
+        return super().count
+
+
+class UserOwnedAdmin(admin.ModelAdmin):
+    """Admin for objects owned by a user, kept cheap on big tables"""
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-id']
+
+
+class TagAdmin(UserOwnedAdmin):
+    list_display = ['name', 'user']
+    search_fields = ['=id', 'name__startswith']
+
+
+class IngredientAdmin(UserOwnedAdmin):
+    list_display = ['name', 'user']
+    search_fields = ['=id', 'name__startswith']
+
+
+class RecipeAdmin(UserOwnedAdmin):
+    list_display = ['title', 'user', 'time_minutes', 'price']
+    search_fields = ['=id', 'title__startswith']
+    autocomplete_fields = ['tags', 'ingredients']
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
@@ -26,6 +89,6 @@ class UserAdmin(BaseUserAdmin):
 
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from core.models import AuthToken
+
+
+def token_cache_key(key):
+    """Return the cache key holding the lookup result for a token"""
+    return f'auth_token:{key}'
+
+
+class LastUsedRecorder:
+    """Collects token usage in memory and writes it out in one batched
+    UPDATE at most once per interval, so authenticating a request doesn't
+    cost a write. Usage recorded since the last flush is lost if the
+    process dies, which only makes `last_used` slightly older."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_flush = None
+
+    def record(self, key):
+        """Remember that a token was used and flush if it is time to"""
+        now = time.monotonic()
+        with self._lock:
+            self._pending.add(key)
+            interval = settings.AUTH_TOKEN_LAST_USED_INTERVAL
+            if (self._last_flush is not None
+                    and now - self._last_flush < interval):
+                return
+            keys, self._pending = self._pending, set()
+            self._last_flush = now
+
+        AuthToken.objects.filter(key__in=keys).update(
+            last_used=timezone.now()
+        )
+
+
+last_used_recorder = LastUsedRecorder()
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """Token authentication for expiring tokens, backed by a cache so
+    authenticating a request usually needs no database query"""
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        cache = caches['tokens']
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            try:
+                token = self.get_model().objects.select_related(
+                    'user'
+                ).get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+            cached = (token.user, token.expires)
+            timeout = min(
+                settings.AUTH_TOKEN_CACHE_TIMEOUT,
+                (token.expires - timezone.now()).total_seconds()
+            )
+            if timeout > 0:
+                cache.set(cache_key, cached, timeout)
+
+        user, expires = cached
+        if expires <= timezone.now():
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+
+        last_used_recorder.record(key)
+        return (user, key)
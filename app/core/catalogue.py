@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import transaction
+
+from core.models import ChangeLogEntry, Ingredient, Tag
+
+STARTER_MODELS = (
+    (Tag, 'tags', ChangeLogEntry.TAG),
+    (Ingredient, 'ingredients', ChangeLogEntry.INGREDIENT),
+)
+
+
+def seed_starter_catalogue(user_ids, skip_existing=False):
+    """Give users the tags and ingredients of settings.STARTER_CATALOGUE,
+    with one insert per table for all of them. With `skip_existing`, names
+    a user already has are left out, so seeding can be run again."""
+    for model, key, kind in STARTER_MODELS:
+        names = list(dict.fromkeys(settings.STARTER_CATALOGUE.get(key, ())))
+        if not names or not user_ids:
+            continue
+
+        existing = set()
+        if skip_existing:
+            existing = set(model.objects.filter(
+                user_id__in=user_ids,
+                name__in=names
+            ).values_list('user_id', 'name'))
+
+        created = model.objects.bulk_create([
+            model(user_id=user_id, name=name)
+            for user_id in user_ids
+            for name in names
+            if (user_id, name) not in existing
+        ])
+        if created and created[0].pk is None:
+            # The database can't return the ids of inserted rows
+            created = [
+                obj for obj in model.objects.filter(
+                    user_id__in=user_ids,
+                    name__in=names
+                ).only('id', 'user_id', 'name')
+                if (obj.user_id, obj.name) not in existing
+            ]
+
+        with transaction.atomic():
+            ChangeLogEntry.objects.lock_users(user_ids)
+            ChangeLogEntry.objects.bulk_create([
+                ChangeLogEntry(
+                    user_id=obj.user_id, kind=kind, object_id=obj.pk
+                )
+                for obj in created
+            ])
@@ -0,0 +1,105 @@
+"""Response body encoders for the content codings clients can negotiate:
+gzip, br and zstd."""
+import zlib
+
+import brotli
+import zstandard
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+
+class GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL
+        ).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+ENCODERS = {
+    'gzip': GzipEncoder,
+    'br': BrotliEncoder,
+    'zstd': ZstdEncoder,
+}
+
+
+def parse_accept_encoding(header):
+    """Return the quality of every coding listed in an Accept-Encoding
+    header"""
+    qualities = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+
+    return qualities
+
+
+def negotiate_encoding(header, preference):
+    """Return the known coding the client accepts best, ties going to
+    the earliest in `preference`, or None"""
+    qualities = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for coding in preference:
+        if coding not in ENCODERS:
+            continue
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+
+    return best
+
+
+def compress(coding, data):
+    """Return data compressed with a coding"""
+    encoder = ENCODERS[coding]()
+    return encoder.compress(data) + encoder.flush()
+
+
+def compress_stream(coding, chunks):
+    """Yield the compressed form of a stream of chunks, sending output as
+    soon as the encoder has any"""
+    encoder = ENCODERS[coding]()
+    for chunk in chunks:
+        data = encoder.compress(chunk)
+        if data:
+            yield data
+    yield encoder.flush()
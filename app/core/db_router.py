@@ -0,0 +1,30 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Whether reads must go to the primary database. Anything running outside
+# a request (commands, jobs) stays on the primary.
+use_primary = ContextVar('use_primary', default=True)
+
+
+class PrimaryReplicaRouter:
+    """Send writes to the primary database and spread reads over the
+    replicas, unless the current request is pinned to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if use_primary.get() or not settings.DATABASE_REPLICAS:
+            return 'default'
+
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Replicas hold the same data, so any relation is fine"""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Replicas get their schema from the primary"""
+        return db == 'default'
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, BCryptSHA256PasswordHasher, make_password
+)
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2 hasher with cost parameters taken from settings"""
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARALLELISM
+
+
+class TunedBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    """BCrypt hasher with the number of rounds taken from settings"""
+
+    @property
+    def rounds(self):
+        return settings.BCRYPT_ROUNDS
+
+
+class HashingBusy(Exception):
+    """Raised when no password hashing slot frees up in time"""
+
+
+_slots_lock = threading.Lock()
+_slots = None
+
+
+def _get_slots():
+    """Return the semaphore bounding concurrent password hashing"""
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(
+                settings.PASSWORD_HASHING_CONCURRENCY
+            )
+        return _slots
+
+
+@contextmanager
+def hashing_slot():
+    """Hold one of the limited password hashing slots"""
+    slots = _get_slots()
+    if not slots.acquire(timeout=settings.PASSWORD_HASHING_TIMEOUT):
+        raise HashingBusy()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    """Return the thread pool new passwords are hashed on"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_CONCURRENCY,
+                thread_name_prefix='password-hashing'
+            )
+        return _pool
+
+
+def hash_password(password):
+    """Hash a new password on the bounded hashing pool. The hashers release
+    the GIL, so the hashing itself runs in parallel with other requests,
+    while sharing its limit with the logins checking passwords.
+
+    A slot is taken before the password is handed to the pool, so at most
+    PASSWORD_HASHING_CONCURRENCY hashes are ever queued and every one of
+    them starts right away. Only the wait for a slot times out: a hash
+    that started can't be stopped, so its result is always waited for."""
+    slots = _get_slots()
+    if not slots.acquire(timeout=settings.PASSWORD_HASHING_TIMEOUT):
+        raise HashingBusy()
+    try:
+        future = _get_pool().submit(make_password, password)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda future: slots.release())
+
+    return future.result()
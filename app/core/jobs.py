@@ -0,0 +1,80 @@
+"""Local runner for work that can happen after a response is sent.
+
+Jobs are queued in memory and run by a worker thread per process. A job
+function is called with a list of all the items queued for it since it last
+ran, so the work of many requests can be done with a few statements (for
+example one INSERT for all the users who just signed up). Queued items are
+lost if the process dies, so jobs must be safe to miss or to redo later.
+
+With JOBS_EAGER set, jobs run right away in the thread queueing them.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """Batches queued items per job function and runs them in the
+    background"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def enqueue(self, job, item):
+        """Queue an item for a job function"""
+        if settings.JOBS_EAGER:
+            self._run(job, [item])
+            return
+
+        with self._lock:
+            self._pending.setdefault(job, []).append(item)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._work,
+                    name='job-runner',
+                    daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def enqueue_on_commit(self, job, item):
+        """Queue an item for a job function once the current transaction
+        commits, so the job sees its data"""
+        transaction.on_commit(lambda: self.enqueue(job, item))
+
+    def flush(self):
+        """Run everything queued so far in the calling thread"""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+
+        for job, items in pending.items():
+            for start in range(0, len(items), settings.JOBS_BATCH_SIZE):
+                self._run(job, items[start:start + settings.JOBS_BATCH_SIZE])
+
+    def _run(self, job, items):
+        try:
+            job(items)
+        except Exception:
+            logger.exception('Job %s failed for %d items',
+                             job.__name__, len(items))
+
+    def _work(self):
+        while True:
+            self._wakeup.wait()
+            # Let a batch build up before running it
+            self._wakeup.clear()
+            time.sleep(settings.JOBS_INTERVAL)
+            close_old_connections()
+            self.flush()
+
+
+runner = JobRunner()
@@ -0,0 +1,70 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from rest_framework.renderers import JSONRenderer
+
+from core import renderers
+
+
+def sample_recipes(count):
+    """Return a recipe list payload shaped like the API's detail output"""
+    return [
+        {
+            'id': recipe_id,
+            'title': f'Recipe number {recipe_id}',
+            'ingredients': [
+                {'id': ingredient_id, 'name': f'Ingredient {ingredient_id}'}
+                for ingredient_id in range(recipe_id % 50, recipe_id % 50 + 8)
+            ],
+            'tags': [
+                {'id': tag_id, 'name': f'Tag {tag_id}'}
+                for tag_id in range(recipe_id % 20, recipe_id % 20 + 4)
+            ],
+            'time_minutes': 5 + recipe_id % 60,
+            'price': f'{recipe_id % 40}.50',
+            'link': f'https://example.com/recipes/{recipe_id}',
+        }
+        for recipe_id in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    """Django command comparing the size and the encode and decode time of
+    a recipe list in every available API format"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def measure(self, function, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = function()
+        return result, (time.perf_counter() - start) / repeat * 1000
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        data = sample_recipes(options['recipes'])
+        formats = [
+            ('json', JSONRenderer(), json.loads),
+            (
+                'msgpack',
+                renderers.MessagePackRenderer(),
+                lambda body: renderers.msgpack.unpackb(body, raw=False)
+            ),
+            ('cbor', renderers.CBORRenderer(), renderers.cbor2.loads),
+        ]
+
+        for name, renderer, decode in formats:
+            body, encode_ms = self.measure(
+                lambda: renderer.render(data), options['repeat']
+            )
+            _, decode_ms = self.measure(
+                lambda: decode(body), options['repeat']
+            )
+            self.stdout.write(
+                f'{name:8} {len(body):>9} bytes  '
+                f'encode {encode_ms:7.2f}ms  decode {decode_ms:7.2f}ms'
+            )
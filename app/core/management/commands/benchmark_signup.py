@@ -0,0 +1,65 @@
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of the sorted values fall"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    """Django command to measure signup latency and throughput of a running
+    server under concurrent load. Every request creates a new user."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+
+    def signup(self, url, run):
+        body = json.dumps({
+            'email': f'benchmark-{run}-{uuid.uuid4().hex}@example.com',
+            'password': uuid.uuid4().hex,
+            'name': 'Benchmark',
+        }).encode()
+        request = Request(
+            url, data=body, headers={'Content-Type': 'application/json'}
+        )
+        start = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+
+        return status, time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        url = options['url'].rstrip('/') + '/api/user/create/'
+        run = uuid.uuid4().hex[:8]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(
+                lambda _: self.signup(url, run), range(options['requests'])
+            ))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for _, latency in results)
+        failed = sum(1 for status, _ in results if status != 201)
+        self.stdout.write(
+            f'{len(results)} signups in {elapsed:.2f}s '
+            f'({len(results) / elapsed:.1f}/s), {failed} failed'
+        )
+        self.stdout.write(
+            'latency p50 {:.0f}ms, p95 {:.0f}ms, p99 {:.0f}ms'.format(
+                *(percentile(latencies, fraction) * 1000
+                  for fraction in (0.5, 0.95, 0.99))
+            )
+        )
@@ -0,0 +1,69 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Run in a fresh interpreter: time setting Django up and loading the URLs
+# and the WSGI handler, then the cost of a request that does not touch the
+# database (an unauthenticated API call).
+PROBE = '''
+import json
+import logging
+import time
+start = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.urls import get_resolver
+get_wsgi_application()
+get_resolver().url_patterns
+startup = time.perf_counter() - start
+logging.disable(logging.WARNING)
+client = Client(HTTP_HOST='localhost')
+client.get('/api/recipe/tags/')
+start = time.perf_counter()
+for _ in range({requests}):
+    client.get('/api/recipe/tags/')
+per_request = (time.perf_counter() - start) / {requests}
+print(json.dumps([startup, per_request]))
+'''
+
+
+class Command(BaseCommand):
+    """Django command comparing startup time and per request overhead of
+    the full settings profile and the API_ONLY one"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=500)
+
+    def probe(self, api_only, requests):
+        env = dict(os.environ, API_ONLY='1' if api_only else '0')
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE.format(requests=requests)],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True
+        ).stdout
+        return json.loads(output.decode().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        for api_only in (False, True):
+            runs = [self.probe(api_only, options['requests'])
+                    for _ in range(options['runs'])]
+            startup = statistics.median(run[0] for run in runs)
+            per_request = statistics.median(run[1] for run in runs)
+            self.stdout.write(
+                '{:9} startup {:6.0f}ms  per request {:6.0f}us'.format(
+                    'api only' if api_only else 'full',
+                    startup * 1000,
+                    per_request * 1000000
+                )
+            )
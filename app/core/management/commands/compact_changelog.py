@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, Max, OuterRef
+
+from core.models import ChangeLogEntry
+
+
+class Command(BaseCommand):
+    """Django command to delete change log entries superseded by a later
+    entry for the same object"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        batch_size = options['batch_size']
+        last_id = ChangeLogEntry.objects.aggregate(last=Max('id'))['last']
+        superseded = Exists(ChangeLogEntry.objects.filter(
+            user=OuterRef('user'),
+            kind=OuterRef('kind'),
+            object_id=OuterRef('object_id'),
+            id__gt=OuterRef('id')
+        ))
+        removed = 0
+        start = 0
+        while last_id is not None and start <= last_id:
+            removed += ChangeLogEntry.objects.filter(
+                superseded,
+                id__gt=start,
+                id__lte=start + batch_size
+            ).delete()[0]
+            start += batch_size
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Removed {removed} superseded entries')
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import AuthToken
+
+
+class Command(BaseCommand):
+    """Django command to delete authentication tokens that have expired"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        now = timezone.now()
+        removed = 0
+        while True:
+            ids = list(
+                AuthToken.objects.filter(expires__lte=now).values_list(
+                    'id', flat=True
+                )[:options['batch_size']]
+            )
+            if not ids:
+                break
+            removed += AuthToken.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Removed {removed} expired tokens')
+        )
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.utils import NotSupportedError
+
+from core import partitioning
+
+
+class Command(BaseCommand):
+    """Django command to move the recipe, tag and ingredient tables to
+    tables hash partitioned by user, copying existing rows in batches
+    while the application keeps writing"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            default=settings.CORE_TABLE_PARTITIONS or 16
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches'
+        )
+        parser.add_argument(
+            '--no-swap',
+            action='store_true',
+            help='Copy the data but keep using the current tables'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Print the SQL instead of running it'
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only look for links to missing rows, which the dropped '
+                 'foreign keys no longer prevent'
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        if options['dry_run']:
+            for model in partitioning.PARTITIONED_MODELS:
+                self._print_sql(model, options['partitions'])
+            return
+
+        if options['check']:
+            self._check()
+            return
+
+        try:
+            partitioning.check_support(connection)
+        except NotSupportedError as exc:
+            raise CommandError(str(exc))
+
+        for model in partitioning.PARTITIONED_MODELS:
+            partitioning.partition_model(
+                model,
+                options['partitions'],
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                swap=not options['no_swap'],
+                log=self.stdout.write
+            )
+
+        self.stdout.write(self.style.SUCCESS('Tables partitioned'))
+        if not options['no_swap']:
+            self._check()
+
+    def _check(self):
+        """Report references to missing rows of the partitioned tables"""
+        with connection.cursor() as cursor:
+            dangling = partitioning.dangling_references(cursor)
+        for table, column, count in dangling:
+            self.stderr.write(
+                f'{table}.{column}: {count} rows point at missing rows'
+            )
+        if dangling:
+            raise CommandError('Found references to missing rows')
+
+        self.stdout.write(self.style.SUCCESS('No references to missing rows'))
+
+    def _print_sql(self, model, partitions):
+        """Print the statements used to partition a model's table"""
+        table = model._meta.db_table
+        statements = partitioning.prepare_sql(model, partitions)
+        statements.append(partitioning.backfill_sql(model))
+        statements += partitioning.swap_sql(
+            model,
+            [('<referencing table>', f'<foreign key to {table}>')]
+        )
+        for statement in statements:
+            self.stdout.write(f'{statement};')
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.reaper import reap_deleted_files
+
+
+class Command(BaseCommand):
+    """Django command to delete stored files queued for deletion"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running, polling the queue every --interval seconds'
+        )
+        parser.add_argument('--interval', type=float, default=10)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        while True:
+            total = 0
+            reaped = reap_deleted_files(options['batch_size'])
+            while reaped:
+                total += reaped
+                reaped = reap_deleted_files(options['batch_size'])
+
+            if total:
+                self.stdout.write(f'Reaped {total} queued files')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
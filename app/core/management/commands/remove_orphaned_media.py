@@ -0,0 +1,56 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Recipe
+from core.storage import get_recipe_image_storage
+
+RECIPE_IMAGE_DIR = 'uploads/recipe'
+
+
+class Command(BaseCommand):
+    """Django command to delete recipe image files no recipe refers to"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Only delete files older than this many seconds, so '
+                 'uploads that are not committed yet are left alone'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        storage = get_recipe_image_storage()
+        try:
+            filenames = storage.listdir(RECIPE_IMAGE_DIR)[1]
+        except FileNotFoundError:
+            return
+
+        referenced = set(
+            Recipe.objects.exclude(image='').exclude(
+                image__isnull=True
+            ).values_list('image', flat=True).iterator()
+        )
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        removed = 0
+        for filename in filenames:
+            name = posixpath.join(RECIPE_IMAGE_DIR, filename)
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) > cutoff:
+                continue
+
+            removed += 1
+            if options['dry_run']:
+                self.stdout.write(f'Would remove {name}')
+            else:
+                storage.delete(name)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{removed} orphaned files found')
+        )
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from core.catalogue import seed_starter_catalogue
+
+
+class Command(BaseCommand):
+    """Django command to give existing users the starter tags and
+    ingredients they are missing"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        batch_size = options['batch_size']
+        users = get_user_model().objects.order_by('id')
+        last_id = users.aggregate(last=Max('id'))['last']
+        seeded = 0
+        start = 0
+        while last_id is not None and start < last_id:
+            user_ids = list(users.filter(
+                id__gt=start,
+                id__lte=start + batch_size
+            ).values_list('id', flat=True))
+            with transaction.atomic():
+                seed_starter_catalogue(user_ids, skip_existing=True)
+            seeded += len(user_ids)
+            start += batch_size
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Seeded the catalogue of {seeded} users')
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.throttling import rejection_counts
+
+
+class Command(BaseCommand):
+    """Django command to show the requests rejected per throttle scope by
+    every worker"""
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        for scope, count in rejection_counts().items():
+            self.stdout.write(f'{scope}: {count}')
@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.cache import patch_vary_headers
+
+from core.compression import compress, compress_stream, negotiate_encoding
+from core.db_router import use_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'pin_primary'
+PIN_HEADER = 'X-Primary-Pin'
+PIN_SALT = 'core.middleware.pin'
+
+
+def is_pinned(request):
+    """Return whether a request carries a valid pin, as a cookie or a
+    header, issued less than REPLICA_PIN_SECONDS ago"""
+    if request.get_signed_cookie(
+            PIN_COOKIE,
+            default=None,
+            salt=PIN_SALT,
+            max_age=settings.REPLICA_PIN_SECONDS) is not None:
+        return True
+
+    pin = request.headers.get(PIN_HEADER)
+    if not pin:
+        return False
+    try:
+        signing.TimestampSigner(salt=PIN_SALT).unsign(
+            pin, max_age=settings.REPLICA_PIN_SECONDS
+        )
+    except signing.BadSignature:
+        return False
+
+    return True
+
+
+class ReplicaRoutingMiddleware:
+    """Let safe requests read from the database replicas, except for
+    clients that wrote recently. Every write, logging in and signing up
+    included, answers with a signed pin keeping the client on the primary
+    for REPLICA_PIN_SECONDS, so it reads its own writes whichever worker
+    serves it next. The pin comes as a cookie, for browsers, and as the
+    X-Primary-Pin header, for API clients that don't keep cookies: they
+    send the header back as they got it. The pin is time stamped when
+    signed, so it ends on time even for clients ignoring the cookie's max
+    age or holding on to the header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        writing = request.method not in SAFE_METHODS
+        reset_token = use_primary.set(writing or is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_primary.reset(reset_token)
+
+        if writing:
+            response.set_signed_cookie(
+                PIN_COOKIE,
+                '1',
+                salt=PIN_SALT,
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+            response[PIN_HEADER] = signing.TimestampSigner(
+                salt=PIN_SALT
+            ).sign('1')
+
+        return response
+
+
+class CompressionMiddleware:
+    """Compress text responses with the best coding the client accepts
+    (see core.compression), streaming responses included.
+
+    Responses to requests carrying the session cookie are left alone:
+    those are authenticated by an ambient credential, so a cross-site page
+    could mix guessed secrets into them and watch the compressed size
+    (BREACH). Token authenticated API requests can't be forged that way."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_compress(self, request, response):
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+        if response.status_code in (204, 206, 304):
+            return False
+        if response.has_header('Content-Encoding'):
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+
+        content_type = response.get('Content-Type', '').split(';')[0]
+        return content_type.strip().lower() in settings.COMPRESSIBLE_TYPES
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.should_compress(request, response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''),
+            settings.COMPRESSION_ENCODINGS
+        )
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                coding, response.streaming_content
+            )
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress(coding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The encoded body is no longer byte for byte the tagged one
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coding
+
+        return response
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.12 on 2026-10-19 08:17
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_authtoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.get_recipe_image_storage, upload_to=core.models.recipe_image_file_path),
+        ),
+    ]
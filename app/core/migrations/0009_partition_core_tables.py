@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_core_tables(apps, schema_editor):
+    """Partition the per-user tables when CORE_TABLE_PARTITIONS is set"""
+    if (schema_editor.connection.vendor != 'postgresql' or
+            not settings.CORE_TABLE_PARTITIONS):
+        return
+
+    from core.partitioning import check_support, partition_model
+
+    # Fail before touching anything on servers without hash partitioning
+    check_support(schema_editor.connection)
+    for model_name in ('Tag', 'Ingredient', 'Recipe'):
+        partition_model(
+            apps.get_model('core', model_name),
+            settings.CORE_TABLE_PARTITIONS
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_changelogentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            partition_core_tables,
+            migrations.RunPython.noop
+        ),
+    ]
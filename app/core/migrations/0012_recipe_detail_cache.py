@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-19 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='detail_cache',
+            field=models.JSONField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-19 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_recipe_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipe_index_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
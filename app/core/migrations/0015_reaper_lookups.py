@@ -0,0 +1,23 @@
+# Generated by Django 3.2.12 on 2026-10-19 10:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_user_recipe_index_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingfiledeletion',
+            name='due',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['image'], name='recipe_image_idx'),
+        ),
+    ]
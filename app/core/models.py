@@ -1,19 +1,41 @@
+import hashlib
 import os
-import uuid
+import secrets
 
 from django.conf import settings
-from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin
 )
+from django.db import models, transaction
+from django.utils import timezone
+
+from core.hashers import hash_password
+from core.storage import get_recipe_image_storage
+
+
+def recipe_image_name(sha256, ext):
+    """Return the stored name of a recipe image with the given content
+    hash and extension"""
+    return os.path.join('uploads/recipe/', f'{sha256}.{ext}')
 
 
 def recipe_image_file_path(instance, filename):
-    """Generate file path for new recipe image"""
-    ext = filename.split('.')[-1]
-    filename = f'{uuid.uuid4()}.{ext}'
+    """Generate file path for new recipe image from a hash of its content,
+    so the same image is only stored once"""
+    ext = filename.split('.')[-1].lower()
+    digest = hashlib.sha256()
+    for chunk in instance.image.file.chunks():
+        digest.update(chunk)
+    instance.image.file.seek(0)
+
+    return recipe_image_name(digest.hexdigest(), ext)
 
-    return os.path.join('uploads/recipe/', filename)
+
+# Recipe columns holding facts extracted from its image
+IMAGE_METADATA_FIELDS = (
+    'image_width', 'image_height', 'image_format', 'image_color',
+    'image_hash',
+)
 
 
 class UserManager(BaseUserManager):
@@ -22,7 +44,10 @@ class UserManager(BaseUserManager):
         if not email:
             raise ValueError('Users must have an email address')
         user = self.model(email=self.normalize_email(email), **kwargs)
-        user.set_password(password)
+        if password is None:
+            user.set_unusable_password()
+        else:
+            user.password = hash_password(password)
         user.save(using=self._db)
 
         return user
@@ -43,12 +68,82 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Bumped with every change to the links of the user's recipes, so each
+    # process can tell its copy of the recipe indexes is stale
+    recipe_index_version = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
+class AuthTokenManager(models.Manager):
+    def get_or_create_token(self, user, device=''):
+        """Return the user's valid token for a device, issuing a new one
+        if there is none"""
+        token = self.filter(
+            user=user,
+            device=device,
+            expires__gt=timezone.now()
+        ).order_by('-expires').first()
+        if token is None:
+            token = self.create(
+                key=secrets.token_hex(20),
+                user=user,
+                device=device,
+                expires=timezone.now() + settings.AUTH_TOKEN_TTL
+            )
+
+        return token
+
+    def issue_missing(self, user_ids, device=''):
+        """Issue a token for a device to every one of the users who has no
+        valid one yet, with a single insert"""
+        has_token = set(self.filter(
+            user_id__in=user_ids,
+            device=device,
+            expires__gt=timezone.now()
+        ).values_list('user_id', flat=True))
+        expires = timezone.now() + settings.AUTH_TOKEN_TTL
+
+        return self.bulk_create([
+            self.model(
+                key=secrets.token_hex(20),
+                user_id=user_id,
+                device=device,
+                expires=expires
+            )
+            for user_id in dict.fromkeys(user_ids)
+            if user_id not in has_token
+        ])
+
+
+class AuthToken(models.Model):
+    """Expiring authentication token issued to a user for one device"""
+    key = models.CharField(max_length=40, unique=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='auth_tokens',
+        on_delete=models.CASCADE
+    )
+    device = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+    last_used = models.DateTimeField(null=True)
+
+    objects = AuthTokenManager()
+
+    def __str__(self):
+        return self.key
+
+    @property
+    def is_expired(self):
+        return self.expires <= timezone.now()
+
+
 class Tag(models.Model):
     """Tag to be used for a recipe"""
     name = models.CharField(max_length=255)
@@ -59,6 +154,16 @@ class Tag(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            # Serves the case sensitive prefix search of the admin
+            models.Index(
+                fields=['name'],
+                name='tag_name_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -73,6 +178,16 @@ class Ingredient(models.Model):
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            # Serves the case sensitive prefix search of the admin
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -89,12 +204,176 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=get_recipe_image_storage
+    )
+    # Facts about the image, extracted in the background by recipe.jobs
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_format = models.CharField(max_length=10, blank=True, editable=False)
+    # Dominant color as #rrggbb
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
+    # Perceptual difference hash (dHash) as 16 hex digits
+    image_hash = models.CharField(max_length=16, blank=True, editable=False)
+    # Ready to serve detail payload, maintained by recipe.details
+    detail_cache = models.JSONField(null=True, editable=False)
 
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'id'],
+                name='recipe_user_id_idx'
+            ),
+            models.Index(
+                fields=['user', 'time_minutes', 'id'],
+                name='recipe_user_time_id_idx'
+            ),
+            models.Index(
+                fields=['user', 'price', 'id'],
+                name='recipe_user_price_id_idx'
+            ),
+            models.Index(
+                fields=['user', 'image_hash'],
+                name='recipe_user_image_hash_idx'
+            ),
+            # Serves the reaper looking up which queued files are in use
+            models.Index(fields=['image'], name='recipe_image_idx'),
+            # Serves the case sensitive prefix search of the admin
+            models.Index(
+                fields=['title'],
+                name='recipe_title_like_idx',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
+    def clear_image_metadata(self):
+        """Forget the facts extracted from the current image, without
+        saving"""
+        self.image_width = self.image_height = None
+        self.image_format = self.image_color = self.image_hash = ''
+
+    def set_image(self, name):
+        """Point the recipe at an already stored image and queue the file
+        it replaces for deletion"""
+        old_name = self.image.name
+        if old_name == name:
+            return
+
+        with transaction.atomic():
+            self.image = name
+            self.clear_image_metadata()
+            self.save(update_fields=['image', *IMAGE_METADATA_FIELDS])
+            if old_name:
+                PendingFileDeletion.objects.create(name=old_name)
+
+    def delete_image(self):
+        """Remove the image from the recipe and queue its file for
+        deletion"""
+        name = self.image.name
+        if not name:
+            return
+
+        with transaction.atomic():
+            self.image = None
+            self.clear_image_metadata()
+            self.save(update_fields=['image', *IMAGE_METADATA_FIELDS])
+            PendingFileDeletion.objects.create(name=name)
+
     def get_absolute_url(self):
         return "/recipes/{}/".format(self.id)
+
+
+class PendingFileDeletion(models.Model):
+    """Stored file that lost its reference and waits to be deleted.
+    Rows are written in the same transaction that drops the reference, so
+    the reaper only ever sees them once that transaction committed."""
+    name = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    # The reaper leaves the row alone until then
+    due = models.DateTimeField(default=timezone.now)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.name
+
+
+class ThrottleRejection(models.Model):
+    """Requests a throttle scope rejected, counted by every worker"""
+    scope = models.CharField(max_length=50, unique=True)
+    count = models.PositiveBigIntegerField(default=0)
+
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'{self.scope}: {self.count}'
+
+
+class ChangeLogManager(models.Manager):
+    def lock_users(self, user_ids):
+        """Lock the rows of users until the current transaction ends,
+        before writing change log entries for them"""
+        list(User.objects.select_for_update(no_key=True).filter(
+            id__in=user_ids
+        ).order_by('id').values_list('id', flat=True))
+
+    def record(self, user_id, kind, object_ids, deleted=False):
+        """Record that objects of a kind changed or were deleted"""
+        entries = [
+            self.model(
+                user_id=user_id,
+                kind=kind,
+                object_id=object_id,
+                deleted=deleted
+            )
+            for object_id in object_ids
+        ]
+        if not entries:
+            return
+
+        with transaction.atomic():
+            self.lock_users([user_id])
+            self.bulk_create(entries)
+
+
+class ChangeLogEntry(models.Model):
+    """Change to one of a user's objects, read by the incremental sync.
+    The id of the latest entry a client has seen is its sync position.
+    Entries are only written holding a lock on the user's row (see
+    ChangeLogManager.lock_users), so a user's entries commit in id order
+    and no entry below a position can still appear after it was read.
+    Deletions are kept as tombstones."""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    objects = ChangeLogManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'kind', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
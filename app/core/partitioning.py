@@ -0,0 +1,271 @@
+"""Hash partitioning of the per-user core tables by user_id (PostgreSQL).
+
+A table is converted in three steps, so existing data can be moved while
+the application keeps running:
+
+1. prepare: create `<table>_part`, partitioned by hash of user_id, with
+   every index of the model under a temporary name, and a trigger
+   mirroring every write on the live table into it.
+2. backfill: copy the existing rows over in id ranges.
+3. swap: rename the tables and their indexes in one short transaction and
+   drop the mirror.
+
+The many-to-many tables have no user_id column, so they stay as they are.
+Their foreign keys to the partitioned tables are dropped on swap, because
+PostgreSQL can only reference the full (id, user_id) key of a partitioned
+table. Django already performs the cascades itself, but nothing stops a
+raw query from leaving links to missing rows any more: check for them
+with dangling_references (`partition_core_tables --check`).
+
+A query filtering on user_id reads a single partition. One filtering on
+the id alone, like the UPDATE of Model.save() or a bulk_update(), probes
+the index of every partition instead, so hot paths that know the user
+pass user_id along.
+
+Hash partitioning needs PostgreSQL 11 or later.
+"""
+import time
+
+from django.db import connection, transaction
+from django.db.utils import NotSupportedError
+
+from core.models import Ingredient, Recipe, Tag
+
+PARTITIONED_MODELS = (Tag, Ingredient, Recipe)
+MIN_POSTGRESQL_VERSION = 110000
+# Longest identifier PostgreSQL keeps
+MAX_NAME_LENGTH = 63
+
+
+def check_support(connection):
+    """Raise NotSupportedError unless the database can hash partition
+    tables"""
+    if connection.vendor != 'postgresql':
+        raise NotSupportedError('Table partitioning requires PostgreSQL')
+    if connection.pg_version < MIN_POSTGRESQL_VERSION:
+        raise NotSupportedError(
+            'Hash partitioning requires PostgreSQL 11 or later, the '
+            f'database runs {connection.pg_version}'
+        )
+
+
+def shadow_table(table):
+    return f'{table}_part'
+
+
+def old_table(table):
+    return f'{table}_unpartitioned'
+
+
+def shadow_index(name):
+    return f'{name[:MAX_NAME_LENGTH - 5]}_part'
+
+
+def old_index(name):
+    return f'{name[:MAX_NAME_LENGTH - 14]}_unpartitioned'
+
+
+def model_indexes(model):
+    """Return (name, statement) for every index Django creates for a model
+    besides its primary key: field indexes with their pattern ops variants
+    and Meta.indexes. Each statement creates the index on the partitioned
+    copy, under its temporary name."""
+    table = model._meta.db_table
+    editor = connection.schema_editor()
+    indexes = []
+    for statement in editor._model_indexes_sql(model):
+        name = str(statement.parts['name']).strip('"')
+        statement.parts['name'] = editor.quote_name(shadow_index(name))
+        statement.rename_table_references(table, shadow_table(table))
+        indexes.append((name, str(statement)))
+
+    return indexes
+
+
+def prepare_sql(model, partitions):
+    """Return the statements creating the partitioned copy of a model's
+    table and the trigger keeping it in sync"""
+    table = model._meta.db_table
+    shadow = shadow_table(table)
+    user_table = model._meta.get_field('user').related_model._meta.db_table
+    # The mirrored row wins over a copy the backfill wrote concurrently
+    updates = ', '.join(
+        f'"{field.column}" = EXCLUDED."{field.column}"'
+        for field in model._meta.local_concrete_fields
+        if field.column not in ('id', 'user_id')
+    )
+    statements = [
+        f'CREATE TABLE "{shadow}" (LIKE "{table}" INCLUDING DEFAULTS '
+        f'INCLUDING CONSTRAINTS) PARTITION BY HASH ("user_id")',
+        f'ALTER TABLE "{shadow}" ADD PRIMARY KEY ("id", "user_id")',
+        f'CREATE INDEX "{shadow}_user_id_id" ON "{shadow}" '
+        f'("user_id", "id")',
+        f'ALTER TABLE "{shadow}" ADD FOREIGN KEY ("user_id") '
+        f'REFERENCES "{user_table}" ("id") DEFERRABLE INITIALLY DEFERRED',
+    ]
+    statements += [statement for _, statement in model_indexes(model)]
+    statements += [
+        f'CREATE TABLE "{table}_p{remainder}" PARTITION OF "{shadow}" '
+        f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        for remainder in range(partitions)
+    ]
+    statements += [
+        f'''CREATE FUNCTION "{table}_mirror"() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM "{shadow}"
+        WHERE "id" = OLD."id" AND "user_id" = OLD."user_id";
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    INSERT INTO "{shadow}" SELECT NEW.*
+    ON CONFLICT ("id", "user_id") DO UPDATE SET {updates};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql''',
+        f'CREATE TRIGGER "{table}_mirror" AFTER INSERT OR UPDATE OR DELETE '
+        f'ON "{table}" FOR EACH ROW EXECUTE PROCEDURE "{table}_mirror"()',
+    ]
+
+    return statements
+
+
+def backfill_sql(model):
+    """Return the statement copying one id range, taking the lower
+    (exclusive) and upper (inclusive) bounds as parameters"""
+    table = model._meta.db_table
+    return (
+        f'INSERT INTO "{shadow_table(table)}" SELECT * FROM "{table}" '
+        f'WHERE "id" > %s AND "id" <= %s ON CONFLICT DO NOTHING'
+    )
+
+
+def swap_sql(model, referencing_keys):
+    """Return the statements replacing a table by its partitioned copy.
+    `referencing_keys` lists (table, constraint) foreign keys pointing at
+    the table."""
+    table = model._meta.db_table
+    shadow = shadow_table(table)
+    statements = [f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE']
+    statements += [
+        f'ALTER TABLE "{referencing}" DROP CONSTRAINT "{constraint}"'
+        for referencing, constraint in referencing_keys
+    ]
+    statements += [
+        f'DROP TRIGGER "{table}_mirror" ON "{table}"',
+        f'DROP FUNCTION "{table}_mirror"()',
+        f'ALTER TABLE "{table}" RENAME TO "{old_table(table)}"',
+        f'ALTER TABLE "{shadow}" RENAME TO "{table}"',
+        f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}"."id"',
+    ]
+    for name, _ in model_indexes(model):
+        statements += [
+            f'ALTER INDEX "{name}" RENAME TO "{old_index(name)}"',
+            f'ALTER INDEX "{shadow_index(name)}" RENAME TO "{name}"',
+        ]
+
+    return statements
+
+
+def is_partitioned(cursor, table):
+    """Return whether a table is already partitioned"""
+    cursor.execute(
+        "SELECT c.relkind = 'p' FROM pg_class c "
+        "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+        [table]
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def is_prepared(cursor, table):
+    """Return whether the partitioned copy of a table exists"""
+    return is_partitioned(cursor, shadow_table(table))
+
+
+def referencing_foreign_keys(cursor, table):
+    """Return the (table, constraint) foreign keys pointing at a table"""
+    cursor.execute(
+        'SELECT conrelid::regclass::text, conname FROM pg_constraint '
+        "WHERE contype = 'f' AND confrelid = %s::regclass",
+        [table]
+    )
+    return [(name.strip('"'), constraint)
+            for name, constraint in cursor.fetchall()]
+
+
+def referencing_columns(model):
+    """Return the (table, column) foreign keys of unpartitioned tables
+    pointing at a model's table, whose constraints are dropped on swap"""
+    return [
+        (relation.related_model._meta.db_table, relation.field.column)
+        for relation in model._meta.get_fields(include_hidden=True)
+        if relation.auto_created and not relation.concrete and
+        (relation.one_to_many or relation.one_to_one) and
+        relation.related_model not in PARTITIONED_MODELS
+    ]
+
+
+def dangling_references(cursor):
+    """Return (table, column, count) for the references into partitioned
+    tables that point at rows which don't exist"""
+    found = []
+    for model in PARTITIONED_MODELS:
+        table = model._meta.db_table
+        for referencing, column in referencing_columns(model):
+            cursor.execute(
+                f'SELECT COUNT(*) FROM "{referencing}" r WHERE NOT EXISTS '
+                f'(SELECT 1 FROM "{table}" t WHERE t."id" = r."{column}")'
+            )
+            count = cursor.fetchone()[0]
+            if count:
+                found.append((referencing, column, count))
+
+    return found
+
+
+def id_bounds(cursor, table):
+    """Return the lowest and highest id in a table"""
+    cursor.execute(f'SELECT MIN("id"), MAX("id") FROM "{table}"')
+    return cursor.fetchone()
+
+
+def partition_model(model, partitions, batch_size=10000, pause=0,
+                    swap=True, log=None):
+    """Move a model's table to a hash partitioned table, resuming from
+    whichever step was reached before"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return
+
+        if not is_prepared(cursor, table):
+            with transaction.atomic():
+                for statement in prepare_sql(model, partitions):
+                    cursor.execute(statement)
+
+        low, high = id_bounds(cursor, table)
+        start = (low or 0) - 1
+        while high is not None and start < high:
+            with transaction.atomic():
+                cursor.execute(
+                    backfill_sql(model),
+                    [start, start + batch_size]
+                )
+            start += batch_size
+            if log:
+                log(f'{table}: copied ids up to {min(start, high)} of {high}')
+            time.sleep(pause)
+
+        if swap:
+            with transaction.atomic():
+                keys = referencing_foreign_keys(cursor, table)
+                for statement in swap_sql(model, keys):
+                    cursor.execute(statement)
+            if log:
+                for referencing, constraint in keys:
+                    log(
+                        f'{table}: dropped foreign key {constraint} of '
+                        f'{referencing}'
+                    )
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import PendingFileDeletion, Recipe
+from core.storage import get_recipe_image_storage
+
+
+def reap_deleted_files(batch_size=100):
+    """Delete one batch of queued files that no recipe uses any more and
+    return the number of queue entries processed.
+
+    Files modified in the last FILE_REAPER_MIN_AGE seconds are kept: an
+    upload reusing a stored file touches it before its recipe commits, so
+    such a file may be referenced again any moment. Their entries stay
+    queued, due once the file is old enough."""
+    storage = get_recipe_image_storage()
+    now = timezone.now()
+    min_age = timedelta(seconds=settings.FILE_REAPER_MIN_AGE)
+    with transaction.atomic():
+        pending = list(
+            PendingFileDeletion.objects.select_for_update(
+                skip_locked=True
+            ).filter(due__lte=now).order_by('id')[:batch_size]
+        )
+        if not pending:
+            return 0
+
+        names = {entry.name for entry in pending}
+        in_use = set(
+            Recipe.objects.filter(image__in=names).values_list(
+                'image', flat=True
+            )
+        )
+        postponed = {}
+        for name in names - in_use:
+            try:
+                modified = storage.get_modified_time(name)
+            except FileNotFoundError:
+                continue
+            if modified > now - min_age:
+                postponed[name] = modified + min_age
+                continue
+            storage.delete(name)
+
+        for entry in pending:
+            if entry.name in postponed:
+                entry.due = postponed[entry.name]
+        PendingFileDeletion.objects.bulk_update(
+            [entry for entry in pending if entry.name in postponed],
+            ['due']
+        )
+        PendingFileDeletion.objects.filter(id__in=[
+            entry.id for entry in pending if entry.name not in postponed
+        ]).delete()
+
+    return len(pending)
@@ -0,0 +1,130 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+
+from core.authentication import token_cache_key
+from core.models import (
+    AuthToken, ChangeLogEntry, Ingredient, PendingFileDeletion, Recipe, Tag
+)
+
+CHANGE_LOG_KINDS = {
+    Recipe: ChangeLogEntry.RECIPE,
+    Tag: ChangeLogEntry.TAG,
+    Ingredient: ChangeLogEntry.INGREDIENT,
+}
+
+# Users being deleted by the current thread. Their change log is removed
+# with them, so nothing must be logged for the objects cascading away.
+_deleting_users = threading.local()
+
+
+def _is_deleting(user_id):
+    return user_id in getattr(_deleting_users, 'ids', set())
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_revoked_token(sender, instance, **kwargs):
+    """Drop a deleted token from the lookup cache"""
+    caches['tokens'].delete(token_cache_key(instance.key))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_user_tokens(sender, instance, created, **kwargs):
+    """Drop the cached copies of a user whenever the user changes"""
+    if created:
+        return
+
+    keys = AuthToken.objects.filter(user=instance).values_list(
+        'key', flat=True
+    )
+    caches['tokens'].delete_many([token_cache_key(key) for key in keys])
+
+
+@receiver(post_delete, sender=Recipe)
+def queue_recipe_image_deletion(sender, instance, **kwargs):
+    """Queue the image of a deleted recipe for deletion"""
+    if instance.image.name:
+        PendingFileDeletion.objects.create(name=instance.image.name)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def start_user_deletion(sender, instance, **kwargs):
+    """Stop logging changes for a user that is being deleted"""
+    if not hasattr(_deleting_users, 'ids'):
+        _deleting_users.ids = set()
+    _deleting_users.ids.add(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def finish_user_deletion(sender, instance, **kwargs):
+    """Forget a user once it has been deleted"""
+    _deleting_users.ids.discard(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def log_saved_object(sender, instance, **kwargs):
+    """Log a created or updated object for sync"""
+    ChangeLogEntry.objects.record(
+        instance.user_id,
+        CHANGE_LOG_KINDS[sender],
+        [instance.pk]
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def log_deleted_object(sender, instance, **kwargs):
+    """Log a tombstone for a deleted object"""
+    if _is_deleting(instance.user_id):
+        return
+
+    ChangeLogEntry.objects.record(
+        instance.user_id,
+        CHANGE_LOG_KINDS[sender],
+        [instance.pk],
+        deleted=True
+    )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def log_unlinked_recipes(sender, instance, **kwargs):
+    """Log the recipes losing a link to a tag or ingredient being
+    deleted, as the cascade doesn't send m2m_changed"""
+    if _is_deleting(instance.user_id):
+        return
+
+    ChangeLogEntry.objects.record(
+        instance.user_id,
+        ChangeLogEntry.RECIPE,
+        instance.recipe_set.values_list('id', flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def log_recipe_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """Log the recipes whose tags or ingredients changed"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'pre_clear':
+        recipe_ids = instance.recipe_set.values_list('id', flat=True)
+    else:
+        recipe_ids = pk_set
+
+    ChangeLogEntry.objects.record(
+        instance.user_id,
+        ChangeLogEntry.RECIPE,
+        recipe_ids
+    )
@@ -0,0 +1,332 @@
+"""Storages for recipe images.
+
+RECIPE_IMAGE_STORAGE selects the backend: the local filesystem by default,
+or `core.storage.S3Storage` to keep images in an S3 compatible object
+store shared by every node. Both name files after a hash of their content
+and can hand out upload URLs clients send the image to directly, so the
+app server only records the name once the upload is done. The filesystem
+one receives those uploads itself and stands in for the object store in
+development and tests.
+"""
+import base64
+import hashlib
+import mimetypes
+import os
+import posixpath
+import tempfile
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.core.files.utils import validate_file_name
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+UPLOAD_SALT = 'core.storage.upload'
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """The body of a signed upload does not match what was signed"""
+
+
+class ContentAddressedMixin:
+    """Storage for files named after a hash of their content. Saving a
+    file whose name is already taken keeps the stored copy instead of
+    writing a second one, and touches it: the reapers leave recently
+    modified files alone, so a file about to be referenced again isn't
+    deleted before the reference commits."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if self.exists(name):
+            self.touch(name)
+            return name
+
+        # Not through Storage.save, whose get_available_name would give a
+        # file saved concurrently under the same name another name
+        name = self._save(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+    def read_start(self, name, length):
+        """Return the first `length` bytes of a stored file"""
+        with self.open(name) as fh:
+            return fh.read(length)
+
+
+class ContentAddressedStorage(ContentAddressedMixin, FileSystemStorage):
+    """Content addressed storage on the local filesystem"""
+
+    def touch(self, name):
+        """Set the modification time of a stored file to now"""
+        os.utime(self.path(name))
+
+    def _save(self, name, content):
+        """Write a file to a temporary name and link it into place, so a
+        file another request saved under the name meanwhile is kept and
+        touched instead"""
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    fh.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp, self.file_permissions_mode)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                self.touch(name)
+        finally:
+            os.remove(tmp)
+
+        return name
+
+    def upload_url(self, name, content_type, size, sha256, expires_in):
+        """Return the method, URL and headers of a request storing a file
+        of the given size and hash under `name`, valid for `expires_in`
+        seconds. The URL points to the app's own upload view."""
+        token = signing.dumps(
+            {
+                'name': name,
+                'size': size,
+                'sha256': sha256,
+                'expires': time.time() + expires_in,
+            },
+            salt=UPLOAD_SALT
+        )
+        return {
+            'method': 'PUT',
+            'url': reverse('upload', args=[token]),
+            'headers': {'Content-Type': content_type},
+        }
+
+    def receive_upload(self, token, stream):
+        """Store the body of an upload made to a URL from `upload_url`,
+        checking it against the signed size and hash, and return its name.
+        Raise signing.BadSignature for an invalid or expired token and
+        UploadRejected when the body doesn't match."""
+        signed = signing.loads(token, salt=UPLOAD_SALT)
+        if signed['expires'] < time.time():
+            raise signing.SignatureExpired('Upload URL expired')
+
+        digest = hashlib.sha256()
+        received = 0
+        with tempfile.TemporaryFile() as tmp:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > signed['size']:
+                    raise UploadRejected('Body larger than signed size')
+                digest.update(chunk)
+                tmp.write(chunk)
+
+            if received != signed['size']:
+                raise UploadRejected('Body smaller than signed size')
+            if digest.hexdigest() != signed['sha256']:
+                raise UploadRejected('Body does not match signed hash')
+
+            tmp.seek(0)
+            return self.save(signed['name'], File(tmp))
+
+
+def _is_missing(exc):
+    """Return whether a ClientError reports a missing object"""
+    return exc.response['Error']['Code'] in ('404', 'NoSuchKey')
+
+
+@deconstructible
+class S3Storage(ContentAddressedMixin, Storage):
+    """Content addressed storage in an S3 compatible object store. Files
+    above S3_MULTIPART_THRESHOLD are sent as multipart uploads, in parts
+    uploaded concurrently."""
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None,
+                 public_url=None):
+        self.bucket = bucket or settings.S3_BUCKET
+        self.endpoint_url = endpoint_url or settings.S3_ENDPOINT_URL
+        self.region = region or settings.S3_REGION
+        self.public_url = public_url or settings.S3_PUBLIC_URL
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE
+        )
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                config=Config(signature_version='s3v4')
+            )
+
+        return self._client
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=name)
+        except ClientError as exc:
+            if _is_missing(exc):
+                return None
+            raise
+
+    def _open(self, name, mode='rb'):
+        tmp = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE * 16)
+        try:
+            self.client.download_fileobj(
+                self.bucket, name, tmp, Config=self.transfer_config
+            )
+        except ClientError as exc:
+            tmp.close()
+            if _is_missing(exc):
+                raise FileNotFoundError(name)
+            raise
+        tmp.seek(0)
+        return File(tmp, name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        self.client.upload_fileobj(
+            content,
+            self.bucket,
+            name,
+            ExtraArgs={
+                'ContentType': (
+                    mimetypes.guess_type(name)[0] or
+                    'application/octet-stream'
+                ),
+            },
+            Config=self.transfer_config
+        )
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def read_start(self, name, length):
+        """Return the first `length` bytes of a stored object, without
+        downloading the rest"""
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=name, Range=f'bytes=0-{length - 1}'
+            )
+        except ClientError as exc:
+            if _is_missing(exc):
+                raise FileNotFoundError(name)
+            raise
+
+        return response['Body'].read()
+
+    def touch(self, name):
+        """Set the modification time of a stored object to now, by copying
+        it onto itself"""
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=name,
+            CopySource={'Bucket': self.bucket, 'Key': name},
+            MetadataDirective='REPLACE',
+            ContentType=(
+                mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            )
+        )
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+
+        return head['ContentLength']
+
+    def get_modified_time(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+
+        return head['LastModified']
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(
+                Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for entry in page.get('CommonPrefixes', ()):
+                directories.append(
+                    posixpath.basename(entry['Prefix'].rstrip('/'))
+                )
+            for entry in page.get('Contents', ()):
+                files.append(posixpath.basename(entry['Key']))
+
+        return directories, files
+
+    def url(self, name):
+        if self.public_url:
+            return f'{self.public_url.rstrip("/")}/{name}'
+
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': name},
+            ExpiresIn=settings.S3_URL_EXPIRY
+        )
+
+    def upload_url(self, name, content_type, size, sha256, expires_in):
+        """Return the method, URL and headers of a presigned request
+        storing a file of the given size and hash under `name`. The store
+        checks the body against the signed length and checksum."""
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': name,
+                'ContentType': content_type,
+                'ContentLength': size,
+                'ChecksumSHA256': checksum,
+            },
+            ExpiresIn=expires_in,
+            HttpMethod='PUT'
+        )
+        return {
+            'method': 'PUT',
+            'url': url,
+            'headers': {
+                'Content-Type': content_type,
+                'Content-Length': str(size),
+                'x-amz-checksum-sha256': checksum,
+            },
+        }
+
+
+_storages = {}
+
+
+def get_recipe_image_storage():
+    """Return the storage used for recipe images"""
+    if settings.RECIPE_IMAGE_STORAGE not in _storages:
+        _storages[settings.RECIPE_IMAGE_STORAGE] = import_string(
+            settings.RECIPE_IMAGE_STORAGE
+        )()
+
+    return _storages[settings.RECIPE_IMAGE_STORAGE]
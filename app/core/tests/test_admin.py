@@ -1,7 +1,14 @@
-from django.test import TestCase, Client
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Ingredient, Recipe, Tag
+
 
 class AdminSiteTests(TestCase):
 
@@ -40,3 +47,99 @@ class AdminSiteTests(TestCase):
         resp = self.client.get(url)
 
         self.assertEqual(resp.status_code, 200)
+
+    def test_recipes_listed(self):
+        """Test that recipes are listed with their user in a number of
+        queries independent of the number of recipes"""
+        url = reverse('admin:core_recipe_changelist')
+        Recipe.objects.create(
+            user=self.user, title='Recipe 0', time_minutes=5, price=5.00
+        )
+        with CaptureQueriesContext(connection) as one_recipe:
+            self.client.get(url)
+
+        for i in range(1, 5):
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}',
+                time_minutes=5, price=5.00
+            )
+        with self.assertNumQueries(len(one_recipe)):
+            resp = self.client.get(url)
+
+        self.assertContains(resp, 'Recipe 4')
+        self.assertContains(resp, self.user.email)
+
+    def test_recipe_search_by_title_prefix(self):
+        """Test that the recipe changelist searches titles by prefix"""
+        Recipe.objects.create(
+            user=self.user, title='Pasta bake', time_minutes=5, price=5.00
+        )
+        Recipe.objects.create(
+            user=self.user, title='Baked pasta', time_minutes=5, price=5.00
+        )
+        url = reverse('admin:core_recipe_changelist')
+
+        resp = self.client.get(url, {'q': 'Pasta'})
+
+        self.assertContains(resp, 'Pasta bake')
+        self.assertNotContains(resp, 'Baked pasta')
+
+    def test_recipe_change_page(self):
+        """Test that the recipe edit page works"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5.00
+        )
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_tags_and_ingredients_listed(self):
+        """Test that tags and ingredients are listed"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+
+        resp = self.client.get(reverse('admin:core_tag_changelist'))
+        self.assertContains(resp, 'Vegan')
+
+        resp = self.client.get(reverse('admin:core_ingredient_changelist'))
+        self.assertContains(resp, 'Salt')
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_paginator_uses_estimate_for_big_tables(self):
+        """Test that unfiltered changelists of big tables are not counted"""
+        paginator = EstimatedCountPaginator(Recipe.objects.order_by('id'), 100)
+
+        with mock.patch.object(paginator, 'estimated_count',
+                               return_value=5000):
+            self.assertEqual(paginator.count, 5000)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=10)
+    def test_paginator_counts_filtered_and_small_tables(self):
+        """Test that filtered lists and small tables are counted exactly"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        filtered = EstimatedCountPaginator(
+            Tag.objects.filter(name='Vegan').order_by('id'), 100
+        )
+        small = EstimatedCountPaginator(Tag.objects.order_by('id'), 100)
+
+        with mock.patch.object(filtered, 'estimated_count',
+                               return_value=5000):
+            self.assertEqual(filtered.count, 1)
+        with mock.patch.object(small, 'estimated_count', return_value=3):
+            self.assertEqual(small.count, 1)
+
+    def test_estimated_count(self):
+        """Test that the estimate is read from the table statistics"""
+        paginator = EstimatedCountPaginator(Tag.objects.order_by('id'), 100)
+        if connection.vendor != 'postgresql':
+            self.assertIsNone(paginator.estimated_count())
+            return
+
+        Tag.objects.bulk_create(
+            Tag(user=self.user, name=f'Tag {i}') for i in range(50)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{Tag._meta.db_table}"')
+
+        self.assertEqual(paginator.estimated_count(), 50)
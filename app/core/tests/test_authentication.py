@@ -0,0 +1,79 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework import exceptions
+
+from core.authentication import (
+    ExpiringTokenAuthentication, LastUsedRecorder
+)
+from core.models import AuthToken
+
+
+class ExpiringTokenAuthenticationTests(TestCase):
+
+    def setUp(self):
+        caches['tokens'].clear()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        self.token = AuthToken.objects.get_or_create_token(self.user)
+        self.auth = ExpiringTokenAuthentication()
+
+    def test_cached_lookup_needs_no_queries(self):
+        """Test that a token seen before is validated from the cache"""
+        with patch('core.authentication.last_used_recorder'):
+            self.auth.authenticate_credentials(self.token.key)
+            with self.assertNumQueries(0):
+                user, key = self.auth.authenticate_credentials(
+                    self.token.key
+                )
+
+        self.assertEqual(user, self.user)
+        self.assertEqual(key, self.token.key)
+
+    def test_expired_token_rejected(self):
+        """Test that an expired token doesn't authenticate"""
+        self.token.expires = timezone.now() - timedelta(seconds=1)
+        self.token.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_revoked_token_rejected(self):
+        """Test that deleting a token evicts it from the cache"""
+        self.auth.authenticate_credentials(self.token.key)
+        self.token.delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deactivated_user_rejected(self):
+        """Test that changes to the user are picked up despite the cache"""
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_last_used_written_in_batches(self):
+        """Test that token usage is flushed once per interval"""
+        other = AuthToken.objects.get_or_create_token(self.user, 'tablet')
+        recorder = LastUsedRecorder()
+
+        with self.settings(AUTH_TOKEN_LAST_USED_INTERVAL=3600):
+            with self.assertNumQueries(1):
+                recorder.record(self.token.key)
+            with self.assertNumQueries(0):
+                recorder.record(other.key)
+
+        self.token.refresh_from_db()
+        other.refresh_from_db()
+        self.assertIsNotNone(self.token.last_used)
+        self.assertIsNone(other.last_used)
@@ -1,8 +1,19 @@
+import os
+import tempfile
+import time
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import (
+    AuthToken, ChangeLogEntry, Ingredient, PendingFileDeletion, Recipe, Tag
+)
 
 
 class CommandTests(TestCase):
@@ -20,3 +31,229 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class MediaCommandTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root.name
+        )
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def _write(self, name, age=0):
+        """Write a media file and backdate it by `age` seconds"""
+        path = os.path.join(self.media_root.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _recipe(self, image=None):
+        return Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=5.00,
+            image=image
+        )
+
+    def test_deleted_recipe_image_queued(self):
+        """Test that deleting a recipe queues its image for deletion"""
+        path = self._write('uploads/recipe/a.jpg')
+        recipe = self._recipe('uploads/recipe/a.jpg')
+
+        recipe.delete()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(PendingFileDeletion.objects.filter(
+            name='uploads/recipe/a.jpg'
+        ).exists())
+
+    def test_reap_deleted_files(self):
+        """Test that queued files are deleted unless still in use"""
+        unused = self._write('uploads/recipe/a.jpg', age=7200)
+        shared = self._write('uploads/recipe/b.jpg', age=7200)
+        self._recipe('uploads/recipe/a.jpg').delete_image()
+        self._recipe('uploads/recipe/b.jpg').delete()
+        self._recipe('uploads/recipe/b.jpg')
+
+        call_command('reap_deleted_files', batch_size=1, stdout=StringIO())
+
+        self.assertFalse(os.path.exists(unused))
+        self.assertTrue(os.path.exists(shared))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_reap_deleted_files_recently_used(self):
+        """Test that queued files touched lately are kept, as a reference
+        to them may not be committed yet"""
+        reused = self._write('uploads/recipe/a.jpg', age=7200)
+        self._recipe('uploads/recipe/a.jpg').delete_image()
+        # An upload of the same image touches the stored file
+        Recipe._meta.get_field('image').storage.save(
+            'uploads/recipe/a.jpg', ContentFile(b'data')
+        )
+
+        call_command('reap_deleted_files', stdout=StringIO())
+
+        self.assertTrue(os.path.exists(reused))
+        entry = PendingFileDeletion.objects.get()
+        self.assertGreater(entry.due, timezone.now())
+
+    def test_reap_deleted_files_postponed_entry_due(self):
+        """Test that a queued file kept for being recently used is deleted
+        once its entry is due"""
+        path = self._write('uploads/recipe/a.jpg')
+        self._recipe('uploads/recipe/a.jpg').delete_image()
+        call_command('reap_deleted_files', stdout=StringIO())
+        os.utime(path, (0, 0))
+        PendingFileDeletion.objects.update(due=timezone.now())
+
+        call_command('reap_deleted_files', stdout=StringIO())
+
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_remove_orphaned_media(self):
+        """Test that only old unreferenced files are removed"""
+        orphan = self._write('uploads/recipe/orphan.jpg', age=7200)
+        recent = self._write('uploads/recipe/recent.jpg')
+        used = self._write('uploads/recipe/used.jpg', age=7200)
+        self._recipe('uploads/recipe/used.jpg')
+
+        call_command('remove_orphaned_media', stdout=StringIO())
+
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(used))
+
+    def test_remove_orphaned_media_dry_run(self):
+        """Test that a dry run leaves files in place"""
+        orphan = self._write('uploads/recipe/orphan.jpg', age=7200)
+
+        call_command('remove_orphaned_media', dry_run=True, stdout=StringIO())
+
+        self.assertTrue(os.path.exists(orphan))
+
+
+class CompactChangeLogTests(TestCase):
+
+    def test_compact_changelog(self):
+        """Test that only the latest entry per object is kept"""
+        user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        tag = Tag.objects.create(user=user, name='Vegan')
+        tag.name = 'Vegetarian'
+        tag.save()
+        other = Tag.objects.create(user=user, name='Dessert')
+        other.delete()
+        latest_ids = set(ChangeLogEntry.objects.filter(
+            id__in=[
+                ChangeLogEntry.objects.filter(object_id=tag.id).last().id,
+                ChangeLogEntry.objects.filter(deleted=True).last().id,
+            ]
+        ).values_list('id', flat=True))
+
+        call_command('compact_changelog', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(
+            set(ChangeLogEntry.objects.values_list('id', flat=True)),
+            latest_ids
+        )
+
+
+class DeleteExpiredTokensTests(TestCase):
+
+    def test_delete_expired_tokens(self):
+        """Test that only expired tokens are deleted"""
+        user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        valid = AuthToken.objects.get_or_create_token(user)
+        for device in ('phone', 'tablet', 'laptop'):
+            AuthToken.objects.create(
+                key=device,
+                user=user,
+                device=device,
+                expires=timezone.now()
+            )
+        out = StringIO()
+
+        call_command('delete_expired_tokens', batch_size=2, stdout=out)
+
+        self.assertIn('Removed 3 expired tokens', out.getvalue())
+        self.assertEqual(
+            list(AuthToken.objects.values_list('id', flat=True)), [valid.id]
+        )
+
+
+@override_settings(STARTER_CATALOGUE={
+    'tags': ['Vegan', 'Dessert'],
+    'ingredients': ['Salt'],
+})
+class SeedStarterCatalogueTests(TestCase):
+
+    def test_seed_existing_users(self):
+        """Test that existing users get the starter items they miss"""
+        users = [
+            get_user_model().objects.create_user(
+                email=f'user{i}@unittest.com',
+                password='password123'
+            )
+            for i in range(3)
+        ]
+        Tag.objects.create(user=users[0], name='Vegan')
+
+        call_command('seed_starter_catalogue', batch_size=2,
+                     stdout=StringIO())
+        call_command('seed_starter_catalogue', stdout=StringIO())
+
+        for user in users:
+            self.assertEqual(
+                sorted(user.tag_set.values_list('name', flat=True)),
+                ['Dessert', 'Vegan']
+            )
+            self.assertEqual(
+                list(user.ingredient_set.values_list('name', flat=True)),
+                ['Salt']
+            )
+        self.assertEqual(Tag.objects.count(), 6)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_seeding_recorded_in_change_log(self):
+        """Test that seeded items are picked up by the incremental sync"""
+        user = get_user_model().objects.create_user(
+            email='user@unittest.com',
+            password='password123'
+        )
+
+        call_command('seed_starter_catalogue', stdout=StringIO())
+
+        self.assertEqual(
+            set(ChangeLogEntry.objects.filter(
+                user=user,
+                kind=ChangeLogEntry.TAG
+            ).values_list('object_id', flat=True)),
+            set(user.tag_set.values_list('id', flat=True))
+        )
+        self.assertEqual(
+            ChangeLogEntry.objects.filter(
+                user=user,
+                kind=ChangeLogEntry.INGREDIENT
+            ).count(),
+            1
+        )
@@ -0,0 +1,154 @@
+import gzip
+import json
+
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import compression
+from core.middleware import CompressionMiddleware
+from core.models import Recipe
+
+BODY = b'{"title": "Sample recipe", "time_minutes": 10}' * 100
+
+
+def respond(response, **headers):
+    """Run a response through the middleware for a GET request"""
+    request = RequestFactory().get('/', **headers)
+    return CompressionMiddleware(lambda request: response)(request)
+
+
+class NegotiationTests(SimpleTestCase):
+
+    def test_best_quality_wins(self):
+        """Test that the coding the client prefers is chosen"""
+        self.assertEqual(
+            compression.negotiate_encoding(
+                'gzip;q=1.0, identity; q=0.5, *;q=0', ['zstd', 'br', 'gzip']
+            ),
+            'gzip'
+        )
+
+    def test_refused_coding_not_chosen(self):
+        """Test that codings with a zero quality are never used"""
+        self.assertIsNone(
+            compression.negotiate_encoding('gzip;q=0', ['gzip'])
+        )
+        self.assertIsNone(compression.negotiate_encoding('', ['gzip']))
+
+    def test_preference_breaks_ties(self):
+        """Test that equally accepted codings go by server preference"""
+        self.assertEqual(
+            compression.negotiate_encoding('gzip, br', ['br', 'gzip']),
+            'br'
+        )
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+
+    def test_large_json_compressed(self):
+        """Test that large JSON responses are gzipped"""
+        response = respond(
+            HttpResponse(BODY, content_type='application/json'),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), BODY)
+        self.assertEqual(
+            response['Content-Length'], str(len(response.content))
+        )
+
+    def test_small_and_binary_responses_left_alone(self):
+        """Test that small or non text responses are not compressed"""
+        small = respond(
+            HttpResponse(b'{}', content_type='application/json'),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+        image = respond(
+            HttpResponse(BODY, content_type='image/jpeg'),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(image.has_header('Content-Encoding'))
+
+    def test_streaming_response_compressed(self):
+        """Test that streaming responses are compressed as they stream"""
+        response = respond(
+            StreamingHttpResponse(
+                iter([BODY, BODY]),
+                content_type='application/json'
+            ),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            BODY * 2
+        )
+
+    def test_session_cookie_requests_not_compressed(self):
+        """Test that cookie authenticated responses are not compressed"""
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        request.COOKIES['sessionid'] = 'abc'
+        response = CompressionMiddleware(
+            lambda request: HttpResponse(
+                BODY, content_type='application/json'
+            )
+        )(request)
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_strong_etag_weakened(self):
+        """Test that a strong ETag is weakened on the compressed body"""
+        response = HttpResponse(BODY, content_type='application/json')
+        response['ETag'] = '"abc"'
+
+        response = respond(response, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_zstd_compressed(self):
+        """Test that zstd is used when the client accepts it"""
+        response = respond(
+            HttpResponse(BODY, content_type='application/json'),
+            HTTP_ACCEPT_ENCODING='gzip, zstd'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'zstd')
+        self.assertEqual(
+            compression.zstandard.ZstdDecompressor().decompressobj()
+            .decompress(response.content),
+            BODY
+        )
+
+
+class CompressedApiTests(TestCase):
+
+    def test_recipe_list_compressed(self):
+        """Test that a large recipe list is sent compressed"""
+        user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        Recipe.objects.bulk_create(
+            Recipe(user=user, title=f'Recipe {i}', time_minutes=10,
+                   price=5.00)
+            for i in range(50)
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        resp = client.get(
+            reverse('recipe:recipe-list'),
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(resp.content))), 50)
@@ -0,0 +1,207 @@
+import time
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.db_router import PrimaryReplicaRouter, use_primary
+from core.middleware import PIN_COOKIE, PIN_HEADER, ReplicaRoutingMiddleware
+from core.models import Recipe
+from core.throttling import reset_buckets
+
+
+@override_settings(DATABASE_REPLICAS=['replica0', 'replica1'])
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.seen = []
+        self.middleware = ReplicaRoutingMiddleware(self._view)
+
+    def _view(self, request):
+        """Record where reads would go while handling the request"""
+        self.seen.append(self.router.db_for_read(Recipe))
+        return HttpResponse()
+
+    def test_writes_go_to_primary(self):
+        """Test that writes always use the primary database"""
+        token = use_primary.set(False)
+        try:
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+        finally:
+            use_primary.reset(token)
+
+    def test_reads_outside_requests_use_primary(self):
+        """Test that reads default to the primary outside requests"""
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_safe_request_reads_from_replicas(self):
+        """Test that safe requests load balance reads over replicas"""
+        for _ in range(20):
+            self.middleware(self.factory.get('/'))
+
+        self.assertEqual(set(self.seen), {'replica0', 'replica1'})
+
+    def test_write_pins_client_by_cookie(self):
+        """Test that a write pins a browser to the primary"""
+        resp = self.middleware(self.factory.post('/'))
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = resp.cookies[PIN_COOKIE].value
+        self.middleware(request)
+
+        self.assertEqual(self.seen, ['default', 'default'])
+
+    def test_write_pins_client_by_header(self):
+        """Test that a client without cookies is pinned to the primary by
+        sending back the pin header"""
+        resp = self.middleware(self.factory.post('/'))
+        self.middleware(
+            self.factory.get('/', HTTP_X_PRIMARY_PIN=resp[PIN_HEADER])
+        )
+
+        self.assertEqual(self.seen, ['default', 'default'])
+
+    def test_expired_pin_header_ignored(self):
+        """Test that a pin header stops pinning once it is too old"""
+        issued = time.time() - 60
+        with patch('time.time', return_value=issued):
+            resp = self.middleware(self.factory.post('/'))
+        self.middleware(
+            self.factory.get('/', HTTP_X_PRIMARY_PIN=resp[PIN_HEADER])
+        )
+
+        self.assertIn(self.seen[1], ['replica0', 'replica1'])
+
+    def test_forged_pin_header_ignored(self):
+        """Test that only signed pin headers pin a client"""
+        self.middleware(self.factory.get('/', HTTP_X_PRIMARY_PIN='1'))
+
+        self.assertIn(self.seen[0], ['replica0', 'replica1'])
+
+    def test_expired_pin_ignored(self):
+        """Test that a pin cookie stops pinning once it is too old, even
+        if the client keeps sending it"""
+        issued = time.time() - 60
+        with patch('time.time', return_value=issued):
+            resp = self.middleware(self.factory.post('/'))
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = resp.cookies[PIN_COOKIE].value
+        self.middleware(request)
+
+        self.assertIn(self.seen[1], ['replica0', 'replica1'])
+
+    def test_forged_pin_ignored(self):
+        """Test that only signed pin cookies pin a client"""
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.middleware(request)
+
+        self.assertIn(self.seen[0], ['replica0', 'replica1'])
+
+    def test_login_and_signup_pin_client(self):
+        """Test that the responses to logging in and signing up pin the
+        client"""
+        client = APIClient()
+        reset_buckets()
+        signup = client.post(reverse('user:create'), {
+            'email': 'test@unittest.com',
+            'password': 'password',
+            'name': 'Test User',
+        })
+        login = client.post(reverse('user:token'), {
+            'email': 'test@unittest.com',
+            'password': 'password',
+        })
+
+        self.assertIn(PIN_COOKIE, signup.cookies)
+        self.assertIn(PIN_COOKIE, login.cookies)
+
+    def test_migrations_only_on_primary(self):
+        """Test that replicas are never migrated"""
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+        self.assertFalse(self.router.allow_migrate('replica0', 'core'))
+
+
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Test that requests read from a second configured database. The
+    replica is a second connection to the test database, so it only sees
+    committed rows like a real replica would."""
+    replica = 'replica_test'
+
+    def setUp(self):
+        connections.settings[self.replica] = {
+            **connections.settings['default'],
+            'TEST': {'MIRROR': 'default'},
+        }
+        self.addCleanup(self.remove_replica)
+        # Rows commit here, so the token of the new user is issued before
+        # the test flushes the user
+        self.settings_override = override_settings(
+            DATABASE_REPLICAS=[self.replica],
+            JOBS_EAGER=True
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        reset_buckets()
+
+    def remove_replica(self):
+        connections[self.replica].close()
+        del connections[self.replica]
+        del connections.settings[self.replica]
+
+    def get_recipes(self):
+        """List recipes, returning the response and the queries run on
+        the primary and on the replica"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[self.replica]) as replica:
+            resp = self.client.get(reverse('recipe:recipe-list'))
+
+        return (
+            resp,
+            [query['sql'] for query in primary.captured_queries],
+            [query['sql'] for query in replica.captured_queries]
+        )
+
+    def test_reads_go_to_replica(self):
+        """Test that a client that didn't write reads from the replica"""
+        Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+
+        resp, primary, replica = self.get_recipes()
+
+        self.assertEqual(len(resp.data), 1)
+        self.assertTrue(any('core_recipe' in sql for sql in replica))
+        self.assertEqual(primary, [])
+
+    def test_reads_after_write_go_to_primary(self):
+        """Test that a client reads from the primary after writing"""
+        self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Sample recipe',
+            'time_minutes': 10,
+            'price': 5.00,
+        })
+
+        resp, primary, replica = self.get_recipes()
+
+        self.assertEqual(len(resp.data), 1)
+        self.assertTrue(any('core_recipe' in sql for sql in primary))
+        self.assertEqual(replica, [])
@@ -0,0 +1,56 @@
+import threading
+
+from django.test import SimpleTestCase, override_settings
+
+from core.jobs import JobRunner
+
+
+class JobRunnerTests(SimpleTestCase):
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_immediately(self):
+        """Test that eager jobs run in the queueing thread"""
+        calls = []
+        runner = JobRunner()
+
+        runner.enqueue(calls.append, 1)
+
+        self.assertEqual(calls, [[1]])
+
+    @override_settings(JOBS_INTERVAL=0.05)
+    def test_items_run_in_batches(self):
+        """Test that items queued together are handed to one call"""
+        calls = []
+        done = threading.Event()
+
+        def job(items):
+            calls.append(items)
+            done.set()
+
+        runner = JobRunner()
+        for item in range(3):
+            runner.enqueue(job, item)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, [[0, 1, 2]])
+
+    @override_settings(JOBS_INTERVAL=60, JOBS_BATCH_SIZE=2)
+    def test_flush_splits_batches(self):
+        """Test that batches are capped at the configured size"""
+        calls = []
+        runner = JobRunner()
+        for item in range(5):
+            runner.enqueue(calls.append, item)
+
+        runner.flush()
+
+        self.assertEqual(calls, [[0, 1], [2, 3], [4]])
+
+    @override_settings(JOBS_EAGER=True)
+    def test_failing_job_logged(self):
+        """Test that a failing job is logged instead of raised"""
+        def job(items):
+            raise RuntimeError()
+
+        with self.assertLogs('core.jobs', level='ERROR'):
+            JobRunner().enqueue(job, 1)
@@ -1,9 +1,15 @@
-from unittest.mock import patch
+import hashlib
+import threading
+import time
+from unittest.mock import Mock, patch
 
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher
 
 from core import models
+from core.hashers import HashingBusy, hash_password
 
 
 def sample_user(email='test@unittest.com', password='password'):
@@ -27,6 +33,40 @@ class ModelTests(TestCase):
         self.assertEqual(user.email, email)
         self.assertTrue(user.check_password(password))
 
+    def test_new_user_password_hashed_with_argon2(self):
+        """Test new passwords are hashed with the preferred hasher"""
+        user = sample_user()
+
+        self.assertEqual(identify_hasher(user.password).algorithm, 'argon2')
+
+    @override_settings(PASSWORD_HASHING_TIMEOUT=0.01)
+    def test_hash_password_busy(self):
+        """Test that hashing gives up when no slot frees up in time"""
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with patch('core.hashers._get_slots', return_value=slots), \
+                patch('core.hashers.make_password') as make_password:
+            with self.assertRaises(HashingBusy):
+                hash_password('password')
+
+        make_password.assert_not_called()
+
+    @override_settings(PASSWORD_HASHING_TIMEOUT=0.01)
+    def test_hash_password_started_is_waited_for(self):
+        """Test that a hash slower than the timeout still returns once it
+        started, and frees its slot"""
+        slots = threading.BoundedSemaphore(1)
+
+        def slow_hash(password):
+            time.sleep(0.05)
+            return 'hashed'
+
+        with patch('core.hashers._get_slots', return_value=slots), \
+                patch('core.hashers.make_password', side_effect=slow_hash):
+            self.assertEqual(hash_password('password'), 'hashed')
+
+        self.assertTrue(slots.acquire(blocking=False))
+
     def test_new_user_email_normalized(self):
         """Test the email for a new user is normalized"""
         email = 'test@ERROR.com'
@@ -99,11 +139,12 @@ class ModelTests(TestCase):
         url = recipe.get_absolute_url()
         self.assertEqual(url, '/recipes/{}/'.format(recipe.id))
 
-    @patch('uuid.uuid4')
-    def test_recipe_file_name_uuid(self, mock_uuid):
-        """Test that image is saved in the correct location"""
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
-        file_path = models.recipe_image_file_path(None, 'myimage.jpg')
-        exp_path = f'uploads/recipe/{uuid}.jpg'
+    def test_recipe_file_name_content_hash(self):
+        """Test that image is saved under a hash of its content"""
+        content = b'image-bytes'
+        instance = Mock()
+        instance.image.file = ContentFile(content)
+        file_path = models.recipe_image_file_path(instance, 'myimage.JPG')
+        digest = hashlib.sha256(content).hexdigest()
+        exp_path = f'uploads/recipe/{digest}.jpg'
         self.assertEqual(file_path, exp_path)
@@ -0,0 +1,175 @@
+from io import StringIO
+from unittest.mock import Mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.utils import NotSupportedError
+from django.test import TestCase
+
+from core import partitioning
+from core.models import Recipe, Tag
+
+
+class PartitioningTests(TestCase):
+
+    def test_prepare_sql(self):
+        """Test the partitioned copy has one partition per remainder"""
+        statements = partitioning.prepare_sql(Recipe, 4)
+        sql = '\n'.join(statements)
+
+        self.assertIn(
+            'CREATE TABLE "core_recipe_part" (LIKE "core_recipe"',
+            sql
+        )
+        self.assertIn('PARTITION BY HASH ("user_id")', sql)
+        self.assertIn('PRIMARY KEY ("id", "user_id")', sql)
+        for remainder in range(4):
+            self.assertIn(
+                f'"core_recipe_p{remainder}" PARTITION OF "core_recipe_part" '
+                f'FOR VALUES WITH (MODULUS 4, REMAINDER {remainder})',
+                sql
+            )
+        self.assertIn(
+            'CREATE INDEX "recipe_user_time_id_idx_part" ON '
+            '"core_recipe_part"',
+            sql
+        )
+        self.assertIn('CREATE TRIGGER "core_recipe_mirror"', sql)
+        self.assertIn(
+            'ON CONFLICT ("id", "user_id") DO UPDATE SET '
+            '"title" = EXCLUDED."title"',
+            sql
+        )
+
+    def test_swap_sql(self):
+        """Test the swap renames the tables and drops foreign keys"""
+        statements = partitioning.swap_sql(
+            Recipe,
+            [('core_recipe_tags', 'core_recipe_tags_recipe_id_fk')]
+        )
+
+        self.assertEqual(
+            statements[0],
+            'LOCK TABLE "core_recipe" IN ACCESS EXCLUSIVE MODE'
+        )
+        self.assertIn(
+            'ALTER TABLE "core_recipe_tags" DROP CONSTRAINT '
+            '"core_recipe_tags_recipe_id_fk"',
+            statements
+        )
+        self.assertIn(
+            'ALTER TABLE "core_recipe_part" RENAME TO "core_recipe"',
+            statements
+        )
+        self.assertIn(
+            'ALTER INDEX "recipe_title_like_idx_part" RENAME TO '
+            '"recipe_title_like_idx"',
+            statements
+        )
+
+    def test_partition_model_keeps_indexes(self):
+        """Test that the partitioned table has every index of the table it
+        replaces, under the same names"""
+        if connection.vendor != 'postgresql':
+            self.skipTest('Requires PostgreSQL')
+        table = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            if partitioning.is_partitioned(cursor, table):
+                self.skipTest('Tables are partitioned already')
+            before = self._index_definitions(cursor, table)
+
+            partitioning.partition_model(Recipe, 2)
+
+            self.assertTrue(partitioning.is_partitioned(cursor, table))
+            after = self._index_definitions(cursor, table)
+
+        self.assertEqual(
+            {name: definition for name, definition in after.items()
+             if name in before},
+            before
+        )
+        self.assertIn(
+            'varchar_pattern_ops',
+            after['recipe_title_like_idx']
+        )
+
+    def _index_definitions(self, cursor, table):
+        """Return the definitions of the indexes of a table by name,
+        without the primary key"""
+        cursor.execute(
+            "SELECT indexname, replace(indexdef, ' ONLY ', ' ') "
+            "FROM pg_indexes WHERE tablename = %s "
+            "AND indexname != %s",
+            [table, f'{table}_pkey']
+        )
+        return dict(cursor.fetchall())
+
+    def test_command_dry_run(self):
+        """Test the dry run prints the SQL for every table"""
+        out = StringIO()
+        call_command('partition_core_tables', partitions=2, dry_run=True,
+                     stdout=out)
+
+        for model in partitioning.PARTITIONED_MODELS:
+            self.assertIn(f'"{model._meta.db_table}_part"', out.getvalue())
+
+    def test_command_requires_postgresql(self):
+        """Test the command refuses to run on other databases"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('Running on PostgreSQL')
+
+        with self.assertRaises(CommandError):
+            call_command('partition_core_tables', stdout=StringIO())
+
+    def test_check_support(self):
+        """Test that only PostgreSQL 11 and later can partition tables"""
+        partitioning.check_support(
+            Mock(vendor='postgresql', pg_version=110005)
+        )
+        for database in (Mock(vendor='postgresql', pg_version=100012),
+                         Mock(vendor='sqlite')):
+            with self.assertRaises(NotSupportedError):
+                partitioning.check_support(database)
+
+    def test_referencing_columns(self):
+        """Test that the many-to-many links are the references whose
+        foreign keys are dropped"""
+        self.assertEqual(
+            sorted(partitioning.referencing_columns(Recipe)),
+            [('core_recipe_ingredients', 'recipe_id'),
+             ('core_recipe_tags', 'recipe_id')]
+        )
+        self.assertEqual(
+            partitioning.referencing_columns(Tag),
+            [('core_recipe_tags', 'tag_id')]
+        )
+
+    def test_command_check(self):
+        """Test that the check reports links to missing rows"""
+        user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        tag = Tag.objects.create(user=user, name='Vegan')
+        out = StringIO()
+        call_command('partition_core_tables', check=True, stdout=out)
+        self.assertIn('No references to missing rows', out.getvalue())
+
+        link = Recipe.tags.through.objects.create(
+            recipe_id=999999, tag_id=tag.id
+        )
+        err = StringIO()
+        try:
+            with self.assertRaises(CommandError):
+                call_command(
+                    'partition_core_tables',
+                    check=True,
+                    stdout=StringIO(),
+                    stderr=err
+                )
+        finally:
+            link.delete()
+
+        self.assertIn('core_recipe_tags.recipe_id: 1 rows', err.getvalue())
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+PROBE = '''
+import json
+import logging
+import django
+django.setup()
+logging.disable(logging.WARNING)
+from django.conf import settings
+from django.test import Client
+from django.urls import NoReverseMatch, reverse
+try:
+    reverse('admin:index')
+    admin_url = True
+except NoReverseMatch:
+    admin_url = False
+response = Client().get('/api/recipe/tags/', HTTP_HOST='localhost')
+print(json.dumps({
+    'apps': settings.INSTALLED_APPS,
+    'middleware': settings.MIDDLEWARE,
+    'admin_url': admin_url,
+    'status': response.status_code,
+}))
+'''
+
+
+def run_profile(api_only):
+    """Return what a fresh process sees of the settings in a profile"""
+    env = dict(os.environ, API_ONLY='1' if api_only else '0')
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=settings.BASE_DIR,
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True
+    ).stdout
+    return json.loads(output.decode().splitlines()[-1])
+
+
+class ProfileTests(SimpleTestCase):
+
+    def test_api_only_profile(self):
+        """Test that API workers leave out the admin and session machinery
+        and still serve the API"""
+        profile = run_profile(api_only=True)
+
+        self.assertNotIn('django.contrib.admin', profile['apps'])
+        self.assertNotIn('django.contrib.sessions', profile['apps'])
+        self.assertNotIn(
+            'django.middleware.csrf.CsrfViewMiddleware',
+            profile['middleware']
+        )
+        self.assertFalse(profile['admin_url'])
+        self.assertEqual(profile['status'], 401)
+
+    def test_full_profile(self):
+        """Test that the default profile keeps the admin"""
+        profile = run_profile(api_only=False)
+
+        self.assertIn('django.contrib.admin', profile['apps'])
+        self.assertTrue(profile['admin_url'])
+        self.assertEqual(profile['status'], 401)
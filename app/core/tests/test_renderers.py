@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from core import renderers
+from core.models import Tag
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class MessagePackTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_rendered_on_request(self):
+        """Test that MessagePack is returned when the client asks for it"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        resp = self.client.get(TAGS_URL, HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(resp['Content-Type'], 'application/msgpack')
+        self.assertEqual(
+            renderers.msgpack.unpackb(resp.content, raw=False),
+            [{'id': self.user.tag_set.get().id, 'name': 'Vegan'}]
+        )
+
+    def test_create_parsed(self):
+        """Test that a MessagePack body is accepted"""
+        resp = self.client.post(
+            TAGS_URL,
+            renderers.msgpack.packb({'name': 'Vegan'}),
+            content_type='application/msgpack'
+        )
+
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(self.user.tag_set.filter(name='Vegan').exists())
+
+    def test_invalid_body_rejected(self):
+        """Test that a broken MessagePack body is a parse error"""
+        with self.assertRaises(ParseError):
+            renderers.MessagePackParser().parse(BytesIO(b'\xc1'))
+
+
+class CBORTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        """Test that values round trip, including dates and decimals"""
+        data = {
+            'price': Decimal('5.50'),
+            'expires': datetime(2030, 1, 1, tzinfo=timezone.utc),
+            'tags': [{'id': 1, 'name': 'Vegan'}],
+        }
+        body = renderers.CBORRenderer().render(data)
+
+        self.assertEqual(renderers.CBORParser().parse(BytesIO(body)), data)
+
+    def test_unknown_types_rendered_as_in_json(self):
+        """Test that types CBOR lacks are rendered as JSON renders them"""
+        body = renderers.CBORRenderer().render(
+            {'duration': timedelta(minutes=1)}
+        )
+
+        self.assertEqual(
+            renderers.CBORParser().parse(BytesIO(body)),
+            {'duration': '60.0'}
+        )
+
+    def test_invalid_body_rejected(self):
+        """Test that a broken CBOR body is a parse error"""
+        with self.assertRaises(ParseError):
+            renderers.CBORParser().parse(BytesIO(b'\xff\xff'))
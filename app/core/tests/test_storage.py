@@ -0,0 +1,253 @@
+import base64
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+
+from core import storage
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        self.location = tempfile.TemporaryDirectory()
+        self.storage = storage.ContentAddressedStorage(
+            location=self.location.name
+        )
+        self.content = b'image-bytes'
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.name = f'uploads/recipe/{self.sha256}.jpg'
+
+    def tearDown(self):
+        self.location.cleanup()
+
+    def upload(self, size=None, sha256=None, expires_in=60):
+        url = self.storage.upload_url(
+            self.name,
+            'image/jpeg',
+            len(self.content) if size is None else size,
+            sha256 or self.sha256,
+            expires_in
+        )['url']
+        return url.rstrip('/').rsplit('/', 1)[-1]
+
+    def test_save_existing_name_kept(self):
+        """Test that saving a taken name keeps the stored file and touches
+        it"""
+        self.storage.save('a.jpg', ContentFile(b'first'))
+        os.utime(self.storage.path('a.jpg'), (0, 0))
+        name = self.storage.save('a.jpg', ContentFile(b'second'))
+
+        self.assertEqual(name, 'a.jpg')
+        with self.storage.open(name) as fh:
+            self.assertEqual(fh.read(), b'first')
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), 0)
+
+    def test_save_concurrent_name_kept(self):
+        """Test that a file saved under the same name by another request
+        between the existence check and the write is kept, not renamed or
+        retried forever"""
+        self.storage.save('a.jpg', ContentFile(b'first'))
+        os.utime(self.storage.path('a.jpg'), (0, 0))
+
+        with patch.object(self.storage, 'exists', return_value=False):
+            name = self.storage.save('a.jpg', ContentFile(b'second'))
+
+        self.assertEqual(name, 'a.jpg')
+        self.assertEqual(os.listdir(self.location.name), ['a.jpg'])
+        with self.storage.open(name) as fh:
+            self.assertEqual(fh.read(), b'first')
+        self.assertGreater(os.path.getmtime(self.storage.path(name)), 0)
+
+    def test_read_start(self):
+        """Test reading the first bytes of a stored file"""
+        self.storage.save('a.jpg', ContentFile(b'first'))
+
+        self.assertEqual(self.storage.read_start('a.jpg', 3), b'fir')
+
+    def test_receive_upload(self):
+        """Test that a signed upload is stored under the signed name"""
+        name = self.storage.receive_upload(
+            self.upload(), BytesIO(self.content)
+        )
+
+        self.assertEqual(name, self.name)
+        with self.storage.open(name) as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_receive_upload_size_mismatch(self):
+        """Test that uploads of another size than signed are rejected"""
+        for size in (len(self.content) - 1, len(self.content) + 1):
+            with self.assertRaises(storage.UploadRejected):
+                self.storage.receive_upload(
+                    self.upload(size=size), BytesIO(self.content)
+                )
+
+        self.assertFalse(self.storage.exists(self.name))
+
+    def test_receive_upload_hash_mismatch(self):
+        """Test that uploads with another hash than signed are rejected"""
+        with self.assertRaises(storage.UploadRejected):
+            self.storage.receive_upload(
+                self.upload(sha256='0' * 64), BytesIO(self.content)
+            )
+
+        self.assertFalse(self.storage.exists(self.name))
+
+    def test_receive_upload_expired(self):
+        """Test that expired upload URLs are refused"""
+        with self.assertRaises(signing.BadSignature):
+            self.storage.receive_upload(
+                self.upload(expires_in=-1), BytesIO(self.content)
+            )
+
+    def test_receive_upload_tampered(self):
+        """Test that tampered upload tokens are refused"""
+        with self.assertRaises(signing.BadSignature):
+            self.storage.receive_upload(
+                self.upload() + 'x', BytesIO(self.content)
+            )
+
+
+@override_settings(
+    S3_BUCKET='recipes',
+    S3_REGION='us-east-1',
+    S3_ENDPOINT_URL=None,
+    S3_PUBLIC_URL=''
+)
+class S3StorageTests(SimpleTestCase):
+
+    def setUp(self):
+        from botocore.stub import Stubber
+
+        credentials = patch.dict(os.environ, {
+            'AWS_ACCESS_KEY_ID': 'key',
+            'AWS_SECRET_ACCESS_KEY': 'secret',
+        })
+        credentials.start()
+        self.addCleanup(credentials.stop)
+        self.storage = storage.S3Storage()
+        self.stubber = Stubber(self.storage.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def test_exists(self):
+        """Test that exists checks the object's metadata"""
+        self.stubber.add_response(
+            'head_object',
+            {'ContentLength': 3},
+            {'Bucket': 'recipes', 'Key': 'a.jpg'}
+        )
+        self.stubber.add_client_error(
+            'head_object', '404', http_status_code=404
+        )
+
+        self.assertTrue(self.storage.exists('a.jpg'))
+        self.assertFalse(self.storage.exists('b.jpg'))
+
+    def test_open_missing(self):
+        """Test that opening a missing object raises FileNotFoundError,
+        like the other backends"""
+        self.stubber.add_client_error(
+            'head_object', '404', http_status_code=404
+        )
+
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('a.jpg')
+
+    def test_save_existing_name_kept(self):
+        """Test that saving a stored name does not upload it again but
+        touches it"""
+        self.stubber.add_response('head_object', {'ContentLength': 3})
+        self.stubber.add_response(
+            'copy_object',
+            {},
+            {
+                'Bucket': 'recipes',
+                'Key': 'a.jpg',
+                'CopySource': {'Bucket': 'recipes', 'Key': 'a.jpg'},
+                'MetadataDirective': 'REPLACE',
+                'ContentType': 'image/jpeg',
+            }
+        )
+
+        name = self.storage.save('a.jpg', ContentFile(b'abc'))
+
+        self.assertEqual(name, 'a.jpg')
+        self.stubber.assert_no_pending_responses()
+
+    def test_read_start(self):
+        """Test that the start of an object is read with a range request"""
+        from botocore.response import StreamingBody
+
+        self.stubber.add_response(
+            'get_object',
+            {'Body': StreamingBody(BytesIO(b'\x89PNG'), 4)},
+            {'Bucket': 'recipes', 'Key': 'a.png', 'Range': 'bytes=0-3'}
+        )
+        self.stubber.add_client_error(
+            'get_object', 'NoSuchKey', http_status_code=404
+        )
+
+        self.assertEqual(self.storage.read_start('a.png', 4), b'\x89PNG')
+        with self.assertRaises(FileNotFoundError):
+            self.storage.read_start('b.png', 4)
+
+    def test_listdir(self):
+        """Test listing the files and directories under a prefix"""
+        self.stubber.add_response(
+            'list_objects_v2',
+            {
+                'CommonPrefixes': [{'Prefix': 'uploads/recipe/old/'}],
+                'Contents': [{'Key': 'uploads/recipe/a.jpg'}],
+            },
+            {'Bucket': 'recipes', 'Prefix': 'uploads/recipe/',
+             'Delimiter': '/'}
+        )
+
+        self.assertEqual(
+            self.storage.listdir('uploads/recipe'), (['old'], ['a.jpg'])
+        )
+
+    def test_url_public(self):
+        """Test that images are linked from the public URL when set"""
+        self.storage.public_url = 'https://cdn.example.com/'
+
+        self.assertEqual(
+            self.storage.url('uploads/recipe/a.jpg'),
+            'https://cdn.example.com/uploads/recipe/a.jpg'
+        )
+
+    def test_url_presigned(self):
+        """Test that images are linked by presigned URL by default"""
+        url = urlparse(self.storage.url('uploads/recipe/a.jpg'))
+
+        self.assertTrue(url.path.endswith('/uploads/recipe/a.jpg'))
+        self.assertIn('X-Amz-Signature', parse_qs(url.query))
+
+    def test_upload_url_signs_checksum(self):
+        """Test that upload URLs make the store check the body's
+        checksum"""
+        sha256 = hashlib.sha256(b'abc').hexdigest()
+
+        upload = self.storage.upload_url(
+            'uploads/recipe/a.jpg', 'image/jpeg', 3, sha256, 60
+        )
+
+        self.assertEqual(upload['method'], 'PUT')
+        self.assertEqual(
+            upload['headers']['x-amz-checksum-sha256'],
+            base64.b64encode(hashlib.sha256(b'abc').digest()).decode()
+        )
+        signed = parse_qs(urlparse(upload['url']).query)[
+            'X-Amz-SignedHeaders'
+        ][0]
+        self.assertIn('x-amz-checksum-sha256', signed)
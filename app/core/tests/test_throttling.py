@@ -0,0 +1,212 @@
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+
+from core import throttling
+from core.jobs import runner
+from core.models import Recipe, ThrottleRejection
+from recipe.views import RecipeViewSet
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class BucketTests(SimpleTestCase):
+
+    def assertBucketRefills(self, buckets, clock):
+        with patch(clock, return_value=100.0):
+            self.assertEqual(buckets.take('key', 2, 1.0), 0)
+            self.assertEqual(buckets.take('key', 2, 1.0), 0)
+            self.assertEqual(buckets.take('key', 2, 1.0), 1.0)
+        with patch(clock, return_value=100.5):
+            self.assertEqual(buckets.take('key', 2, 1.0), 0.5)
+        with patch(clock, return_value=101.0):
+            self.assertEqual(buckets.take('key', 2, 1.0), 0)
+
+    def test_local_bucket(self):
+        """Test that local buckets allow bursts and refill over time"""
+        self.assertBucketRefills(
+            throttling.LocalBuckets(), 'core.throttling.time.monotonic'
+        )
+
+    def test_cache_bucket(self):
+        """Test that cache buckets allow bursts and refill over time"""
+        buckets = throttling.CacheBuckets('throttle')
+        buckets.reset()
+        self.assertBucketRefills(buckets, 'core.throttling.time.time')
+
+    def test_cache_bucket_atomic(self):
+        """Test that racing requests can't take more tokens than a cache
+        bucket holds"""
+        buckets = throttling.CacheBuckets('throttle')
+        buckets.reset()
+        get = LocMemCache.get
+        granted = []
+
+        def slow_get(cache, *args, **kwargs):
+            value = get(cache, *args, **kwargs)
+            time.sleep(0.005)
+            return value
+
+        def take():
+            if not buckets.take('key', 3, 1e-6):
+                granted.append(True)
+
+        with patch.object(LocMemCache, 'get', slow_get), \
+                patch('core.throttling.LOCK_WAIT', 5):
+            threads = [threading.Thread(target=take) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(granted), 3)
+
+    @patch('core.throttling.LOCK_WAIT', 0.01)
+    def test_cache_bucket_busy(self):
+        """Test that a bucket locked for too long rejects the request"""
+        buckets = throttling.CacheBuckets('throttle')
+        buckets.reset()
+        caches['throttle'].add('key:lock', 1)
+
+        self.assertEqual(buckets.take('key', 2, 1.0), 1.0)
+
+    def test_local_buckets_pruned(self):
+        """Test that full buckets are dropped once there are too many"""
+        buckets = throttling.LocalBuckets()
+        buckets.max_buckets = 2
+        with patch('core.throttling.time.monotonic', return_value=0.0):
+            buckets.take('a', 1, 1.0)
+            buckets.take('b', 1, 1.0)
+        with patch('core.throttling.time.monotonic', return_value=10.0):
+            buckets.take('c', 1, 1.0)
+
+        self.assertEqual(list(buckets._buckets), ['c'])
+
+
+@override_settings(JOBS_EAGER=True)
+class ThrottleApiTests(TestCase):
+
+    def setUp(self):
+        throttling.reset_buckets()
+        # Rejections of earlier tests are saved in the background: take
+        # those still queued into this test's transaction, and drop those
+        # saved already
+        runner.flush()
+        ThrottleRejection.objects.all().delete()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_reads_throttled_per_user(self):
+        """Test that each user has their own read bucket"""
+        other_client = APIClient()
+        other_client.force_authenticate(
+            get_user_model().objects.create_user(
+                'other@unittest.com',
+                'password123'
+            )
+        )
+        rejected = throttling.rejections['read']
+
+        with patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                        {'read': '2/min'}):
+            for _ in range(2):
+                resp = self.client.get(TAGS_URL)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.get(TAGS_URL)
+            self.assertEqual(resp.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', resp)
+
+            resp = other_client.get(TAGS_URL)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.post(TAGS_URL, {'name': 'Vegan'})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(throttling.rejections['read'], rejected + 1)
+        self.assertEqual(throttling.rejection_counts()['read'], 1)
+
+    def test_save_rejections(self):
+        """Test that batches of rejections add up per scope"""
+        for _ in range(2):
+            throttling.save_rejections(['read', 'write', 'read'])
+
+        counts = throttling.rejection_counts()
+        self.assertEqual(counts['read'], 4)
+        self.assertEqual(counts['write'], 2)
+        self.assertEqual(counts['upload'], 0)
+
+    def test_throttle_stats_command(self):
+        """Test that the command reports the rejections of each scope"""
+        with patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                        {'write': '1/min'}):
+            for _ in range(3):
+                self.client.post(TAGS_URL, {'name': 'Vegan'})
+        out = StringIO()
+
+        call_command('throttle_stats', stdout=out)
+
+        self.assertIn('write: 2\n', out.getvalue())
+        self.assertIn('read: 0\n', out.getvalue())
+
+    def test_uploads_have_own_scope(self):
+        """Test that uploads count against the upload scope only"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=5.00
+        )
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+
+        with patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                        {'upload': '1/min', 'write': '100/min'}):
+            self.client.post(url, {'image': 'notimage'})
+            resp = self.client.post(url, {'image': 'notimage'})
+            self.assertEqual(resp.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+
+            resp = self.client.post(TAGS_URL, {'name': 'Vegan'})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_rates_overridden_per_view(self):
+        """Test that a view can set its own rates"""
+        with patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                        {'read': '1/min'}), \
+                patch.object(RecipeViewSet, 'throttle_rates',
+                             {'read': None}, create=True):
+            for _ in range(3):
+                resp = self.client.get(RECIPES_URL)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+            self.client.get(TAGS_URL)
+            resp = self.client.get(TAGS_URL)
+            self.assertEqual(resp.status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(THROTTLE_BACKEND='cache')
+    def test_worker_limit_with_cache_backend(self):
+        """Test that the worker limit is shared by all clients"""
+        throttling.reset_buckets()
+        with patch.dict(api_settings.DEFAULT_THROTTLE_RATES,
+                        {'worker': '1/min'}):
+            self.client.get(TAGS_URL)
+            resp = APIClient().post(
+                reverse('user:token'),
+                {'email': 'test@unittest.com', 'password': 'password123'}
+            )
+
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
@@ -0,0 +1,119 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+class MediaViewTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root.name
+        )
+        self.settings_override.enable()
+        os.makedirs(os.path.join(self.media_root.name, 'uploads/recipe'))
+        self.path = 'uploads/recipe/abc123.jpg'
+        with open(os.path.join(self.media_root.name, self.path), 'wb') as f:
+            f.write(b'0123456789')
+        self.url = reverse('media', args=[self.path])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def test_serve_media_cacheable(self):
+        """Test that media is served with immutable cache headers"""
+        resp = self.client.get(self.url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b''.join(resp.streaming_content), b'0123456789')
+        self.assertIn('immutable', resp['Cache-Control'])
+        self.assertEqual(resp['ETag'], '"abc123"')
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+
+    def test_serve_media_not_modified(self):
+        """Test that a matching ETag returns 304"""
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH='"abc123"')
+
+        self.assertEqual(resp.status_code, 304)
+
+    def test_serve_media_not_modified_etag_list(self):
+        """Test that weak and listed ETags match too"""
+        for header in ('W/"abc123"', '"old", "abc123"', '*'):
+            resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=header)
+
+            self.assertEqual(resp.status_code, 304)
+
+    def test_serve_media_modified(self):
+        """Test that other ETags get the file"""
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH='"old"')
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_serve_media_range(self):
+        """Test that a byte range returns partial content"""
+        resp = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(b''.join(resp.streaming_content), b'2345')
+        self.assertEqual(resp['Content-Range'], 'bytes 2-5/10')
+
+    def test_serve_media_suffix_range(self):
+        """Test that a suffix byte range returns the end of the file"""
+        resp = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(b''.join(resp.streaming_content), b'789')
+
+    def test_serve_media_unsatisfiable_range(self):
+        """Test that a range outside the file returns 416"""
+        resp = self.client.get(self.url, HTTP_RANGE='bytes=20-30')
+
+        self.assertEqual(resp.status_code, 416)
+
+    def test_serve_media_accel_redirect(self):
+        """Test that media is handed to the front end server if set up"""
+        with self.settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected/'):
+            resp = self.client.get(self.url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['X-Accel-Redirect'], f'/protected/{self.path}')
+        self.assertEqual(resp.content, b'')
+
+    def test_serve_media_missing(self):
+        """Test that unknown or escaping paths return 404"""
+        missing = self.client.get(reverse('media', args=['nope.jpg']))
+        escaping = self.client.get(reverse('media', args=['../etc/passwd']))
+
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(escaping.status_code, 404)
+
+
+class HealthzViewTests(TestCase):
+
+    def test_healthz_ok(self):
+        """Test that the health check reports ready with a database"""
+        resp = self.client.get(reverse('healthz'))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {'status': 'ok'})
+
+    def test_healthz_database_unavailable(self):
+        """Test that the health check fails without a database"""
+        with patch(
+            'core.views.connection.ensure_connection',
+            side_effect=OperationalError
+        ):
+            resp = self.client.get(reverse('healthz'))
+
+        self.assertEqual(resp.status_code, 503)
+
+    def test_healthz_safe_methods_only(self):
+        """Test that the health check only accepts safe methods"""
+        resp = self.client.post(reverse('healthz'))
+
+        self.assertEqual(resp.status_code, 405)
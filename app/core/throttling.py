@@ -0,0 +1,265 @@
+"""Token bucket rate limiting for the API.
+
+Every client gets one bucket per scope, holding up to as many tokens as the
+scope's rate allows per period and refilled continuously at that rate. A
+request takes a token, so bursts up to the full rate pass while the average
+stays under it. Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] and
+can be overridden per view with a `throttle_rates` dict, where None turns a
+scope off.
+
+Buckets are kept in process memory by default, so each worker limits the
+requests it serves by itself. With THROTTLE_BACKEND set to 'cache' they are
+kept in the THROTTLE_CACHE cache, shared by the workers using it.
+
+Rejected requests are counted per scope in the database, in batches the job
+runner writes, so the throttle_stats command reports those of every worker.
+"""
+import logging
+import math
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from core.jobs import runner
+from core.models import ThrottleRejection
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Rejected requests per scope since the process started
+rejections = Counter()
+
+# Seconds a cache bucket's lock is kept when its holder dies
+LOCK_TIMEOUT = 1
+# Seconds to wait for a busy cache bucket before rejecting the request
+LOCK_WAIT = 0.1
+LOCK_POLL_INTERVAL = 0.002
+
+
+def parse_rate(rate):
+    """Return the (capacity, tokens per second) of a rate such as '100/min'"""
+    number, period = rate.split('/')
+    capacity = int(number)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def _take(bucket, capacity, refill_rate, now):
+    """Take a token from a (tokens, updated) bucket, returning the new
+    bucket and the seconds to wait, zero when the token was granted"""
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+
+    return (tokens, now), (1 - tokens) / refill_rate
+
+
+class LocalBuckets:
+    """Buckets in process memory, for single node deployments. There is no
+    lock: a bucket is read and replaced as one tuple, which the GIL keeps
+    whole, so racing requests can at worst both take the last token."""
+    max_buckets = 100000
+
+    def __init__(self):
+        self._buckets = {}
+
+    def take(self, key, capacity, refill_rate):
+        now = time.monotonic()
+        stored = self._buckets.get(key)
+        bucket, wait = _take(
+            stored and stored[:2], capacity, refill_rate, now
+        )
+        self._buckets[key] = bucket + (
+            now + (capacity - bucket[0]) / refill_rate,
+        )
+        if len(self._buckets) > self.max_buckets:
+            self._prune(now)
+
+        return wait
+
+    def _prune(self, now):
+        """Drop the buckets that have refilled completely"""
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                self._buckets.pop(key, None)
+
+    def reset(self):
+        self._buckets.clear()
+
+
+class CacheBuckets:
+    """Buckets in a Django cache, shared by every node using it. A bucket
+    is read and written under a lock taken with cache.add, so requests
+    racing on different nodes can't both take its last token."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, capacity, refill_rate):
+        cache = caches[self.alias]
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(lock, 1, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                # Too busy to tell: reject as if the bucket were empty
+                return 1 / refill_rate
+            time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            bucket, wait = _take(
+                cache.get(key), capacity, refill_rate, time.time()
+            )
+            cache.set(
+                key,
+                bucket,
+                math.ceil((capacity - bucket[0]) / refill_rate) + 1
+            )
+        finally:
+            cache.delete(lock)
+
+        return wait
+
+    def reset(self):
+        caches[self.alias].clear()
+
+
+_backends = {}
+
+
+def get_buckets():
+    """Return the bucket store selected by THROTTLE_BACKEND"""
+    if settings.THROTTLE_BACKEND not in _backends:
+        if settings.THROTTLE_BACKEND == 'cache':
+            _backends['cache'] = CacheBuckets(settings.THROTTLE_CACHE)
+        else:
+            _backends['local'] = LocalBuckets()
+
+    return _backends[settings.THROTTLE_BACKEND]
+
+
+def reset_buckets():
+    """Refill every bucket"""
+    get_buckets().reset()
+
+
+def save_rejections(scopes):
+    """Add rejected requests, one scope per request, to the stored
+    counts"""
+    for scope, count in Counter(scopes).items():
+        ThrottleRejection.objects.get_or_create(scope=scope)
+        ThrottleRejection.objects.filter(scope=scope).update(
+            count=F('count') + count
+        )
+
+
+def record_rejection(scope):
+    """Count a rejected request of a scope, in this process and in the
+    database"""
+    rejections[scope] += 1
+    runner.enqueue(save_rejections, scope)
+
+
+def rejection_counts():
+    """Return the rejected requests per throttled scope counted by every
+    worker"""
+    counts = dict(
+        ThrottleRejection.objects.values_list('scope', 'count')
+    )
+    return {
+        scope: counts.get(scope, 0)
+        for scope in sorted(api_settings.DEFAULT_THROTTLE_RATES)
+    }
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle taking one token per request from the client's bucket"""
+    scope = None
+
+    def get_rate(self, view):
+        rates = getattr(view, 'throttle_rates', {})
+        if self.scope in rates:
+            return rates[self.scope]
+
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def applies(self, request, view):
+        """Return whether the request counts against this scope"""
+        return True
+
+    def get_cache_key(self, request, view):
+        """Return the key of the client's bucket, or None not to throttle
+        the request"""
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+
+        return f'throttle:{self.scope}:{ident}'
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        rate = self.get_rate(view)
+        if rate is None or not self.applies(request, view):
+            return True
+
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        wait = get_buckets().take(key, *parse_rate(rate))
+        if not wait:
+            return True
+
+        self.wait_time = wait
+        record_rejection(self.scope)
+        logger.info('Throttled %s request for %s', self.scope, key)
+        return False
+
+    def wait(self):
+        return self.wait_time
+
+
+class ReadThrottle(TokenBucketThrottle):
+    """Limit the reads of each client"""
+    scope = 'read'
+
+    def applies(self, request, view):
+        return request.method in SAFE_METHODS
+
+
+class UploadThrottle(TokenBucketThrottle):
+    """Limit the uploads of each client, made through the actions a view
+    lists in `upload_actions`"""
+    scope = 'upload'
+
+    def applies(self, request, view):
+        return getattr(view, 'action', None) in getattr(
+            view, 'upload_actions', ()
+        )
+
+
+class WriteThrottle(UploadThrottle):
+    """Limit the writes other than uploads of each client"""
+    scope = 'write'
+
+    def applies(self, request, view):
+        return (request.method not in SAFE_METHODS and
+                not super().applies(request, view))
+
+
+class WorkerThrottle(TokenBucketThrottle):
+    """Limit the requests of all clients together, as served by one worker
+    with the local backend, or by every worker sharing THROTTLE_CACHE with
+    the cache backend"""
+    scope = 'worker'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}'
@@ -0,0 +1,178 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import DatabaseError, connection
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+    JsonResponse, StreamingHttpResponse
+)
+from django.utils._os import safe_join
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_safe
+
+from core.storage import UploadRejected, get_recipe_image_storage
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _read_range(fh, start, length):
+    """Yield `length` bytes of an open file starting at `start`, closing
+    it afterwards"""
+    with fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header, size):
+    """Return the (start, end) byte positions of a single range request,
+    or None when the header can't be satisfied"""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        return None
+
+    return start, end
+
+
+def _etag_matches(header, etag):
+    """Return whether an If-None-Match header matches an ETag, using the
+    weak comparison RFC 7232 asks for"""
+    if not header:
+        return False
+
+    tags = parse_etags(header)
+    if tags == ['*']:
+        return True
+
+    def opaque(tag):
+        return tag[2:] if tag.startswith('W/') else tag
+
+    return opaque(etag) in {opaque(tag) for tag in tags}
+
+
+def serve_file(request, path, accel_path=None, etag=None,
+               cache_control=None, fh=None):
+    """Return a response serving a file from disk, with long lived cache
+    headers unless `cache_control` is given. The file is handed to the
+    front end server through X-Accel-Redirect when `accel_path` is given,
+    and otherwise sent with the server's file wrapper (sendfile) or as a
+    single byte range.
+
+    The file is opened once, so it is served whole even if it is removed
+    meanwhile. `fh` is an already open file of `path` to serve instead."""
+    if fh is None:
+        try:
+            fh = open(path, 'rb')
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            raise Http404()
+
+    if etag and _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        fh.close()
+        response = HttpResponseNotModified()
+    elif accel_path:
+        fh.close()
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = accel_path
+        response['Content-Type'] = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        )
+    else:
+        size = os.fstat(fh.fileno()).st_size
+        byte_range = request.META.get('HTTP_RANGE')
+        if byte_range:
+            bounds = _parse_range(byte_range, size)
+            if bounds is None:
+                fh.close()
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+            start, end = bounds
+            response = StreamingHttpResponse(
+                _read_range(fh, start, end - start + 1),
+                status=206,
+                content_type=(
+                    mimetypes.guess_type(path)[0] or
+                    'application/octet-stream'
+                )
+            )
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            response = FileResponse(fh)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Cache-Control'] = cache_control or (
+        f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+    )
+    if etag:
+        response['ETag'] = etag
+
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve an uploaded media file. Uploaded files are named after a hash
+    of their content, so they never change and can be cached forever."""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404()
+
+    accel_path = None
+    if settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+        accel_path = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+    etag = '"{}"'.format(os.path.splitext(os.path.basename(path))[0])
+
+    return serve_file(request, fullpath, accel_path=accel_path, etag=etag)
+
+
+@require_safe
+def healthz(request):
+    """Report whether the process is ready to serve requests: the app is
+    loaded and the database accepts connections"""
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return JsonResponse({'status': 'unavailable'}, status=503)
+
+    return JsonResponse({'status': 'ok'})
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def receive_upload(request, token):
+    """Store a file uploaded to a signed URL handed out by a storage
+    receiving uploads itself. The signed token authorizes the upload."""
+    storage = get_recipe_image_storage()
+    if not hasattr(storage, 'receive_upload'):
+        raise Http404()
+
+    try:
+        storage.receive_upload(token, request)
+    except signing.BadSignature:
+        return HttpResponse(status=403)
+    except UploadRejected as exc:
+        return HttpResponse(str(exc), status=400, content_type='text/plain')
+
+    return HttpResponse(status=201)
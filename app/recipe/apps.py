@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class RecipeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe'
+
+    def ready(self):
+        from PIL import Image
+
+        from recipe import signals  # noqa: F401
+
+        # Pillow only warns past MAX_IMAGE_PIXELS and refuses images with
+        # twice as many
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS // 2
@@ -0,0 +1,69 @@
+"""Ready to serve detail payloads of recipes, kept on Recipe.detail_cache.
+
+A payload is rebuilt in the transaction of every write changing it: a save
+of the recipe, a change of its tags or ingredients, or the deletion of one
+of those. Renaming a tag or ingredient can touch many recipes, so the job
+runner rebuilds their payloads once the rename commits. Recipes are then
+read from their own row only.
+While RECIPE_DETAIL_CACHE is off, the same writes drop the payload instead.
+Recipes without a payload (from before it existed, or written while the
+setting was off) are served the usual way until `refresh_recipe_details`
+fills them in. A rename job lost with its process leaves payloads showing
+the old name, which `refresh_recipe_details --all` rebuilds.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from core.models import Recipe
+
+from recipe import serializers
+
+# Recipe columns the payload is built from
+DETAIL_FIELDS = frozenset(
+    serializers.RecipeDetailSerializer.Meta.fields
+) - {'id', 'tags', 'ingredients'}
+
+
+def build_detail(recipe):
+    """Return the detail payload of a recipe"""
+    return serializers.RecipeDetailSerializer(
+        recipe,
+        context={'detail_cache': False}
+    ).data
+
+
+def refresh_detail(recipe):
+    """Rebuild and store the payload of a recipe instance, unless it is
+    unchanged, or drop it while payloads are off"""
+    detail = build_detail(recipe) if settings.RECIPE_DETAIL_CACHE else None
+    if detail == recipe.detail_cache:
+        return
+
+    recipe.detail_cache = detail
+    # The user narrows the update to one partition of a partitioned table
+    Recipe.objects.filter(
+        pk=recipe.pk, user_id=recipe.user_id
+    ).update(detail_cache=detail)
+
+
+def refresh_details(recipe_ids):
+    """Rebuild and store the payloads of recipes, a batch at a time, or
+    drop them while payloads are off. Each batch is locked while it is
+    rebuilt, so a recipe written meanwhile doesn't get a payload built
+    from its previous version."""
+    recipe_ids = sorted(set(recipe_ids))
+    if not settings.RECIPE_DETAIL_CACHE:
+        Recipe.objects.filter(
+            id__in=recipe_ids, detail_cache__isnull=False
+        ).update(detail_cache=None)
+        return
+
+    batch_size = settings.RECIPE_DETAIL_BATCH_SIZE
+    for start in range(0, len(recipe_ids), batch_size):
+        with transaction.atomic():
+            recipes = list(Recipe.objects.select_for_update().filter(
+                id__in=recipe_ids[start:start + batch_size]
+            ).order_by('id').prefetch_related('tags', 'ingredients'))
+            for recipe in recipes:
+                recipe.detail_cache = build_detail(recipe)
+            Recipe.objects.bulk_update(recipes, ['detail_cache'])
@@ -0,0 +1,142 @@
+"""Facts about recipe images: size, format, dominant color and a
+perceptual hash.
+
+The hash is a difference hash (dHash) of 64 bits: the image is shrunk to
+9x8 grey pixels and every bit records whether a pixel is brighter than its
+right neighbour. Resizing, recompressing or slightly retouching a photo
+flips few bits, so copies of the same photo have hashes a small Hamming
+distance apart.
+"""
+import logging
+from collections import defaultdict
+
+from PIL import Image
+
+from core.storage import get_recipe_image_storage
+
+logger = logging.getLogger(__name__)
+
+# Bytes image_type needs from the start of a file
+SIGNATURE_LENGTH = 12
+HASH_BITS = 64
+# Side of the thumbnail the dominant color is picked from
+COLOR_SAMPLE_SIZE = 64
+PALETTE_SIZE = 5
+
+
+def image_type(header):
+    """Return the file extension of the image type the first
+    SIGNATURE_LENGTH bytes of a file show, or None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+
+    return None
+
+
+def dhash(image):
+    """Return the difference hash of an image as 16 hex digits"""
+    grey = image.convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(grey.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = value << 1 | (left > right)
+
+    return f'{value:016x}'
+
+
+def dominant_color(image):
+    """Return the most common color of an image as #rrggbb, after reducing
+    it to a small palette"""
+    sample = image.convert('RGB')
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    quantized = sample.quantize(colors=PALETTE_SIZE)
+    _, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    red, green, blue = palette[index * 3:index * 3 + 3]
+
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def extract_metadata(fh):
+    """Return the width, height, format, dominant color and hash of the
+    image in a file"""
+    image = Image.open(fh)
+    width, height = image.size
+    metadata = {
+        'image_width': width,
+        'image_height': height,
+        'image_format': (image.format or '').lower(),
+    }
+    # Both are computed from a small version, which JPEG can decode to
+    # directly
+    image.draft('RGB', (COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    image.load()
+    metadata['image_color'] = dominant_color(image)
+    metadata['image_hash'] = dhash(image)
+
+    return metadata
+
+
+def read_metadata(name):
+    """Return the metadata of a stored image, or None when it can't be
+    read. Runs in worker processes of the backfill too."""
+    try:
+        with get_recipe_image_storage().open(name) as fh:
+            return extract_metadata(fh)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning('Could not read image %s: %s', name, exc)
+        return None
+
+
+def find_duplicates(hashes, max_distance):
+    """Group ids whose hashes are at most `max_distance` bits apart, or
+    linked through such pairs.
+
+    `hashes` maps ids to hex hashes. Hashes are split into max_distance + 1
+    bands: two hashes that close are equal in at least one band, so only
+    hashes sharing a band are compared. Returns the sorted id groups with
+    more than one member.
+    """
+    ids_by_value = defaultdict(list)
+    for item_id, value in hashes.items():
+        ids_by_value[int(value, 16)].append(item_id)
+
+    bands = max_distance + 1
+    band_bits = -(-HASH_BITS // bands)
+    mask = (1 << band_bits) - 1
+    buckets = defaultdict(list)
+    for value in ids_by_value:
+        for band in range(bands):
+            buckets[band, value >> (band * band_bits) & mask].append(value)
+
+    # Union find over the hash values found close to each other
+    parents = {value: value for value in ids_by_value}
+
+    def root(value):
+        while parents[value] != value:
+            parents[value] = parents[parents[value]]
+            value = parents[value]
+        return value
+
+    for values in buckets.values():
+        for index, first in enumerate(values):
+            for second in values[index + 1:]:
+                if (root(first) != root(second) and
+                        bin(first ^ second).count('1') <= max_distance):
+                    parents[root(second)] = root(first)
+
+    groups = defaultdict(list)
+    for value, item_ids in ids_by_value.items():
+        groups[root(value)].extend(item_ids)
+
+    return sorted(
+        sorted(group) for group in groups.values() if len(group) > 1
+    )
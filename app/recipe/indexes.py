@@ -0,0 +1,438 @@
+"""In-process indexes over the tags and ingredients of each user's recipes.
+
+An index is built from the through tables the first time it is needed and
+then kept up to date from the m2m signals once the change commits. Every
+change also bumps a version on the user's row in the same transaction, so
+other processes see their copy is stale and rebuild it on next use.
+"""
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Recipe, User
+
+TAG = 't'
+INGREDIENT = 'i'
+
+
+def current_version(user_id):
+    """Return the version of a user's recipe links"""
+    return User.objects.filter(id=user_id).values_list(
+        'recipe_index_version', flat=True
+    ).first() or 0
+
+
+def bump_version(user_id):
+    """Mark every copy of a user's indexes as stale and return the new
+    version. The user's row stays locked until the calling transaction
+    ends, so versions are bumped in commit order."""
+    users = User.objects.filter(id=user_id)
+    with transaction.atomic():
+        users.update(recipe_index_version=F('recipe_index_version') + 1)
+        return users.values_list(
+            'recipe_index_version', flat=True
+        ).first() or 0
+
+
+def recipe_links(user_id):
+    """Yield the (recipe id, feature) pairs of all of a user's recipes"""
+    tags = Recipe.tags.through.objects.filter(
+        recipe__user_id=user_id
+    ).values_list('recipe_id', 'tag_id')
+    for recipe_id, tag_id in tags.iterator():
+        yield recipe_id, (TAG, tag_id)
+
+    ingredients = Recipe.ingredients.through.objects.filter(
+        recipe__user_id=user_id
+    ).values_list('recipe_id', 'ingredient_id')
+    for recipe_id, ingredient_id in ingredients.iterator():
+        yield recipe_id, (INGREDIENT, ingredient_id)
+
+
+class UserIndexCache:
+    """Bounded LRU cache of one index per user"""
+
+    def __init__(self, index_class):
+        self.index_class = index_class
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def get(self, user_id):
+        """Return an up to date index for a user, building it if needed"""
+        version = current_version(user_id)
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(user_id)
+                return entry[1]
+
+        index = self.index_class(recipe_links(user_id))
+        with self._lock:
+            self._indexes[user_id] = (version, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > settings.RECIPE_INDEX_MAX_USERS:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def apply(self, user_id, previous_version, version, change):
+        """Apply a committed change to the cached index of a user, or drop
+        it if it missed an earlier change"""
+        with self._lock:
+            entry = self._indexes.get(user_id)
+            if entry is None:
+                return
+            if entry[0] != previous_version:
+                del self._indexes[user_id]
+                return
+
+            change(entry[1])
+            self._indexes[user_id] = (version, entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+class RecipeFeatureIndex:
+    """Sparse recipe x feature matrix kept as both its rows (the features
+    of each recipe) and its columns (the recipes having each feature)"""
+
+    def __init__(self, links=()):
+        self.features = defaultdict(set)
+        self.recipes = defaultdict(set)
+        for recipe_id, feature in links:
+            self.add(recipe_id, feature)
+
+    def add(self, recipe_id, feature):
+        self.features[recipe_id].add(feature)
+        self.recipes[feature].add(recipe_id)
+
+    def remove(self, recipe_id, feature):
+        self.features[recipe_id].discard(feature)
+        self.recipes[feature].discard(recipe_id)
+
+    def remove_kind(self, recipe_id, kind):
+        for feature in list(self.features.get(recipe_id, ())):
+            if feature[0] == kind:
+                self.remove(recipe_id, feature)
+
+    def remove_recipe(self, recipe_id):
+        for feature in self.features.pop(recipe_id, ()):
+            self.recipes[feature].discard(recipe_id)
+
+    def remove_feature(self, feature):
+        for recipe_id in self.recipes.pop(feature, ()):
+            self.features[recipe_id].discard(feature)
+
+    def similar(self, recipe_id, limit=10, metric='jaccard'):
+        """Return up to `limit` (recipe id, score) pairs of the recipes
+        sharing most tags and ingredients with a recipe, best first"""
+        features = self.features.get(recipe_id, set())
+        overlap = Counter()
+        for feature in features:
+            overlap.update(self.recipes[feature])
+        overlap.pop(recipe_id, None)
+
+        scores = []
+        for other_id, shared in overlap.items():
+            other_size = len(self.features[other_id])
+            if metric == 'cosine':
+                score = shared / math.sqrt(len(features) * other_size)
+            else:
+                score = shared / (len(features) + other_size - shared)
+            scores.append((other_id, score))
+
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:limit]
+
+
+# Most values a group keeps as a sorted array before switching to a bitset
+ARRAY_MAX_SIZE = 4096
+BITSET_BYTES = 1 << 13
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _set_bits(bits):
+    """Return the positions of the set bits of an int, in order"""
+    digits = bin(bits)[:1:-1]
+    positions = []
+    index = digits.find('1')
+    while index >= 0:
+        positions.append(index)
+        index = digits.find('1', index + 1)
+    return positions
+
+
+class ArrayContainer:
+    """Sorted array of the low 16 bits of a sparse group's values"""
+
+    __slots__ = ('values',)
+
+    def __init__(self, values=()):
+        self.values = array('H', values)
+
+    def add(self, low):
+        """Add a value, returning whether it was missing"""
+        index = bisect_left(self.values, low)
+        if index < len(self.values) and self.values[index] == low:
+            return False
+        self.values.insert(index, low)
+        return True
+
+    def discard(self, low):
+        """Remove a value, returning whether it was there"""
+        index = bisect_left(self.values, low)
+        if index == len(self.values) or self.values[index] != low:
+            return False
+        del self.values[index]
+        return True
+
+    def __contains__(self, low):
+        index = bisect_left(self.values, low)
+        return index < len(self.values) and self.values[index] == low
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def copy(self):
+        return ArrayContainer(self.values)
+
+    def to_int(self):
+        data = bytearray(BITSET_BYTES)
+        for low in self.values:
+            data[low >> 3] |= 1 << (low & 7)
+        return int.from_bytes(data, 'little')
+
+
+class BitsetContainer:
+    """65536 bit bitset of the low 16 bits of a dense group's values,
+    changed in place"""
+
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, values=()):
+        self.bits = bytearray(BITSET_BYTES)
+        self.size = 0
+        for low in values:
+            self.add(low)
+
+    @classmethod
+    def from_int(cls, bits, size):
+        container = cls()
+        container.bits[:] = bits.to_bytes(BITSET_BYTES, 'little')
+        container.size = size
+        return container
+
+    def add(self, low):
+        """Add a value, returning whether it was missing"""
+        mask = 1 << (low & 7)
+        if self.bits[low >> 3] & mask:
+            return False
+        self.bits[low >> 3] |= mask
+        self.size += 1
+        return True
+
+    def discard(self, low):
+        """Remove a value, returning whether it was there"""
+        mask = 1 << (low & 7)
+        if not self.bits[low >> 3] & mask:
+            return False
+        self.bits[low >> 3] &= ~mask
+        self.size -= 1
+        return True
+
+    def __contains__(self, low):
+        return bool(self.bits[low >> 3] >> (low & 7) & 1)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(_set_bits(self.to_int()))
+
+    def copy(self):
+        container = BitsetContainer()
+        container.bits[:] = self.bits
+        container.size = self.size
+        return container
+
+    def to_int(self):
+        return int.from_bytes(self.bits, 'little')
+
+
+def _container(bits):
+    """Return the container holding the values of an int bitset, or None
+    when it is empty"""
+    size = _popcount(bits)
+    if not size:
+        return None
+    if size > ARRAY_MAX_SIZE:
+        return BitsetContainer.from_int(bits, size)
+
+    return ArrayContainer(_set_bits(bits))
+
+
+class RoaringBitmap:
+    """Compressed set of non-negative integers in the style of roaring
+    bitmaps: values are grouped by their high 16 bits, and every group
+    keeps its low 16 bits in a sorted array while it has at most
+    ARRAY_MAX_SIZE of them, or in a bitset once it is denser. Set
+    operations only touch groups both sides have."""
+
+    __slots__ = ('containers',)
+
+    def __init__(self, values=()):
+        self.containers = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        high = value >> 16
+        container = self.containers.get(high)
+        if container is None:
+            container = self.containers[high] = ArrayContainer()
+        if (container.add(value & 0xFFFF) and
+                isinstance(container, ArrayContainer) and
+                len(container) > ARRAY_MAX_SIZE):
+            self.containers[high] = BitsetContainer(container)
+
+    def discard(self, value):
+        high = value >> 16
+        container = self.containers.get(high)
+        if container is None or not container.discard(value & 0xFFFF):
+            return
+        if not container:
+            del self.containers[high]
+        elif (isinstance(container, BitsetContainer) and
+                len(container) <= ARRAY_MAX_SIZE):
+            self.containers[high] = ArrayContainer(container)
+
+    def __contains__(self, value):
+        container = self.containers.get(value >> 16)
+        return container is not None and value & 0xFFFF in container
+
+    def __and__(self, other):
+        result = RoaringBitmap()
+        for high, container in self.containers.items():
+            other_container = other.containers.get(high)
+            if other_container is None:
+                continue
+            small, large = sorted((container, other_container), key=len)
+            if isinstance(large, ArrayContainer):
+                values = sorted(set(small.values).intersection(large.values))
+            elif isinstance(small, ArrayContainer):
+                bits = large.bits
+                values = [
+                    low for low in small.values
+                    if bits[low >> 3] >> (low & 7) & 1
+                ]
+            else:
+                both = _container(small.to_int() & large.to_int())
+                if both is not None:
+                    result.containers[high] = both
+                continue
+            if values:
+                result.containers[high] = ArrayContainer(values)
+        return result
+
+    def __or__(self, other):
+        result = RoaringBitmap()
+        for high in self.containers.keys() | other.containers.keys():
+            container = self.containers.get(high)
+            other_container = other.containers.get(high)
+            if container is None or other_container is None:
+                either = container or other_container
+                result.containers[high] = either.copy()
+            elif isinstance(container, ArrayContainer) and isinstance(
+                    other_container, ArrayContainer) and (
+                    len(container) + len(other_container) <=
+                    ARRAY_MAX_SIZE):
+                result.containers[high] = ArrayContainer(
+                    sorted(set(container) | set(other_container))
+                )
+            elif isinstance(container, BitsetContainer) or isinstance(
+                    other_container, BitsetContainer):
+                result.containers[high] = _container(
+                    container.to_int() | other_container.to_int()
+                )
+            else:
+                result.containers[high] = BitsetContainer(
+                    set(container) | set(other_container)
+                )
+        return result
+
+    def __len__(self):
+        return sum(len(container) for container in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            for low in self.containers[high]:
+                yield high << 16 | low
+
+
+class RecipeBitmapIndex:
+    """Bitmap of recipe ids for every tag and ingredient of a user"""
+
+    def __init__(self, links=()):
+        self.bitmaps = defaultdict(RoaringBitmap)
+        for recipe_id, feature in links:
+            self.add(recipe_id, feature)
+
+    def add(self, recipe_id, feature):
+        self.bitmaps[feature].add(recipe_id)
+
+    def remove(self, recipe_id, feature):
+        if feature in self.bitmaps:
+            self.bitmaps[feature].discard(recipe_id)
+
+    def remove_kind(self, recipe_id, kind):
+        for feature, bitmap in self.bitmaps.items():
+            if feature[0] == kind:
+                bitmap.discard(recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        for bitmap in self.bitmaps.values():
+            bitmap.discard(recipe_id)
+
+    def remove_feature(self, feature):
+        self.bitmaps.pop(feature, None)
+
+    def _combine(self, features, require_all):
+        bitmaps = [self.bitmaps.get(feature, RoaringBitmap())
+                   for feature in features]
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap if require_all else result | bitmap
+        return result
+
+    def match(self, tag_ids=(), ingredient_ids=(), require_all=False):
+        """Return the sorted ids of the recipes having any (or, with
+        `require_all`, every) one of the tags, and any (or every) one of
+        the ingredients"""
+        groups = [
+            [(TAG, tag_id) for tag_id in tag_ids],
+            [(INGREDIENT, ingredient_id) for ingredient_id in ingredient_ids],
+        ]
+        result = None
+        for features in filter(None, groups):
+            matched = self._combine(features, require_all)
+            result = matched if result is None else result & matched
+
+        return list(result or ())
+
+
+feature_indexes = UserIndexCache(RecipeFeatureIndex)
+bitmap_indexes = UserIndexCache(RecipeBitmapIndex)
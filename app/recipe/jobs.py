@@ -0,0 +1,59 @@
+from collections import defaultdict
+
+from core.models import IMAGE_METADATA_FIELDS, Ingredient, Recipe, Tag
+
+from recipe.details import refresh_details
+from recipe.images import read_metadata
+
+
+def save_image_metadata(recipes, metadata):
+    """Set the metadata read for each image name on the recipes using it,
+    with one update per image, returning how many were set. Recipes whose
+    image was replaced since it was read are left alone."""
+    recipe_ids = defaultdict(list)
+    for recipe in recipes:
+        recipe_ids[recipe.image.name].append(recipe.id)
+
+    updated = 0
+    for name, facts in metadata.items():
+        if facts is None or name not in recipe_ids:
+            continue
+        updated += Recipe.objects.filter(
+            id__in=recipe_ids[name], image=name
+        ).update(**{field: facts[field] for field in IMAGE_METADATA_FIELDS})
+
+    # update() sends no signals, so the payloads are refreshed here
+    refresh_details([
+        recipe_id
+        for name, facts in metadata.items() if facts is not None
+        for recipe_id in recipe_ids.get(name, ())
+    ])
+    return updated
+
+
+def extract_image_metadata(recipe_ids):
+    """Extract the metadata of the images of recipes that were given a
+    new image, reading each distinct image once"""
+    recipes = list(Recipe.objects.filter(
+        id__in=recipe_ids
+    ).exclude(image='').exclude(image__isnull=True).only('id', 'image'))
+    metadata = {
+        name: read_metadata(name)
+        for name in {recipe.image.name for recipe in recipes}
+    }
+    save_image_metadata(recipes, metadata)
+
+
+def refresh_feature_details(features):
+    """Rebuild the detail payloads of the recipes of renamed tags and
+    ingredients, given as (model, id). The recipes are read now, so a
+    recipe unlinked since the rename is left alone."""
+    recipe_ids = set()
+    for model, field in ((Tag, 'tags'), (Ingredient, 'ingredients')):
+        ids = [pk for sender, pk in features if sender is model]
+        if ids:
+            recipe_ids.update(Recipe.objects.filter(
+                **{f'{field}__in': ids}
+            ).values_list('id', flat=True))
+
+    refresh_details(recipe_ids)
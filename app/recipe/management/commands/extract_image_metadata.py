@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+
+from recipe.images import read_metadata
+from recipe.jobs import save_image_metadata
+
+
+class Command(BaseCommand):
+    """Django command to extract the metadata of recipe images, reading
+    the images in parallel worker processes"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Extract every image again, not only the missing ones'
+        )
+
+    def batches(self, recipes, batch_size):
+        """Yield the recipes to extract, a batch at a time"""
+        last_id = 0
+        while True:
+            batch = list(recipes.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return
+            last_id = batch[-1].id
+            yield batch
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        recipes = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).only('id', 'image').order_by('id')
+        if not options['all']:
+            recipes = recipes.filter(image_hash='')
+        workers = options['workers']
+
+        total = extracted = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = None
+            for batch in self.batches(recipes, options['batch_size']):
+                names = sorted({recipe.image.name for recipe in batch})
+                # map() submits the whole batch right away, so the images
+                # are read while the previous batch is written
+                results = pool.map(
+                    read_metadata,
+                    names,
+                    chunksize=max(1, len(names) // (workers * 4))
+                )
+                if pending:
+                    extracted += self.save(*pending)
+                pending = (batch, names, results)
+                total += len(batch)
+            if pending:
+                extracted += self.save(*pending)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Extracted the metadata of {extracted} recipe images, '
+            f'{total - extracted} could not be read'
+        ))
+
+    def save(self, batch, names, results):
+        """Write the metadata of a batch, returning how many recipes got
+        it"""
+        return save_image_metadata(batch, dict(zip(names, results)))
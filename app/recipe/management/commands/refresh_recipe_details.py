@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from core.models import Recipe
+
+from recipe.details import refresh_details
+
+
+class Command(BaseCommand):
+    """Django command to rebuild the stored detail payloads of recipes"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every payload, not only the missing ones'
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        batch_size = options['batch_size']
+        recipes = Recipe.objects.order_by('id')
+        if not options['all']:
+            recipes = recipes.filter(detail_cache__isnull=True)
+        last_id = recipes.aggregate(last=Max('id'))['last']
+        refreshed = 0
+        start = 0
+        while last_id is not None and start < last_id:
+            recipe_ids = list(recipes.filter(
+                id__gt=start,
+                id__lte=start + batch_size
+            ).values_list('id', flat=True))
+            refresh_details(recipe_ids)
+            refreshed += len(recipe_ids)
+            start += batch_size
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Refreshed {refreshed} recipes')
+        )
@@ -0,0 +1,104 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginate on the view's (field, id) ordering. The cursor holds the
+    last row's values and the next page starts right after them, so pages
+    never scan skipped rows the way OFFSET does. Lists stay unpaginated
+    unless the client asks for a page size."""
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return None
+
+        return min(page_size, self.max_page_size) if page_size > 0 else None
+
+    def encode_cursor(self, values):
+        data = json.dumps(values).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, request, model):
+        """Return the ordering value and id of the cursor, converted by the
+        model's fields, or None when the request has no cursor"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None
+
+        try:
+            value, last_id = json.loads(base64.urlsafe_b64decode(cursor))
+            value = model._meta.get_field(self.field).to_python(value)
+            last_id = model._meta.pk.to_python(last_id)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None or last_id is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, last_id
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if self.page_size is None:
+            return None
+
+        self.request = request
+        self.field, self.descending = view.get_ordering()
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            value, last_id = cursor
+            after = 'lt' if self.descending else 'gt'
+            if self.field == 'id':
+                queryset = queryset.filter(**{f'id__{after}': last_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{self.field}__{after}': value}) |
+                    Q(**{self.field: value, f'id__{after}': last_id})
+                )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        last = self.page[-1]
+        value = getattr(last, self.field)
+        cursor = self.encode_cursor([str(value), last.id])
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -1,6 +1,36 @@
+import posixpath
+import re
+from collections import OrderedDict
+
+from django.conf import settings
+
 from rest_framework import serializers
 
-from core.models import Tag, Ingredient, Recipe
+from core.models import Tag, Ingredient, Recipe, recipe_image_name
+from core.storage import get_recipe_image_storage
+
+from recipe.images import SIGNATURE_LENGTH, image_type
+
+# Image types accepted for direct uploads, with their file extension
+IMAGE_UPLOAD_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UserOwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field only accepting objects owned by the request user"""
+
+    def get_queryset(self):
+        request = self.context.get('request')
+        queryset = super().get_queryset()
+        if request is None:
+            return queryset
+
+        return queryset.filter(user=request.user)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -23,11 +53,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for recipe objects"""
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserOwnedPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
@@ -35,8 +65,82 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredients', 'tags', 'time_minutes',
-                  'price', 'link')
-        read_only_fields = ('id',)
+                  'price', 'link', 'image_width', 'image_height',
+                  'image_color')
+        read_only_fields = ('id', 'image_width', 'image_height',
+                            'image_color')
+
+    def update(self, instance, validated_data):
+        """Update a recipe, writing only the columns that changed. Links are
+        replaced with set(), which only adds and removes the differences.
+        The detail payload is rebuilt once, after the links, and saved with
+        the columns in a single UPDATE."""
+        # recipe.details builds payloads with the serializers of this module
+        from recipe.details import build_detail
+
+        links = {
+            name: validated_data.pop(name)
+            for name in ('tags', 'ingredients')
+            if name in validated_data
+        }
+        changed = []
+        for name, value in validated_data.items():
+            field = instance._meta.get_field(name)
+            if field.is_relation:
+                current, value = getattr(instance, field.attname), value.pk
+                name = field.attname
+            else:
+                current = getattr(instance, name)
+            if current != value:
+                setattr(instance, name, value)
+                changed.append(name)
+
+        instance._detail_deferred = True
+        try:
+            for name, objects in links.items():
+                getattr(instance, name).set(objects)
+        finally:
+            del instance._detail_deferred
+
+        if changed or links:
+            # Payloads written while they are off would go stale
+            detail = None
+            if settings.RECIPE_DETAIL_CACHE:
+                detail = build_detail(instance)
+            if detail != instance.detail_cache:
+                instance.detail_cache = detail
+                changed.append('detail_cache')
+        if changed:
+            instance.save(update_fields=changed)
+
+        return instance
+
+    def get_cached_detail(self, instance):
+        """Return the stored detail payload of a recipe, if it may be
+        used"""
+        if (not settings.RECIPE_DETAIL_CACHE or
+                not self.context.get('detail_cache', True)):
+            return None
+
+        return getattr(instance, 'detail_cache', None)
+
+    def order_fields(self, detail):
+        """Return the fields of a stored payload in the serializer's order,
+        as the database may not keep it"""
+        return OrderedDict(
+            (field.field_name, detail.get(field.field_name))
+            for field in self._readable_fields
+        )
+
+    def to_representation(self, instance):
+        detail = self.get_cached_detail(instance)
+        if detail is None:
+            return super().to_representation(instance)
+
+        data = self.order_fields(detail)
+        data['ingredients'] = [item['id'] for item in detail['ingredients']]
+        data['tags'] = [item['id'] for item in detail['tags']]
+        return data
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -44,6 +148,26 @@ class RecipeDetailSerializer(RecipeSerializer):
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
+    def to_representation(self, instance):
+        detail = self.get_cached_detail(instance)
+        if detail is None:
+            return super(RecipeSerializer, self).to_representation(instance)
+
+        return self.order_fields(detail)
+
+
+class SimilarRecipeSerializer(RecipeSerializer):
+    """Serializer for a recipe with its similarity to another recipe"""
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('similarity',)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['similarity'] = instance.similarity
+        return data
+
 
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
@@ -52,3 +176,74 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+    def update(self, instance, validated_data):
+        """Replace the image, forgetting the facts about the old one until
+        they are extracted from the new one"""
+        instance.clear_image_metadata()
+        return super().update(instance, validated_data)
+
+
+class ImageUploadSerializer(serializers.Serializer):
+    """Serializer for requesting a URL to upload a recipe image to"""
+    content_type = serializers.ChoiceField(choices=list(IMAGE_UPLOAD_TYPES))
+    size = serializers.IntegerField(min_value=1)
+    sha256 = serializers.RegexField(
+        SHA256_RE,
+        error_messages={'invalid': 'Must be a lowercase hex SHA-256.'}
+    )
+
+    def validate_size(self, value):
+        if value > settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Must be at most {settings.IMAGE_UPLOAD_MAX_SIZE} bytes.'
+            )
+        return value
+
+    def validate(self, attrs):
+        attrs['name'] = recipe_image_name(
+            attrs['sha256'], IMAGE_UPLOAD_TYPES[attrs['content_type']]
+        )
+        return attrs
+
+
+class ImageConfirmSerializer(serializers.Serializer):
+    """Serializer for setting a directly uploaded image on a recipe"""
+    name = serializers.CharField(max_length=255)
+
+    def validate_name(self, value):
+        digest, _, ext = posixpath.basename(value).partition('.')
+        if (not SHA256_RE.match(digest) or
+                ext not in IMAGE_UPLOAD_TYPES.values() or
+                recipe_image_name(digest, ext) != value):
+            raise serializers.ValidationError('Not a recipe image name.')
+
+        storage = get_recipe_image_storage()
+        if not storage.exists(value):
+            raise serializers.ValidationError('Image was not uploaded.')
+        if storage.size(value) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('Image is too large.')
+        # The signed content type only named the extension, check that
+        # the uploaded bytes are an image of that type
+        if image_type(storage.read_start(value, SIGNATURE_LENGTH)) != ext:
+            raise serializers.ValidationError(
+                'Image is not of the uploaded type.'
+            )
+        # Keep the reapers off the file until the recipe refers to it
+        storage.touch(value)
+        return value
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    """Serializer for an ingredient aggregated across several recipes"""
+    id = serializers.IntegerField(source='ingredient_id', read_only=True)
+    name = serializers.CharField(source='ingredient__name', read_only=True)
+    recipe_count = serializers.IntegerField(read_only=True)
+
+
+class FacetSerializer(serializers.Serializer):
+    """Serializer for the number of filtered recipes having a tag or
+    ingredient"""
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    count = serializers.IntegerField(read_only=True)
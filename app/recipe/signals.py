@@ -0,0 +1,156 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from core.jobs import runner
+from core.models import Ingredient, Recipe, Tag
+
+from recipe.details import DETAIL_FIELDS, refresh_detail, refresh_details
+from recipe.indexes import (
+    INGREDIENT, TAG, bitmap_indexes, bump_version, feature_indexes
+)
+from recipe.jobs import refresh_feature_details
+
+
+def _update_indexes(user_id, change):
+    """Apply a change to the user's cached indexes once it commits"""
+    version = bump_version(user_id)
+
+    def apply():
+        for indexes in (feature_indexes, bitmap_indexes):
+            indexes.apply(user_id, version - 1, version, change)
+
+    transaction.on_commit(apply)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_indexes_for_links(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """Keep the indexes in step with changed recipe links"""
+    kind = TAG if sender is Recipe.tags.through else INGREDIENT
+    if action == 'pre_clear':
+        if reverse:
+            def change(index):
+                index.remove_feature((kind, instance.pk))
+        else:
+            def change(index):
+                index.remove_kind(instance.pk, kind)
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            links = [(pk, (kind, instance.pk)) for pk in pk_set]
+        else:
+            links = [(instance.pk, (kind, pk)) for pk in pk_set]
+        method = 'add' if action == 'post_add' else 'remove'
+
+        def change(index):
+            for recipe_id, feature in links:
+                getattr(index, method)(recipe_id, feature)
+    else:
+        return
+
+    _update_indexes(instance.user_id, change)
+
+
+@receiver(post_delete, sender=Recipe)
+def update_indexes_for_recipe(sender, instance, **kwargs):
+    """Drop a deleted recipe from the indexes"""
+    recipe_id = instance.pk
+    _update_indexes(
+        instance.user_id,
+        lambda index: index.remove_recipe(recipe_id)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def update_indexes_for_feature(sender, instance, **kwargs):
+    """Drop a deleted tag or ingredient from the indexes"""
+    feature = (TAG if sender is Tag else INGREDIENT, instance.pk)
+    _update_indexes(
+        instance.user_id,
+        lambda index: index.remove_feature(feature)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_saved_recipe_detail(sender, instance, update_fields, **kwargs):
+    """Rebuild the detail payload of a saved recipe, unless it was saved
+    with it"""
+    if update_fields is not None and (
+            'detail_cache' in update_fields or
+            DETAIL_FIELDS.isdisjoint(update_fields)):
+        return
+
+    refresh_detail(instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_relinked_recipe_details(sender, instance, action, reverse,
+                                    pk_set, **kwargs):
+    """Rebuild the detail payloads of recipes whose links changed, unless
+    the recipe's own update saves its payload afterwards"""
+    if not reverse and getattr(instance, '_detail_deferred', False):
+        return
+
+    if action == 'pre_clear' and reverse:
+        instance._detail_recipe_ids = list(
+            instance.recipe_set.values_list('id', flat=True)
+        )
+    elif action == 'post_clear' or (
+            action in ('post_add', 'post_remove') and pk_set):
+        if not reverse:
+            refresh_detail(instance)
+        elif action == 'post_clear':
+            refresh_details(instance.__dict__.pop('_detail_recipe_ids', ()))
+        else:
+            refresh_details(pk_set)
+
+
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def collect_renamed_feature(sender, instance, update_fields, **kwargs):
+    """Remember whether a saved tag or ingredient changes its name, the
+    only column the payloads show"""
+    if instance.pk is None:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+
+    name = sender.objects.filter(pk=instance.pk).values_list(
+        'name', flat=True
+    ).first()
+    instance._detail_renamed = name is not None and name != instance.name
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def refresh_renamed_feature_details(sender, instance, **kwargs):
+    """Have the job runner rebuild the detail payloads of the recipes of a
+    renamed tag or ingredient once the rename commits"""
+    if instance.__dict__.pop('_detail_renamed', False):
+        runner.enqueue_on_commit(
+            refresh_feature_details,
+            (sender, instance.pk)
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_unlinked_recipes(sender, instance, **kwargs):
+    """Remember the recipes of a tag or ingredient being deleted, as the
+    cascade doesn't send m2m_changed"""
+    instance._detail_recipe_ids = list(
+        instance.recipe_set.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_unlinked_recipe_details(sender, instance, **kwargs):
+    """Rebuild the detail payloads of the recipes of a deleted tag or
+    ingredient"""
+    refresh_details(instance.__dict__.pop('_detail_recipe_ids', ()))
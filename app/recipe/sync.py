@@ -0,0 +1,53 @@
+from django.db.models import Max
+
+from core.models import ChangeLogEntry, Ingredient, Recipe, Tag
+
+from recipe import serializers
+
+SYNC_KINDS = (
+    (ChangeLogEntry.RECIPE, 'recipes', Recipe,
+     serializers.RecipeSerializer),
+    (ChangeLogEntry.TAG, 'tags', Tag, serializers.TagSerializer),
+    (ChangeLogEntry.INGREDIENT, 'ingredients', Ingredient,
+     serializers.IngredientSerializer),
+)
+
+
+def build_sync_payload(user, since=None):
+    """Return the user's objects changed after sync position `since`,
+    along with the ids deleted since then and the new sync position.
+    Without a position every object is returned."""
+    entries = ChangeLogEntry.objects.filter(user=user)
+    full = since is None
+    if full:
+        # Read the position first, anything changing while the snapshot is
+        # taken is simply sent again on the next sync.
+        token = entries.aggregate(token=Max('id'))['token'] or 0
+        changed = {kind: None for kind, *_ in SYNC_KINDS}
+        deleted = {kind: set() for kind, *_ in SYNC_KINDS}
+    else:
+        latest = {}
+        token = since
+        for entry_id, kind, object_id, is_deleted in entries.filter(
+            id__gt=since
+        ).order_by('id').values_list('id', 'kind', 'object_id', 'deleted'):
+            latest[(kind, object_id)] = is_deleted
+            token = entry_id
+
+        changed = {kind: set() for kind, *_ in SYNC_KINDS}
+        deleted = {kind: set() for kind, *_ in SYNC_KINDS}
+        for (kind, object_id), is_deleted in latest.items():
+            (deleted if is_deleted else changed)[kind].add(object_id)
+
+    payload = {'token': token, 'full': full, 'deleted': {}}
+    for kind, key, model, serializer_class in SYNC_KINDS:
+        queryset = model.objects.filter(user=user).order_by('id')
+        if changed[kind] is not None:
+            queryset = queryset.filter(id__in=changed[kind])
+        if model is Recipe:
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+
+        payload[key] = serializer_class(queryset, many=True).data
+        payload['deleted'][key] = sorted(deleted[kind])
+
+    return payload
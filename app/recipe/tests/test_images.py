@@ -0,0 +1,266 @@
+import os
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.throttling import reset_buckets
+
+from recipe import images
+from recipe.jobs import extract_image_metadata, save_image_metadata
+from recipe.tests.utils import sample_recipe
+
+DUPLICATES_URL = reverse('recipe:recipe-duplicate-images')
+
+
+def sample_photo(size=(320, 240), fmt='JPEG', quality=90, seed=1):
+    """Return the bytes of a sample picture with some structure, mostly
+    red, that differs with the seed"""
+    image = Image.new('RGB', (320, 240), color=(200, 30, 30))
+    draw = ImageDraw.Draw(image)
+    for index in range(6):
+        offset = (index * 47 * seed) % 280
+        draw.ellipse(
+            [offset, 20 * index, offset + 40, 20 * index + 60],
+            fill=(30 * index, 200 - 20 * index, 40 * seed % 255)
+        )
+    image = image.resize(size)
+    output = BytesIO()
+    image.save(output, format=fmt, quality=quality)
+    return output.getvalue()
+
+
+class ImageMetadataTests(SimpleTestCase):
+
+    def test_extract_metadata(self):
+        """Test that size, format, color and hash are extracted"""
+        metadata = images.extract_metadata(BytesIO(sample_photo()))
+
+        self.assertEqual(metadata['image_width'], 320)
+        self.assertEqual(metadata['image_height'], 240)
+        self.assertEqual(metadata['image_format'], 'jpeg')
+        red, green, blue = (
+            int(metadata['image_color'][i:i + 2], 16) for i in (1, 3, 5)
+        )
+        self.assertGreater(red, 150)
+        self.assertLess(green, 80)
+        self.assertRegex(metadata['image_hash'], r'^[0-9a-f]{16}$')
+
+    def test_hash_survives_resizing_and_recompression(self):
+        """Test that copies of a photo have close hashes and other photos
+        distant ones"""
+        original = images.extract_metadata(BytesIO(sample_photo()))
+        copy = images.extract_metadata(BytesIO(
+            sample_photo(size=(160, 120), fmt='PNG')
+        ))
+        other = images.extract_metadata(BytesIO(sample_photo(seed=3)))
+
+        def distance(first, second):
+            return bin(
+                int(first['image_hash'], 16) ^ int(second['image_hash'], 16)
+            ).count('1')
+
+        self.assertLessEqual(distance(original, copy), 5)
+        self.assertGreater(distance(original, other), 10)
+
+    def test_find_duplicates(self):
+        """Test that ids are grouped by close hashes"""
+        hashes = {
+            1: '0000000000000000',
+            2: '0000000000000003',
+            3: 'ffffffffffffffff',
+            4: '0000000000000000',
+            5: 'fffffffffffffff0',
+            6: '0f0f0f0f0f0f0f0f',
+        }
+
+        self.assertEqual(
+            images.find_duplicates(hashes, 2), [[1, 2, 4]]
+        )
+        self.assertEqual(
+            images.find_duplicates(hashes, 4), [[1, 2, 4], [3, 5]]
+        )
+        self.assertEqual(images.find_duplicates(hashes, 0), [[1, 4]])
+
+    def test_max_image_pixels(self):
+        """Test that Pillow refuses images over IMAGE_MAX_PIXELS"""
+        self.assertEqual(
+            Image.MAX_IMAGE_PIXELS * 2, settings.IMAGE_MAX_PIXELS
+        )
+
+    def test_read_metadata_unreadable(self):
+        """Test that images that can't be read give no metadata"""
+        with self.assertLogs('recipe.images', level='WARNING'):
+            self.assertIsNone(
+                images.read_metadata('uploads/recipe/missing.jpg')
+            )
+
+
+class ImageMetadataJobTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.storage = Recipe._meta.get_field('image').storage
+        self.names = []
+        reset_buckets()
+
+    def tearDown(self):
+        for name in self.names:
+            self.storage.delete(name)
+
+    def stored_recipe(self, content, user=None):
+        name = self.storage.save(
+            f'uploads/recipe/metadata-test-{len(self.names)}.jpg',
+            ContentFile(content)
+        )
+        self.names.append(name)
+        return sample_recipe(user or self.user, image=name)
+
+    def test_extract_job(self):
+        """Test that the job stores the metadata and the detail payload
+        shows it"""
+        recipe = self.stored_recipe(sample_photo())
+
+        extract_image_metadata([recipe.id])
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_width, 320)
+        self.assertEqual(recipe.image_format, 'jpeg')
+        self.assertEqual(len(recipe.image_hash), 16)
+        self.assertEqual(recipe.detail_cache['image_width'], 320)
+        self.assertEqual(
+            recipe.detail_cache['image_color'], recipe.image_color
+        )
+
+    @override_settings(JOBS_EAGER=True)
+    def test_upload_queues_extraction(self):
+        """Test that uploading an image extracts its metadata once the
+        upload commits"""
+        recipe = sample_recipe(self.user)
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(sample_photo())
+            ntf.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(
+                    url, {'image': ntf}, format='multipart'
+                )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.names.append(recipe.image.name)
+        self.assertEqual(recipe.image_width, 320)
+        self.assertEqual(recipe.image_height, 240)
+
+    def test_save_skips_replaced_image(self):
+        """Test that metadata read from an image isn't stored on a recipe
+        that was given another image meanwhile"""
+        recipe = self.stored_recipe(sample_photo())
+        name = recipe.image.name
+        metadata = {name: images.read_metadata(name)}
+        Recipe.objects.filter(id=recipe.id).update(
+            image='uploads/recipe/other.jpg'
+        )
+
+        self.assertEqual(save_image_metadata([recipe], metadata), 0)
+
+        recipe.refresh_from_db()
+        self.assertIsNone(recipe.image_width)
+        self.assertEqual(recipe.image_hash, '')
+
+    def test_read_metadata_decompression_bomb(self):
+        """Test that images with too many pixels are not decoded"""
+        name = self.stored_recipe(sample_photo()).image.name
+
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), \
+                self.assertLogs('recipe.images', level='WARNING'):
+            self.assertIsNone(images.read_metadata(name))
+
+    def test_delete_image_clears_metadata(self):
+        """Test that deleting an image forgets its metadata"""
+        recipe = self.stored_recipe(sample_photo())
+        extract_image_metadata([recipe.id])
+        recipe.refresh_from_db()
+
+        recipe.delete_image()
+
+        recipe.refresh_from_db()
+        self.assertIsNone(recipe.image_width)
+        self.assertEqual(recipe.image_hash, '')
+
+    def test_duplicate_images(self):
+        """Test listing recipes showing the same photo"""
+        first = self.stored_recipe(sample_photo())
+        copy = self.stored_recipe(sample_photo(size=(200, 150), quality=60))
+        other = self.stored_recipe(sample_photo(seed=3))
+        extract_image_metadata([first.id, copy.id, other.id])
+
+        res = self.client.get(DUPLICATES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['groups'], [[first.id, copy.id]])
+
+    def test_duplicate_images_limited_to_user(self):
+        """Test that duplicates are only looked for in the user's
+        recipes"""
+        first = self.stored_recipe(sample_photo())
+        other_user = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'testpass'
+        )
+        copy = self.stored_recipe(sample_photo(), user=other_user)
+        extract_image_metadata([first.id, copy.id])
+
+        res = self.client.get(DUPLICATES_URL)
+
+        self.assertEqual(res.data['groups'], [])
+
+    def test_duplicate_images_invalid_distance(self):
+        """Test that the distance must be a positive number"""
+        for distance in ('x', '-1'):
+            res = self.client.get(DUPLICATES_URL, {'distance': distance})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_DETAIL_BATCH_SIZE=2)
+    def test_backfill_command(self):
+        """Test that the command extracts the missing metadata in worker
+        processes"""
+        recipes = [
+            self.stored_recipe(sample_photo(seed=seed))
+            for seed in range(1, 4)
+        ]
+        broken = self.stored_recipe(b'not an image')
+        out = StringIO()
+
+        call_command(
+            'extract_image_metadata',
+            '--workers', '2',
+            '--batch-size', '2',
+            stdout=out
+        )
+
+        self.assertIn('3 recipe images, 1 could not be read', out.getvalue())
+        for recipe in recipes:
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.image_width, 320)
+        broken.refresh_from_db()
+        self.assertEqual(broken.image_hash, '')
+        self.assertTrue(os.path.exists(broken.image.path))
@@ -0,0 +1,99 @@
+from django.test import SimpleTestCase
+
+from recipe.indexes import (
+    ARRAY_MAX_SIZE, INGREDIENT, TAG, ArrayContainer, BitsetContainer,
+    RecipeBitmapIndex, RecipeFeatureIndex, RoaringBitmap
+)
+
+
+class RoaringBitmapTests(SimpleTestCase):
+
+    def test_add_discard_contains(self):
+        """Test membership across several containers"""
+        bitmap = RoaringBitmap([1, 70000, 1 << 33])
+        bitmap.discard(70000)
+        bitmap.discard(5)
+
+        self.assertIn(1, bitmap)
+        self.assertIn(1 << 33, bitmap)
+        self.assertNotIn(70000, bitmap)
+        self.assertEqual(len(bitmap), 2)
+        self.assertEqual(len(bitmap.containers), 2)
+
+    def test_set_operations(self):
+        """Test AND and OR keep values sorted and containers minimal"""
+        a = RoaringBitmap([3, 1, 65536, 200000])
+        b = RoaringBitmap([1, 65536, 5])
+
+        self.assertEqual(list(a & b), [1, 65536])
+        self.assertEqual(list(a | b), [1, 3, 5, 65536, 200000])
+        self.assertNotIn(200000 >> 16, (a & b).containers)
+
+    def test_container_conversion(self):
+        """Test that groups switch to a bitset past ARRAY_MAX_SIZE values
+        and back to an array at it"""
+        bitmap = RoaringBitmap(range(ARRAY_MAX_SIZE))
+        self.assertIsInstance(bitmap.containers[0], ArrayContainer)
+
+        bitmap.add(ARRAY_MAX_SIZE)
+        self.assertIsInstance(bitmap.containers[0], BitsetContainer)
+        self.assertEqual(len(bitmap), ARRAY_MAX_SIZE + 1)
+
+        bitmap.discard(0)
+        self.assertIsInstance(bitmap.containers[0], ArrayContainer)
+        self.assertEqual(list(bitmap), list(range(1, ARRAY_MAX_SIZE + 1)))
+
+    def test_set_operations_mixed_containers(self):
+        """Test AND and OR of sparse and dense groups against sets"""
+        dense = set(range(0, 200000, 3))
+        other_dense = set(range(0, 200000, 5))
+        sparse = set(range(0, 200000, 101))
+        for first, second in ((dense, sparse), (dense, other_dense),
+                              (sparse, sparse), (sparse, dense)):
+            a, b = RoaringBitmap(first), RoaringBitmap(second)
+
+            self.assertEqual(list(a & b), sorted(first & second))
+            self.assertEqual(list(a | b), sorted(first | second))
+            for container in [*(a & b).containers.values(),
+                              *(a | b).containers.values()]:
+                self.assertEqual(
+                    isinstance(container, BitsetContainer),
+                    len(container) > ARRAY_MAX_SIZE
+                )
+
+
+class RecipeIndexTests(SimpleTestCase):
+
+    links = [
+        (1, (TAG, 10)), (1, (TAG, 11)), (1, (INGREDIENT, 20)),
+        (2, (TAG, 10)), (2, (INGREDIENT, 21)),
+        (3, (TAG, 11)), (3, (INGREDIENT, 20)),
+    ]
+
+    def test_bitmap_match(self):
+        """Test combining tags and ingredients with AND and OR"""
+        index = RecipeBitmapIndex(self.links)
+
+        self.assertEqual(index.match([10, 11]), [1, 2, 3])
+        self.assertEqual(index.match([10, 11], require_all=True), [1])
+        self.assertEqual(index.match([10], [20]), [1])
+        self.assertEqual(index.match([], [20, 21]), [1, 2, 3])
+        self.assertEqual(index.match([99]), [])
+
+    def test_indexes_apply_changes(self):
+        """Test both indexes take the same incremental changes"""
+        for index in (RecipeBitmapIndex(self.links),
+                      RecipeFeatureIndex(self.links)):
+            index.remove_feature((TAG, 11))
+            index.remove_kind(2, INGREDIENT)
+            index.remove_recipe(3)
+            index.add(4, (TAG, 10))
+
+            if isinstance(index, RecipeBitmapIndex):
+                self.assertEqual(index.match([10]), [1, 2, 4])
+                self.assertEqual(index.match([], [20, 21]), [1])
+            else:
+                self.assertEqual(
+                    [recipe_id for recipe_id, _ in index.similar(1)],
+                    [2, 4]
+                )
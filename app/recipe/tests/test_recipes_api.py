@@ -1,20 +1,36 @@
+import base64
+import hashlib
+import json
 import tempfile
 import os
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import PendingFileDeletion, Recipe, Tag, Ingredient
+from core.throttling import reset_buckets
 
+from recipe.indexes import feature_indexes
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.tests.utils import sample_recipe
 
 RECIPES_URL = reverse('recipe:recipe-list')
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+FACETS_URL = reverse('recipe:recipe-facets')
 
 
 def image_upload_url(recipe_id):
@@ -22,11 +38,31 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def image_delete_url(recipe_id):
+    """Return URL for recipe image deletion"""
+    return reverse('recipe:recipe-delete-image', args=[recipe_id])
+
+
+def image_upload_request_url(recipe_id):
+    """Return URL for requesting a direct image upload URL"""
+    return reverse('recipe:recipe-image-upload-url', args=[recipe_id])
+
+
+def image_confirm_url(recipe_id):
+    """Return URL for confirming a direct image upload"""
+    return reverse('recipe:recipe-confirm-image', args=[recipe_id])
+
+
 def detail_url(recipe_id):
     """Return recipe detail URL"""
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    """Return similar recipes URL"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
 def sample_tag(user, name='Main course'):
     """Create and return a sample tag"""
     return Tag.objects.create(user=user, name=name)
@@ -37,18 +73,6 @@ def sample_ingredient(user, name='Cinnamon'):
     return Ingredient.objects.create(user=user, name=name)
 
 
-def sample_recipe(user, **params):
-    """Create and return a sample recipe"""
-    defaults = {
-        'title': 'Sample Recipe',
-        'time_minutes': 10,
-        'price': 5.00,
-    }
-    defaults.update(params)
-
-    return Recipe.objects.create(user=user, **defaults)
-
-
 class PublicRecipeApiTests(TestCase):
     """Test the publicly available recipes API"""
 
@@ -72,6 +96,8 @@ class PrivateRecipeApiTests(TestCase):
         )
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        cache.clear()
+        feature_indexes.clear()
 
     def test_retrieve_recipes(self):
         """Test retrieving a list of recipes"""
@@ -168,6 +194,22 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_create_recipe_with_other_users_tag(self):
+        """Test that tags of another user can't be linked"""
+        user2 = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'password123'
+        )
+        payload = {
+            'title': 'Borrowed tag',
+            'tags': [sample_tag(user2).id],
+            'time_minutes': 30,
+            'price': 5.00
+        }
+        resp = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_partial_update_recipe(self):
         """Test updating a recipe with patch"""
         recipe = sample_recipe(self.user)
@@ -184,6 +226,59 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(len(tags), 1)
         self.assertIn(new_tag, tags)
 
+    def test_partial_update_writes_changed_columns(self):
+        """Test that a patch only writes the columns and links it changes,
+        with the detail payload in the same UPDATE"""
+        recipe = sample_recipe(self.user)
+        tag = sample_tag(self.user)
+        recipe.tags.add(tag)
+        new_tag = sample_tag(self.user, 'Curry')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(
+                detail_url(recipe.id),
+                {'title': 'Chicken tikka', 'tags': [tag.id, new_tag.id]},
+                format='json'
+            )
+
+        writes = [query['sql'] for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        recipe_updates = [
+            sql for sql in writes
+            if sql.startswith('UPDATE "core_recipe" SET')
+        ]
+        self.assertEqual(len(recipe_updates), 1)
+        self.assertTrue(
+            recipe_updates[0].startswith('UPDATE "core_recipe" SET "title"')
+        )
+        self.assertIn(', "detail_cache" = ', recipe_updates[0])
+        self.assertNotIn('"time_minutes" = ', recipe_updates[0])
+        self.assertFalse([sql for sql in writes
+                          if sql.startswith('DELETE FROM "core_recipe_tags"')])
+        self.assertEqual(
+            set(recipe.tags.values_list('id', flat=True)),
+            {tag.id, new_tag.id}
+        )
+
+    def test_partial_update_unchanged_writes_nothing(self):
+        """Test that a patch changing nothing doesn't write"""
+        recipe = sample_recipe(self.user)
+        tag = sample_tag(self.user)
+        recipe.tags.add(tag)
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.patch(
+                detail_url(recipe.id),
+                {'title': recipe.title, 'price': '5.00', 'tags': [tag.id]},
+                format='json'
+            )
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse([
+            query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ])
+
     def test_full_update_recipe(self):
         """Test updating a recipe with put"""
         recipe = sample_recipe(self.user)
@@ -248,6 +343,518 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(serializer2.data, resp.data)
         self.assertNotIn(serializer3.data, resp.data)
 
+    def test_filter_recipes_by_time_and_price(self):
+        """Test filtering recipes by maximum time and a price range"""
+        quick_cheap = sample_recipe(self.user, time_minutes=10, price=3)
+        quick_dear = sample_recipe(self.user, time_minutes=10, price=30)
+        sample_recipe(self.user, time_minutes=90, price=3)
+
+        resp = self.client.get(RECIPES_URL, {'max_time': 15})
+        self.assertEqual(
+            sorted(r['id'] for r in resp.data),
+            [quick_cheap.id, quick_dear.id]
+        )
+
+        resp = self.client.get(
+            RECIPES_URL,
+            {'max_time': 15, 'min_price': '1.50', 'max_price': '5'}
+        )
+        self.assertEqual([r['id'] for r in resp.data], [quick_cheap.id])
+
+    def test_filter_recipes_invalid_number(self):
+        """Test that malformed range filters are rejected"""
+        for params in ({'max_time': 'soon'}, {'max_price': 'NaN'}):
+            resp = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_recipes_invalid_ids(self):
+        """Test that malformed id lists are rejected, with or without the
+        bitmap index"""
+        for bitmap in (False, True):
+            with self.settings(RECIPE_BITMAP_INDEX=bitmap):
+                for params in ({'tags': 'x'}, {'ingredients': '1,,2'}):
+                    resp = self.client.get(RECIPES_URL, params)
+
+                    self.assertEqual(
+                        resp.status_code, status.HTTP_400_BAD_REQUEST
+                    )
+                    self.assertIn(next(iter(params)), resp.data)
+
+    def test_order_recipes(self):
+        """Test ordering recipes by a whitelisted field with id ties"""
+        slow = sample_recipe(self.user, time_minutes=60)
+        quick1 = sample_recipe(self.user, time_minutes=5)
+        quick2 = sample_recipe(self.user, time_minutes=5)
+
+        resp = self.client.get(RECIPES_URL, {'ordering': 'time_minutes'})
+        self.assertEqual(
+            [r['id'] for r in resp.data],
+            [quick1.id, quick2.id, slow.id]
+        )
+
+        resp = self.client.get(RECIPES_URL, {'ordering': '-time_minutes'})
+        self.assertEqual(
+            [r['id'] for r in resp.data],
+            [slow.id, quick2.id, quick1.id]
+        )
+
+    def test_order_recipes_invalid_field(self):
+        """Test that only whitelisted orderings are accepted"""
+        resp = self.client.get(RECIPES_URL, {'ordering': 'title'})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keyset_pagination(self):
+        """Test walking pages through the keyset cursor without OFFSET"""
+        prices = [4, 2, 2, 8, 2, 6, 4]
+        for price in prices:
+            sample_recipe(self.user, price=price)
+        expected = list(Recipe.objects.order_by('price', 'id').values_list(
+            'id', flat=True
+        ))
+
+        seen = []
+        url = RECIPES_URL
+        params = {'ordering': 'price', 'page_size': 3}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url, params)
+            self.assertFalse(any(
+                'OFFSET' in query['sql'] for query in queries
+            ))
+            seen += [r['id'] for r in resp.data['results']]
+            url, params = resp.data['next'], None
+
+        self.assertEqual(seen, expected)
+
+    def test_keyset_pagination_invalid_cursor(self):
+        """Test that a tampered cursor is rejected"""
+        resp = self.client.get(
+            RECIPES_URL,
+            {'page_size': 2, 'cursor': 'not-a-cursor'}
+        )
+
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_keyset_pagination_cursor_wrong_types(self):
+        """Test that cursors with values the ordering field can't hold are
+        rejected"""
+        sample_recipe(self.user)
+        for ordering, values in (
+                ('price', ['cheap', 1]),
+                ('price', [None, 1]),
+                ('time_minutes', ['5', 'x']),
+                ('time_minutes', [{'a': 1}, 1]),
+                ('id', ['1', [2]])):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(values).encode()
+            ).decode()
+
+            resp = self.client.get(RECIPES_URL, {
+                'ordering': ordering, 'page_size': 2, 'cursor': cursor
+            })
+
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_ordering_uses_index(self):
+        """Test that the query plan of each ordering uses its index"""
+        for field in ('id', 'time_minutes', 'price'):
+            queryset = Recipe.objects.filter(user=self.user).order_by(
+                f'-{field}', '-id'
+            )
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+
+            # Rows come in index order, so there is no separate sort step
+            self.assertIn('INDEX', plan.upper())
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_filter_recipes_with_bitmap_index(self):
+        """Test that the bitmap index filters like the database does"""
+        recipe1 = sample_recipe(self.user, title='Thai vegetable curry')
+        recipe2 = sample_recipe(self.user, title='Aubergine with tahini')
+        recipe3 = sample_recipe(self.user, title='Fish and chips')
+        vegan = sample_tag(self.user, 'Vegan')
+        tahini = sample_ingredient(self.user, 'Tahini')
+        recipe1.tags.add(vegan)
+        recipe2.tags.add(vegan)
+        recipe2.ingredients.add(tahini)
+
+        with self.settings(RECIPE_BITMAP_INDEX=True):
+            by_tag = self.client.get(RECIPES_URL, {'tags': vegan.id})
+            by_both = self.client.get(
+                RECIPES_URL,
+                {'tags': vegan.id, 'ingredients': tahini.id}
+            )
+
+        self.assertEqual(
+            sorted(r['id'] for r in by_tag.data),
+            [recipe1.id, recipe2.id]
+        )
+        self.assertEqual([r['id'] for r in by_both.data], [recipe2.id])
+        self.assertNotIn(recipe3.id, [r['id'] for r in by_tag.data])
+
+    def test_shopping_list_for_recipes(self):
+        """Test aggregating ingredients across the selected recipes"""
+        recipe1 = sample_recipe(self.user, title='Pancakes')
+        recipe2 = sample_recipe(self.user, title='Crepes')
+        recipe3 = sample_recipe(self.user, title='Omelette')
+        flour = sample_ingredient(self.user, 'Flour')
+        eggs = sample_ingredient(self.user, 'Eggs')
+        cheese = sample_ingredient(self.user, 'Cheese')
+        recipe1.ingredients.add(flour, eggs)
+        recipe2.ingredients.add(flour, eggs)
+        recipe3.ingredients.add(eggs, cheese)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(
+                SHOPPING_LIST_URL,
+                {'recipes': f'{recipe1.id},{recipe2.id}'}
+            )
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data, [
+            {'id': eggs.id, 'name': 'Eggs', 'recipe_count': 2},
+            {'id': flour.id, 'name': 'Flour', 'recipe_count': 2},
+        ])
+
+    def test_shopping_list_invalid_recipes(self):
+        """Test that a malformed recipe id list is rejected"""
+        resp = self.client.get(SHOPPING_LIST_URL, {'recipes': 'x'})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('recipes', resp.data)
+
+    def test_shopping_list_filtered_by_tags(self):
+        """Test the shopping list honours the recipe tag filter"""
+        recipe1 = sample_recipe(self.user, title='Vegan curry')
+        recipe2 = sample_recipe(self.user, title='Fish and chips')
+        vegan = sample_tag(self.user, 'Vegan')
+        recipe1.tags.add(vegan)
+        recipe1.ingredients.add(sample_ingredient(self.user, 'Tofu'))
+        recipe2.ingredients.add(sample_ingredient(self.user, 'Cod'))
+
+        resp = self.client.get(SHOPPING_LIST_URL, {'tags': vegan.id})
+
+        self.assertEqual(len(resp.data), 1)
+        self.assertEqual(resp.data[0]['name'], 'Tofu')
+        self.assertEqual(resp.data[0]['recipe_count'], 1)
+
+    def test_shopping_list_limited_to_user(self):
+        """Test the shopping list ignores other users' recipes"""
+        user2 = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'password123'
+        )
+        recipe = sample_recipe(user2)
+        recipe.ingredients.add(sample_ingredient(user2, 'Salt'))
+
+        resp = self.client.get(SHOPPING_LIST_URL, {'recipes': recipe.id})
+
+        self.assertEqual(resp.data, [])
+
+    def test_facets(self):
+        """Test counting recipes per tag and ingredient in one query"""
+        vegan = sample_tag(self.user, 'Vegan')
+        quick = sample_tag(self.user, 'Quick')
+        sample_tag(self.user, 'Unused')
+        rice = sample_ingredient(self.user, 'Rice')
+        recipe1 = sample_recipe(self.user, title='Vegan curry')
+        recipe2 = sample_recipe(self.user, title='Vegan salad')
+        recipe1.tags.add(vegan, quick)
+        recipe2.tags.add(vegan)
+        recipe1.ingredients.add(rice)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(FACETS_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['tags'], [
+            {'id': vegan.id, 'name': 'Vegan', 'count': 2},
+            {'id': quick.id, 'name': 'Quick', 'count': 1},
+        ])
+        self.assertEqual(resp.data['ingredients'], [
+            {'id': rice.id, 'name': 'Rice', 'count': 1},
+        ])
+
+    def test_facets_within_filter(self):
+        """Test that each kind of facet is counted over the recipes
+        matching every filter but its own"""
+        vegan = sample_tag(self.user, 'Vegan')
+        quick = sample_tag(self.user, 'Quick')
+        rice = sample_ingredient(self.user, 'Rice')
+        beef = sample_ingredient(self.user, 'Beef')
+        recipe1 = sample_recipe(self.user, title='Vegan curry')
+        recipe2 = sample_recipe(self.user, title='Steak')
+        slow = sample_recipe(self.user, title='Stew', time_minutes=120)
+        recipe1.tags.add(vegan)
+        recipe1.ingredients.add(rice)
+        recipe2.tags.add(quick)
+        recipe2.ingredients.add(beef)
+        slow.tags.add(quick)
+        slow.ingredients.add(rice)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(
+                FACETS_URL,
+                {'tags': vegan.id, 'ingredients': rice.id, 'max_time': 60}
+            )
+
+        # Tags are counted over the quick recipes with rice, whatever
+        # their tags
+        self.assertEqual(resp.data['tags'], [
+            {'id': vegan.id, 'name': 'Vegan', 'count': 1},
+        ])
+        # Ingredients are counted over the quick vegan recipes
+        self.assertEqual(resp.data['ingredients'], [
+            {'id': rice.id, 'name': 'Rice', 'count': 1},
+        ])
+
+        resp = self.client.get(FACETS_URL, {'tags': vegan.id})
+
+        self.assertEqual(resp.data['tags'], [
+            {'id': quick.id, 'name': 'Quick', 'count': 2},
+            {'id': vegan.id, 'name': 'Vegan', 'count': 1},
+        ])
+        self.assertEqual(resp.data['ingredients'], [
+            {'id': rice.id, 'name': 'Rice', 'count': 1},
+        ])
+
+    def test_similar_recipes(self):
+        """Test listing recipes ranked by shared tags and ingredients"""
+        vegan = sample_tag(self.user, 'Vegan')
+        curry = sample_tag(self.user, 'Curry')
+        rice = sample_ingredient(self.user, 'Rice')
+        recipe = sample_recipe(self.user, title='Vegan curry')
+        close = sample_recipe(self.user, title='Vegan korma')
+        far = sample_recipe(self.user, title='Fried rice')
+        sample_recipe(self.user, title='Unrelated')
+        recipe.tags.add(vegan, curry)
+        recipe.ingredients.add(rice)
+        close.tags.add(vegan, curry)
+        far.ingredients.add(rice)
+        far.tags.add(sample_tag(self.user, 'Quick'))
+
+        resp = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in resp.data], [close.id, far.id])
+        self.assertAlmostEqual(resp.data[0]['similarity'], 2 / 3)
+        self.assertAlmostEqual(resp.data[1]['similarity'], 1 / 4)
+
+    def test_similar_recipes_follow_link_changes(self):
+        """Test that the index picks up tag changes after commit"""
+        vegan = sample_tag(self.user, 'Vegan')
+        recipe = sample_recipe(self.user)
+        other = sample_recipe(self.user, title='Other')
+        recipe.tags.add(vegan)
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.tags.add(vegan)
+        resp = self.client.get(similar_url(recipe.id))
+        self.assertEqual([r['id'] for r in resp.data], [other.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vegan.delete()
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+
+    def test_similar_recipes_follow_other_processes(self):
+        """Test that a version bumped by another process makes the cached
+        index rebuild"""
+        vegan = sample_tag(self.user, 'Vegan')
+        recipe = sample_recipe(self.user)
+        other = sample_recipe(self.user, title='Other')
+        recipe.tags.add(vegan)
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+
+        # Another process links the tag: no signal reaches this one, only
+        # the version on the user's row
+        Recipe.tags.through.objects.create(recipe=other, tag=vegan)
+        get_user_model().objects.filter(id=self.user.id).update(
+            recipe_index_version=F('recipe_index_version') + 1
+        )
+
+        resp = self.client.get(similar_url(recipe.id))
+        self.assertEqual([r['id'] for r in resp.data], [other.id])
+
+    def test_similar_recipes_cosine(self):
+        """Test ranking similar recipes by cosine similarity"""
+        tags = [sample_tag(self.user, f'Tag {i}') for i in range(4)]
+        recipe = sample_recipe(self.user)
+        other = sample_recipe(self.user, title='Other')
+        recipe.tags.add(*tags[:2])
+        other.tags.add(*tags)
+
+        resp = self.client.get(similar_url(recipe.id), {'metric': 'cosine'})
+
+        self.assertAlmostEqual(resp.data[0]['similarity'], 2 / 8 ** 0.5)
+
+    def test_similar_recipes_invalid_metric(self):
+        """Test that unknown similarity metrics are rejected"""
+        recipe = sample_recipe(self.user)
+
+        resp = self.client.get(similar_url(recipe.id), {'metric': 'nope'})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_similar_recipes_invalid_limit(self):
+        """Test that limits below one are rejected"""
+        recipe = sample_recipe(self.user)
+
+        for limit in ('0', '-1', 'x'):
+            resp = self.client.get(similar_url(recipe.id), {'limit': limit})
+
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeDetailCacheTests(TestCase):
+    """Test serving recipes from their stored detail payload"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+        self.tag = sample_tag(self.user)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(sample_ingredient(self.user))
+
+    def assertDetailFresh(self, recipe):
+        recipe.refresh_from_db()
+        with override_settings(RECIPE_DETAIL_CACHE=False):
+            expected = RecipeDetailSerializer(recipe).data
+        self.assertEqual(recipe.detail_cache, expected)
+
+    def test_retrieve_reads_one_row(self):
+        """Test that a recipe detail is read with a single query"""
+        with self.assertNumQueries(1):
+            resp = self.client.get(detail_url(self.recipe.id))
+
+        self.assertEqual(resp.data['tags'], [
+            {'id': self.tag.id, 'name': self.tag.name}
+        ])
+
+    def test_list_reads_one_table(self):
+        """Test that recipes are listed with a single query"""
+        sample_recipe(self.user).tags.add(self.tag)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(RECIPES_URL)
+
+        self.assertEqual(resp.data[0]['tags'], [self.tag.id])
+        self.assertEqual(
+            resp.data,
+            RecipeSerializer(
+                Recipe.objects.order_by('-id'),
+                many=True,
+                context={'detail_cache': False}
+            ).data
+        )
+
+    def test_detail_follows_recipe_changes(self):
+        """Test that the payload follows updates and link changes"""
+        tag = sample_tag(self.user, 'Curry')
+        self.client.patch(
+            detail_url(self.recipe.id),
+            {'title': 'Chicken tikka', 'tags': [tag.id]}
+        )
+        self.assertDetailFresh(self.recipe)
+
+        tag.recipe_set.add(sample_recipe(self.user))
+        for recipe in tag.recipe_set.all():
+            self.assertDetailFresh(recipe)
+
+        self.recipe.ingredients.clear()
+        self.assertDetailFresh(self.recipe)
+
+        tag.recipe_set.clear()
+        self.assertDetailFresh(self.recipe)
+
+    @override_settings(RECIPE_DETAIL_BATCH_SIZE=2, JOBS_EAGER=True)
+    def test_detail_follows_renames_and_deletes(self):
+        """Test that renaming or deleting a tag refreshes its recipes"""
+        recipes = [self.recipe]
+        for _ in range(4):
+            recipes.append(sample_recipe(self.user))
+            recipes[-1].tags.add(self.tag)
+
+        self.tag.name = 'Starter'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        for recipe in recipes:
+            self.assertDetailFresh(recipe)
+            self.assertEqual(recipe.detail_cache['tags'][0]['name'],
+                             'Starter')
+
+        self.tag.delete()
+        for recipe in recipes:
+            self.assertDetailFresh(recipe)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_detail_refreshed_after_rename_commits(self):
+        """Test that a rename refreshes payloads only once it commits, and
+        that saving a tag under its own name refreshes nothing"""
+        with patch('recipe.jobs.refresh_details') as refresh_details:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.tag.save()
+                Tag.objects.get(pk=self.tag.pk).save()
+            self.assertEqual(callbacks, [])
+
+            self.tag.name = 'Starter'
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.tag.save()
+            refresh_details.assert_not_called()
+
+            callbacks[0]()
+        self.assertEqual(
+            list(refresh_details.call_args[0][0]), [self.recipe.id]
+        )
+
+    @override_settings(JOBS_EAGER=True)
+    def test_detail_dropped_while_disabled(self):
+        """Test that writes while payloads are off drop them, so none goes
+        stale until they are turned back on"""
+        other = sample_recipe(self.user)
+        other.tags.add(self.tag)
+        with override_settings(RECIPE_DETAIL_CACHE=False):
+            self.client.patch(
+                detail_url(self.recipe.id),
+                {'title': 'Chicken tikka'}
+            )
+            self.recipe.refresh_from_db()
+            self.assertIsNone(self.recipe.detail_cache)
+
+            self.tag.name = 'Starter'
+            with self.captureOnCommitCallbacks(execute=True):
+                self.tag.save()
+            other.refresh_from_db()
+            self.assertIsNone(other.detail_cache)
+
+        call_command('refresh_recipe_details', stdout=StringIO())
+        self.assertDetailFresh(self.recipe)
+        self.assertDetailFresh(other)
+
+    def test_missing_detail_served_and_refreshed(self):
+        """Test that recipes without a payload are still served, and that
+        the command fills it in"""
+        Recipe.objects.update(detail_cache=None)
+
+        resp = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(resp.data['tags'], [
+            {'id': self.tag.id, 'name': self.tag.name}
+        ])
+
+        call_command('refresh_recipe_details', stdout=StringIO())
+        self.assertDetailFresh(self.recipe)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -259,6 +866,7 @@ class RecipeImageUploadTests(TestCase):
         )
         self.client.force_authenticate(self.user)
         self.recipe = sample_recipe(self.user)
+        reset_buckets()
 
     def tearDown(self):
         self.recipe.image.delete()
@@ -277,9 +885,211 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_upload_same_image_stored_once(self):
+        """Test that identical images share one stored file"""
+        other = sample_recipe(self.user, title='Other recipe')
+        img = Image.new('RGB', (10, 10), color='red')
+        for recipe in (self.recipe, other):
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+                img.save(ntf, format='JPEG')
+                ntf.seek(0)
+                self.client.post(
+                    image_upload_url(recipe.id),
+                    {'image': ntf},
+                    format='multipart'
+                )
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, other.image.name)
+
+        self.client.post(image_delete_url(other.id))
+
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'no-image'}, format='multipart')
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DirectImageUploadTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+        output = BytesIO()
+        Image.frombytes('RGB', (4, 4), os.urandom(48)).save(output, 'PNG')
+        self.content = output.getvalue()
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        reset_buckets()
+
+    def tearDown(self):
+        self.recipe.image.storage.delete(
+            f'uploads/recipe/{self.sha256}.png'
+        )
+
+    def request_upload(self, **params):
+        payload = {
+            'content_type': 'image/png',
+            'size': len(self.content),
+            'sha256': self.sha256,
+        }
+        payload.update(params)
+        return self.client.post(
+            image_upload_request_url(self.recipe.id), payload
+        )
+
+    def test_direct_upload(self):
+        """Test uploading an image to a URL and confirming it"""
+        res = self.request_upload()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        name = res.data['name']
+        self.assertEqual(name, f'uploads/recipe/{self.sha256}.png')
+        upload = res.data['upload']
+        self.assertEqual(upload['method'], 'PUT')
+
+        put = self.client.put(
+            upload['url'], self.content, content_type='image/png'
+        )
+        self.assertEqual(put.status_code, status.HTTP_201_CREATED)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+        res = self.client.post(image_confirm_url(self.recipe.id), {
+            'name': name
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, name)
+        with self.recipe.image.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_direct_upload_already_stored(self):
+        """Test that no upload URL is given for a stored image, which is
+        touched so the reapers leave it alone"""
+        storage = self.recipe.image.storage
+        name = storage.save(
+            f'uploads/recipe/{self.sha256}.png', ContentFile(self.content)
+        )
+        os.utime(storage.path(name), (0, 0))
+
+        res = self.request_upload()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['upload'])
+        self.assertGreater(os.path.getmtime(storage.path(name)), 0)
+
+    def test_direct_upload_body_mismatch(self):
+        """Test that an upload not matching the signed hash is rejected"""
+        upload = self.request_upload().data['upload']
+
+        put = self.client.put(
+            upload['url'],
+            self.content[::-1],
+            content_type='image/png'
+        )
+
+        self.assertEqual(put.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.recipe.image.storage.exists(
+            f'uploads/recipe/{self.sha256}.png'
+        ))
+
+    def test_direct_upload_bad_token(self):
+        """Test that uploads need a valid signed URL"""
+        upload = self.request_upload().data['upload']
+
+        put = self.client.put(
+            upload['url'] + 'x', self.content, content_type='image/png'
+        )
+
+        self.assertEqual(put.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=8)
+    def test_direct_upload_too_large(self):
+        """Test that upload URLs are refused for images over the limit"""
+        res = self.request_upload()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('size', res.data)
+
+    def test_direct_upload_bad_type(self):
+        """Test that upload URLs are only given for image types"""
+        res = self.request_upload(content_type='text/html')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm_missing_image(self):
+        """Test that an image that was not uploaded can't be confirmed"""
+        res = self.client.post(image_confirm_url(self.recipe.id), {
+            'name': f'uploads/recipe/{self.sha256}.png'
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm_wrong_image_type(self):
+        """Test that an upload whose bytes aren't of the type it was
+        uploaded as can't be confirmed"""
+        for content in (b'<html>not an image</html>', b'GIF89a' + b'0' * 8):
+            self.content = content
+            self.sha256 = hashlib.sha256(content).hexdigest()
+            name = self.recipe.image.storage.save(
+                f'uploads/recipe/{self.sha256}.png', ContentFile(content)
+            )
+            self.addCleanup(self.recipe.image.storage.delete, name)
+
+            res = self.client.post(image_confirm_url(self.recipe.id), {
+                'name': name
+            })
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('name', res.data)
+
+    def test_confirm_invalid_name(self):
+        """Test that only recipe image names can be confirmed"""
+        for name in ('../settings.py', 'uploads/recipe/abc.png',
+                     f'uploads/recipe/{self.sha256}.html'):
+            res = self.client.post(image_confirm_url(self.recipe.id), {
+                'name': name
+            })
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_confirm_queues_replaced_image(self):
+        """Test that confirming an image queues the previous one for
+        deletion"""
+        Recipe.objects.filter(id=self.recipe.id).update(
+            image='uploads/recipe/old.jpg'
+        )
+        self.recipe.image.storage.save(
+            f'uploads/recipe/{self.sha256}.png', ContentFile(self.content)
+        )
+
+        self.client.post(image_confirm_url(self.recipe.id), {
+            'name': f'uploads/recipe/{self.sha256}.png'
+        })
+
+        self.assertTrue(PendingFileDeletion.objects.filter(
+            name='uploads/recipe/old.jpg'
+        ).exists())
+
+    def test_direct_upload_other_users_recipe(self):
+        """Test that upload URLs are only given for the user's recipes"""
+        other = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'testpass'
+        )
+        self.recipe = sample_recipe(other)
+
+        res = self.request_upload()
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,193 @@
+import threading
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import ChangeLogEntry, Recipe, Tag, Ingredient
+
+from recipe.tests.utils import sample_recipe
+
+
+SYNC_URL = reverse('recipe:sync')
+
+
+class PublicSyncApiTests(TestCase):
+    """Test the publicly available sync API"""
+
+    def test_login_required(self):
+        """Test that login is required for syncing"""
+        resp = APIClient().get(SYNC_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test the authorized user sync API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'password123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_full_sync(self):
+        """Test that syncing without a token returns everything"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        recipe.tags.add(tag)
+
+        resp = self.client.get(SYNC_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.data['full'])
+        self.assertEqual(len(resp.data['recipes']), 1)
+        self.assertEqual(resp.data['recipes'][0]['tags'], [tag.id])
+        self.assertEqual(len(resp.data['tags']), 1)
+        self.assertEqual(len(resp.data['ingredients']), 1)
+
+    def test_delta_sync_returns_only_changes(self):
+        """Test that syncing from a token returns only later changes"""
+        unchanged = sample_recipe(self.user, title='Unchanged')
+        renamed = Tag.objects.create(user=self.user, name='Vegan')
+        removed = Ingredient.objects.create(user=self.user, name='Salt')
+        linked = sample_recipe(self.user, title='Linked')
+        token = self.client.get(SYNC_URL).data['token']
+
+        renamed.name = 'Vegetarian'
+        renamed.save()
+        removed_id = removed.id
+        removed.delete()
+        linked.tags.add(renamed)
+        resp = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertFalse(resp.data['full'])
+        self.assertGreater(resp.data['token'], token)
+        self.assertEqual(
+            [r['id'] for r in resp.data['recipes']],
+            [linked.id]
+        )
+        self.assertNotIn(unchanged.id, [r['id'] for r in resp.data['recipes']])
+        self.assertEqual(resp.data['tags'][0]['name'], 'Vegetarian')
+        self.assertEqual(resp.data['ingredients'], [])
+        self.assertEqual(resp.data['deleted']['ingredients'], [removed_id])
+
+    def test_delta_sync_created_then_deleted(self):
+        """Test that an object deleted after it was created is a tombstone"""
+        token = self.client.get(SYNC_URL).data['token']
+        recipe = sample_recipe(self.user)
+        recipe_id = recipe.id
+        recipe.delete()
+
+        resp = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(resp.data['recipes'], [])
+        self.assertEqual(resp.data['deleted']['recipes'], [recipe_id])
+
+    def test_delta_sync_without_changes(self):
+        """Test that an up to date client gets an empty delta"""
+        sample_recipe(self.user)
+        token = self.client.get(SYNC_URL).data['token']
+
+        resp = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(resp.data['token'], token)
+        self.assertEqual(resp.data['recipes'], [])
+        self.assertEqual(resp.data['deleted']['recipes'], [])
+
+    def test_deleted_tag_marks_recipes_changed(self):
+        """Test that deleting a tag reports the recipes that lost it"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe.tags.add(tag)
+        token = self.client.get(SYNC_URL).data['token']
+
+        tag.delete()
+        resp = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(resp.data['recipes'][0]['id'], recipe.id)
+        self.assertEqual(resp.data['recipes'][0]['tags'], [])
+
+    def test_sync_limited_to_user(self):
+        """Test that other users' changes are not returned"""
+        user2 = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'password123'
+        )
+        token = self.client.get(SYNC_URL).data['token']
+        sample_recipe(user2)
+
+        resp = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(resp.data['recipes'], [])
+
+    def test_deleting_user_cascades(self):
+        """Test that deleting a user with logged changes succeeds"""
+        recipe = sample_recipe(self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+        self.user.delete()
+
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_invalid_token(self):
+        """Test that a malformed token is rejected"""
+        resp = self.client.get(SYNC_URL, {'since': 'abc'})
+
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs row locks')
+# Rows commit here, so a new user would be given logged starter tags, and
+# a token after the test flushed the user
+@override_settings(STARTER_CATALOGUE={}, JOBS_EAGER=True)
+class ChangeLogOrderTests(TransactionTestCase):
+    """Test that a user's change log entries commit in id order"""
+
+    def test_entries_wait_for_open_transaction(self):
+        """Test that an entry can't be written while another transaction
+        holding an entry of the same user is open"""
+        user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        recorded = threading.Event()
+        release = threading.Event()
+
+        def open_transaction():
+            with transaction.atomic():
+                ChangeLogEntry.objects.record(user.id, 'tag', [1])
+                recorded.set()
+                release.wait(5)
+            connection.close()
+
+        def record():
+            ChangeLogEntry.objects.record(user.id, 'tag', [2])
+            connection.close()
+
+        first = threading.Thread(target=open_transaction)
+        first.start()
+        recorded.wait(5)
+        second = threading.Thread(target=record)
+        second.start()
+        second.join(0.2)
+        blocked = second.is_alive()
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertTrue(blocked)
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(user=user).order_by(
+                'id'
+            ).values_list('object_id', flat=True)),
+            [1, 2]
+        )
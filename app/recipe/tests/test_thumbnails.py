@@ -0,0 +1,322 @@
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.throttling import reset_buckets
+
+from recipe import thumbnails
+
+
+def thumbnail_url(recipe_id, **params):
+    """Return the thumbnail URL of a recipe"""
+    url = reverse('recipe:recipe-image', args=[recipe_id])
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    return f'{url}?{query}' if query else url
+
+
+def sample_image(size=(400, 300), color='red', fmt='PNG'):
+    """Return the bytes of a sample image"""
+    output = BytesIO()
+    Image.new('RGB', size, color=color).save(output, format=fmt)
+    return output.getvalue()
+
+
+class ThumbnailApiTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            THUMBNAIL_CACHE_DIR=self.cache_dir.name
+        )
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@unittest.com',
+            'testpass'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        storage = Recipe._meta.get_field('image').storage
+        self.recipe.image = storage.save(
+            'uploads/recipe/thumbnail-test.png',
+            ContentFile(sample_image())
+        )
+        self.recipe.save(update_fields=['image'])
+        reset_buckets()
+
+    def tearDown(self):
+        self.recipe.image.delete(save=False)
+        self.settings_override.disable()
+        self.cache_dir.cleanup()
+
+    def get(self, **params):
+        response = self.client.get(thumbnail_url(self.recipe.id, **params))
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+        return response
+
+    def test_thumbnail(self):
+        """Test that a thumbnail is cropped to the requested size"""
+        res = self.get(w=128, h=128, fmt='png')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        image = Image.open(BytesIO(res.body))
+        self.assertEqual(image.size, (128, 128))
+        self.assertEqual(image.format, 'PNG')
+
+    def test_thumbnail_default_format(self):
+        """Test that the preferred available format is the default"""
+        res = self.get(w=320, h=180)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        fmt = thumbnails.available_formats()[0]
+        self.assertEqual(
+            Image.open(BytesIO(res.body)).format,
+            thumbnails.PILLOW_FORMATS[fmt]
+        )
+
+    def test_thumbnail_cached(self):
+        """Test that a thumbnail is only rendered once"""
+        with patch(
+            'recipe.thumbnails.render', wraps=thumbnails.render
+        ) as render:
+            first = self.get(w=64, h=64, fmt='jpeg')
+            second = self.get(w=64, h=64, fmt='jpeg')
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.body, second.body)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_thumbnail_not_modified(self):
+        """Test that a thumbnail the client has is not sent again"""
+        etag = self.get(w=64, h=64, fmt='jpeg')['ETag']
+
+        res = self.client.get(
+            thumbnail_url(self.recipe.id, w=64, h=64, fmt='jpeg'),
+            HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_thumbnail_size_not_allowed(self):
+        """Test that only the allowed sizes are rendered"""
+        for params in ({'w': 100, 'h': 100}, {'w': 128}, {'w': 'x', 'h': 1}):
+            res = self.get(**params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_thumbnail_format_not_allowed(self):
+        """Test that only the allowed formats are rendered"""
+        res = self.get(w=64, h=64, fmt='gif')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_thumbnail_no_image(self):
+        """Test that recipes without an image have no thumbnail"""
+        Recipe.objects.filter(id=self.recipe.id).update(image=None)
+
+        res = self.get(w=64, h=64)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_thumbnail_image_only_accept(self):
+        """Test that clients accepting only images get errors as JSON"""
+        res = self.client.get(
+            thumbnail_url(self.recipe.id, w=1, h=1),
+            HTTP_ACCEPT='image/webp'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res['Content-Type'], 'application/json')
+
+    def test_thumbnail_unreadable_image(self):
+        """Test that an image that can't be decoded has no thumbnail"""
+        storage = Recipe._meta.get_field('image').storage
+        with storage.open(self.recipe.image.name, 'wb') as fh:
+            fh.write(sample_image()[:100])
+
+        res = self.get(w=64, h=64, fmt='png')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_thumbnail_busy(self):
+        """Test that a thumbnail that can't be rendered in time answers
+        503 with Retry-After, not the client's rate limit"""
+        with patch('recipe.views.get_rendition',
+                   side_effect=thumbnails.RenditionBusy):
+            res = self.get(w=64, h=64)
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
+
+    def test_thumbnail_other_users_recipe(self):
+        """Test that thumbnails of other users' recipes are not served"""
+        other = get_user_model().objects.create_user(
+            'other@unittest.com',
+            'testpass'
+        )
+        self.client.force_authenticate(other)
+
+        res = self.get(w=64, h=64)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RenditionCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = thumbnails.RenditionCache(self.directory.name, 130)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def age(self, key, seconds):
+        path = self.cache.path(key, 'png')
+        used = time.time() - seconds
+        os.utime(path, (used, used))
+
+    def test_put_get(self):
+        """Test that stored files are found by key"""
+        self.assertIsNone(self.cache.get('abcd', 'png'))
+
+        path = self.cache.put('abcd', 'png', b'data')
+
+        self.assertEqual(self.cache.get('abcd', 'png'), path)
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'data')
+
+    def test_evicts_least_recently_used(self):
+        """Test that the least recently used files go first once the cache
+        is over its bound"""
+        for index, key in enumerate(['aa01', 'bb02', 'cc03']):
+            self.cache.put(key, 'png', b'x' * 40)
+            self.age(key, 1000 - index * 100)
+        # Reading the oldest file makes it the most recently used
+        self.cache.get('aa01', 'png')
+
+        self.cache.put('dd04', 'png', b'x' * 40)
+
+        self.assertIsNotNone(self.cache.get('aa01', 'png'))
+        self.assertIsNone(self.cache.get('bb02', 'png'))
+        self.assertIsNone(self.cache.get('cc03', 'png'))
+        self.assertIsNotNone(self.cache.get('dd04', 'png'))
+
+
+class GetRenditionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            THUMBNAIL_CACHE_DIR=self.directory.name
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def get_rendition(self, name='uploads/recipe/a.png'):
+        key, fh = thumbnails.get_rendition(name, 64, 64, 'png')
+        with fh:
+            return key, fh.read()
+
+    def test_single_render(self):
+        """Test that concurrent requests for a missing rendition share one
+        render"""
+        renders = []
+
+        def slow_render(*args):
+            renders.append(args)
+            time.sleep(0.05)
+            return b'data'
+
+        with patch('recipe.thumbnails.render', side_effect=slow_render):
+            threads = [
+                threading.Thread(target=self.get_rendition)
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(renders), 1)
+
+    @override_settings(THUMBNAIL_TIMEOUT=0.01)
+    def test_timeout_keeps_render(self):
+        """Test that a render outlasting the request is cached for the
+        next one rather than thrown away"""
+        def slow_render(*args):
+            time.sleep(0.05)
+            return b'data'
+
+        with patch('recipe.thumbnails.render',
+                   side_effect=slow_render) as render:
+            with self.assertRaises(thumbnails.RenditionBusy):
+                self.get_rendition()
+            time.sleep(0.1)
+
+            self.assertEqual(self.get_rendition()[1], b'data')
+
+        self.assertEqual(render.call_count, 1)
+
+    @override_settings(THUMBNAIL_QUEUE_SIZE=1)
+    def test_queue_bounded(self):
+        """Test that renders past the queue size are refused"""
+        rendering = threading.Event()
+        release = threading.Event()
+
+        def blocked_render(*args):
+            rendering.set()
+            release.wait(1)
+            return b'data'
+
+        with patch('recipe.thumbnails.render', side_effect=blocked_render):
+            thread = threading.Thread(target=self.get_rendition)
+            thread.start()
+            rendering.wait(1)
+            try:
+                with self.assertRaises(thumbnails.RenditionBusy):
+                    self.get_rendition('uploads/recipe/b.png')
+            finally:
+                release.set()
+                thread.join()
+
+            self.assertEqual(
+                self.get_rendition('uploads/recipe/b.png')[1], b'data'
+            )
+
+    def test_evicted_rendition_rendered_again(self):
+        """Test that a rendition evicted before it is opened is rendered
+        again"""
+        missing = os.path.join(self.directory.name, 'evicted.png')
+        with patch.object(thumbnails.RenditionCache, 'get',
+                          side_effect=[missing, None]), \
+                patch('recipe.thumbnails.render',
+                      return_value=b'data') as render:
+            self.assertEqual(self.get_rendition()[1], b'data')
+
+        self.assertEqual(render.call_count, 1)
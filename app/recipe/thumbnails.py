@@ -0,0 +1,250 @@
+"""Thumbnails of recipe images, rendered on demand.
+
+Renditions are rendered with Pillow on a bounded thread pool (Pillow
+releases the GIL while resizing and encoding) and kept in a size bounded
+directory, THUMBNAIL_CACHE_DIR, evicting the least recently used ones.
+Concurrent requests for a rendition that isn't cached yet wait for the
+render in flight instead of each running their own, and at most
+THUMBNAIL_QUEUE_SIZE renders are in flight at once. Only the sizes listed
+in THUMBNAIL_SIZES are rendered, so the cache can't be filled with
+arbitrary sizes.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+from django.conf import settings
+
+from core.storage import get_recipe_image_storage
+
+# Seconds between refreshes of a cached rendition's last use time
+TOUCH_INTERVAL = 60
+# Eviction removes renditions until the cache is this full
+EVICT_TO = 0.9
+
+PILLOW_FORMATS = {'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+mimetypes.add_type('image/webp', '.webp')
+
+
+class RenditionBusy(Exception):
+    """Raised when a rendition can't be rendered in time, or too many are
+    being rendered already"""
+
+
+class ImageUnreadable(Exception):
+    """Raised when a stored image can't be decoded"""
+
+
+def available_formats():
+    """Return the allowed formats this Pillow build can write, in order of
+    preference"""
+    return [
+        fmt for fmt in settings.THUMBNAIL_FORMATS
+        if fmt != 'webp' or features.check('webp')
+    ]
+
+
+class RenditionCache:
+    """Directory of rendered files bounded to `max_size` bytes. A file's
+    modification time records its last use, and the least recently used
+    files are removed once the directory grows past its bound."""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key[:2], f'{key}.{ext}')
+
+    def get(self, key, ext):
+        """Return the path of a cached file, or None"""
+        path = self.path(key, ext)
+        try:
+            used = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+        now = time.time()
+        if now - used > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return None
+
+        return path
+
+    def put(self, key, ext, data):
+        """Store a file and return its path"""
+        path = self.path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+        return path
+
+    def _files(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat
+
+    def _scan_size(self):
+        return sum(stat.st_size for _, stat in self._files())
+
+    def _evict(self):
+        """Remove the least recently used files until the cache is below
+        its bound. The directory is rescanned, so files written by other
+        processes are counted too."""
+        files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+        size = sum(stat.st_size for _, stat in files)
+        target = self.max_size * EVICT_TO
+        for path, stat in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+        self._size = size
+
+
+_caches = {}
+
+
+def get_cache():
+    """Return the rendition cache in THUMBNAIL_CACHE_DIR"""
+    directory = settings.THUMBNAIL_CACHE_DIR
+    if directory not in _caches:
+        _caches[directory] = RenditionCache(
+            directory, settings.THUMBNAIL_CACHE_MAX_SIZE
+        )
+
+    return _caches[directory]
+
+
+_pool_lock = threading.Lock()
+_pool = None
+_in_flight_lock = threading.Lock()
+# Renders queued or running, by cache directory and rendition key
+_in_flight = {}
+
+
+def _get_pool():
+    """Return the thread pool renditions are rendered on"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails'
+            )
+        return _pool
+
+
+def rendition_key(name, width, height, fmt):
+    """Return the cache key of a rendition of a stored image"""
+    return hashlib.sha256(
+        f'{name}:{width}x{height}:{fmt}:{settings.THUMBNAIL_QUALITY}'.encode()
+    ).hexdigest()
+
+
+def render(name, width, height, fmt):
+    """Return a stored image cropped to fill width x height, encoded in
+    `fmt`"""
+    with get_recipe_image_storage().open(name) as fh:
+        try:
+            image = Image.open(fh)
+            # Let the JPEG decoder downscale while decoding
+            image.draft('RGB', (width, height))
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            raise ImageUnreadable(name) from exc
+
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    output = BytesIO()
+    image.save(
+        output,
+        format=PILLOW_FORMATS[fmt],
+        quality=settings.THUMBNAIL_QUALITY
+    )
+    return output.getvalue()
+
+
+def _render_into(cache, key, name, width, height, fmt):
+    return cache.put(key, fmt, render(name, width, height, fmt))
+
+
+def _submit(cache, key, name, width, height, fmt):
+    """Return the future of the render of a rendition into the cache,
+    joining the one in flight for the same key"""
+    flight = (cache.directory, key)
+    with _in_flight_lock:
+        future = _in_flight.get(flight)
+        if future is not None:
+            return future
+        if len(_in_flight) >= settings.THUMBNAIL_QUEUE_SIZE:
+            raise RenditionBusy()
+        future = _in_flight[flight] = _get_pool().submit(
+            _render_into, cache, key, name, width, height, fmt
+        )
+
+    def forget(future):
+        with _in_flight_lock:
+            if _in_flight.get(flight) is future:
+                del _in_flight[flight]
+
+    future.add_done_callback(forget)
+    return future
+
+
+def get_rendition(name, width, height, fmt):
+    """Return the cache key and an open file of a rendition of a stored
+    image, rendering it on the pool when it isn't cached. A render that
+    takes too long goes on and is cached for the next request."""
+    cache = get_cache()
+    key = rendition_key(name, width, height, fmt)
+    # A rendition can be evicted between being found and being opened,
+    # it is rendered again then
+    for _ in range(2):
+        path = cache.get(key, fmt)
+        if path is None:
+            future = _submit(cache, key, name, width, height, fmt)
+            try:
+                path = future.result(timeout=settings.THUMBNAIL_TIMEOUT)
+            except TimeoutError:
+                raise RenditionBusy()
+        try:
+            return key, open(path, 'rb')
+        except FileNotFoundError:
+            continue
+
+    raise RenditionBusy()
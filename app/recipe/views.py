@@ -1,19 +1,62 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, Count, F, Value
+
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    APIException, NotAcceptable, NotFound, ValidationError
+)
+from rest_framework.negotiation import DefaultContentNegotiation
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.views import APIView
 
-from core.models import Tag, Ingredient, Recipe
+from core.authentication import ExpiringTokenAuthentication
+from core.jobs import runner
+from core.models import Tag, Ingredient, Recipe, PendingFileDeletion
+from core.storage import get_recipe_image_storage
+from core.views import serve_file
 
 from recipe import serializers
+from recipe.images import find_duplicates
+from recipe.indexes import bitmap_indexes, feature_indexes
+from recipe.jobs import extract_image_metadata
+from recipe.pagination import KeysetPagination
+from recipe.sync import build_sync_payload
+from recipe.thumbnails import (
+    ImageUnreadable, RenditionBusy, available_formats, get_rendition
+)
+
+
+class ThumbnailBusy(APIException):
+    """The server is too busy rendering thumbnails, not the client over
+    its rate. `wait` becomes the response's Retry-After."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Thumbnail is being rendered, try again shortly.'
+    default_code = 'thumbnail_busy'
+    wait = 1
+
+
+class FileContentNegotiation(DefaultContentNegotiation):
+    """Negotiation for actions answering with files. Clients accepting
+    only the file's type get errors in the first renderer's format rather
+    than a 406."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
 
 
 class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
     """Base ViewSet for user owned recipe attributes"""
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
@@ -23,7 +66,7 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         )
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(recipe__user=self.request.user)
 
         return queryset.filter(
             user=self.request.user
@@ -50,28 +93,107 @@ class RecipeViewSet(viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
+    ordering_fields = ('id', 'time_minutes', 'price')
+    upload_actions = ('upload_image', 'image_upload_url')
 
-    def _params_to_ints(self, qs):
-        """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+    def _params_to_ints(self, qs, name):
+        """Convert a list of string IDs given in query parameter `name` to
+        a list of integers"""
+        try:
+            return [int(str_id) for str_id in qs.split(',')]
+        except ValueError:
+            raise ValidationError({
+                name: 'Must be a comma separated list of numbers.'
+            })
 
-    def get_queryset(self):
-        """Return objects for the current authenticated user only"""
-        tags = self.request.query_params.get('tags')
-        ingredients = self.request.query_params.get('ingredients')
+    def _param_to_number(self, name, number_type):
+        """Convert an optional query parameter to a number"""
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+
+        try:
+            number = number_type(value)
+        except (ValueError, ArithmeticError):
+            raise ValidationError({name: 'Must be a number.'})
+        if isinstance(number, Decimal) and not number.is_finite():
+            raise ValidationError({name: 'Must be a number.'})
+
+        return number
+
+    def get_ordering(self):
+        """Return the requested ordering field and whether it descends"""
+        ordering = self.request.query_params.get('ordering', '-id')
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({
+                'ordering': 'Must be one of {}, optionally prefixed with -.'
+                .format(', '.join(self.ordering_fields))
+            })
+
+        return ordering.lstrip('-'), ordering.startswith('-')
+
+    def get_queryset(self, skip_filter=None):
+        """Return objects for the current authenticated user only, leaving
+        out the 'tags' or 'ingredients' filter named by `skip_filter`"""
+        params = self.request.query_params
+        tags = params.get('tags') if skip_filter != 'tags' else None
+        ingredients = (
+            params.get('ingredients') if skip_filter != 'ingredients'
+            else None
+        )
         queryset = self.queryset
 
-        if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+        if settings.RECIPE_BITMAP_INDEX and (tags or ingredients):
+            tag_ids = self._params_to_ints(tags, 'tags') if tags else ()
+            ingredient_ids = (
+                self._params_to_ints(ingredients, 'ingredients')
+                if ingredients else ()
+            )
+            recipe_ids = bitmap_indexes.get(self.request.user.id).match(
+                tag_ids, ingredient_ids
+            )
+            queryset = queryset.filter(id__in=recipe_ids)
+        else:
+            # The user conditions on the joined tables keep every query on
+            # the user's partition when the tables are partitioned.
+            if tags:
+                tag_ids = self._params_to_ints(tags, 'tags')
+                queryset = queryset.filter(
+                    tags__id__in=tag_ids,
+                    tags__user=self.request.user
+                )
+
+            if ingredients:
+                ingredient_ids = self._params_to_ints(
+                    ingredients, 'ingredients'
+                )
+                queryset = queryset.filter(
+                    ingredients__id__in=ingredient_ids,
+                    ingredients__user=self.request.user
+                )
+
+        max_time = self._param_to_number('max_time', int)
+        if max_time is not None:
+            queryset = queryset.filter(time_minutes__lte=max_time)
+        min_price = self._param_to_number('min_price', Decimal)
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = self._param_to_number('max_price', Decimal)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
 
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        # Every ordering ends on id and is backed by a (user, field, id)
+        # index, so pages are read straight off the index.
+        field, descending = self.get_ordering()
+        prefix = '-' if descending else ''
+        ordering = [f'{prefix}{field}']
+        if field != 'id':
+            ordering.append(f'{prefix}id')
 
-        return queryset.filter(user=self.request.user)
+        return queryset.filter(user=self.request.user).order_by(*ordering)
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
@@ -79,6 +201,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'image_upload_url':
+            return serializers.ImageUploadSerializer
+        elif self.action == 'confirm_image':
+            return serializers.ImageConfirmSerializer
+        elif self.action == 'shopping_list':
+            return serializers.ShoppingListItemSerializer
+        elif self.action == 'similar':
+            return serializers.SimilarRecipeSerializer
+        elif self.action == 'facets':
+            return serializers.FacetSerializer
 
         return self.serializer_class
 
@@ -90,17 +222,175 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Update a recipe object"""
         serializer.save(user=self.request.user)
 
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        """List the ingredients needed for a set of recipes, with the
+        number of recipes using each one, in a single aggregate query"""
+        recipes = self.get_queryset()
+        recipe_ids = self.request.query_params.get('recipes')
+        if recipe_ids:
+            recipes = recipes.filter(
+                id__in=self._params_to_ints(recipe_ids, 'recipes')
+            )
+
+        items = Recipe.ingredients.through.objects.filter(
+            recipe__in=recipes.values('id')
+        ).values('ingredient_id', 'ingredient__name').annotate(
+            recipe_count=Count('recipe_id')
+        ).order_by('ingredient__name')
+
+        serializer = self.get_serializer(items, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def facets(self, request):
+        """Count, for every tag and ingredient, how many of the recipes
+        matching the current filters have it, in one grouped query. The
+        counts are disjunctive: each kind is counted over the recipes
+        matching every filter but its own, so picking a tag doesn't hide
+        the other tags that could be added to the selection."""
+        facets = []
+        for kind, field in (('tags', 'tag'), ('ingredients', 'ingredient')):
+            through = getattr(Recipe, kind).through
+            recipe_ids = self.get_queryset(skip_filter=kind).values('id')
+            facets.append(
+                through.objects.filter(recipe__in=recipe_ids).values(
+                    facet_id=F(f'{field}_id'),
+                    facet_name=F(f'{field}__name')
+                ).annotate(
+                    kind=Value(kind, output_field=CharField()),
+                    count=Count('recipe_id')
+                ).values_list('kind', 'facet_id', 'facet_name', 'count')
+            )
+
+        results = {'tags': [], 'ingredients': []}
+        rows = facets[0].union(facets[1], all=True)
+        for kind, facet_id, name, count in rows:
+            results[kind].append(
+                {'id': facet_id, 'name': name, 'count': count}
+            )
+        for kind, items in results.items():
+            items.sort(key=lambda item: (-item['count'], item['name']))
+            results[kind] = self.get_serializer(items, many=True).data
+
+        return Response(results)
+
+    @action(methods=['GET'], detail=False, url_path='duplicate-images')
+    def duplicate_images(self, request):
+        """List the groups of the user's recipes whose images are the same
+        photo, going by their perceptual hashes"""
+        try:
+            distance = min(int(request.query_params.get(
+                'distance', settings.IMAGE_DUPLICATE_DISTANCE
+            )), 16)
+        except ValueError:
+            raise ValidationError({'distance': 'Must be a number.'})
+        if distance < 0:
+            raise ValidationError({'distance': 'Must not be negative.'})
+
+        hashes = dict(self.get_queryset().exclude(
+            image_hash=''
+        ).values_list('id', 'image_hash'))
+
+        return Response({'groups': find_duplicates(hashes, distance)})
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """List the user's recipes sharing most tags and ingredients with
+        this one"""
+        recipe = self.get_object()
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in ('jaccard', 'cosine'):
+            raise ValidationError({'metric': 'Must be jaccard or cosine.'})
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be a number.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be at least 1.'})
+
+        scores = feature_indexes.get(request.user.id).similar(
+            recipe.id,
+            limit=limit,
+            metric=metric
+        )
+        recipes = Recipe.objects.filter(
+            user=request.user
+        ).prefetch_related('tags', 'ingredients').in_bulk(
+            [recipe_id for recipe_id, _ in scores]
+        )
+        results = []
+        for recipe_id, score in scores:
+            if recipe_id in recipes:
+                recipes[recipe_id].similarity = score
+                results.append(recipes[recipe_id])
+
+        serializer = self.get_serializer(results, many=True)
+        return Response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=True,
+        url_path='image',
+        content_negotiation_class=FileContentNegotiation
+    )
+    def image(self, request, pk=None):
+        """Return a thumbnail of the recipe's image, cropped to one of the
+        allowed sizes"""
+        try:
+            size = (
+                int(request.query_params['w']),
+                int(request.query_params['h'])
+            )
+        except (KeyError, ValueError):
+            size = None
+        if size not in settings.THUMBNAIL_SIZES:
+            raise ValidationError({'size': 'Must be one of {}.'.format(
+                ', '.join(f'w={w}&h={h}' for w, h in settings.THUMBNAIL_SIZES)
+            )})
+        formats = available_formats()
+        fmt = request.query_params.get('fmt', formats[0])
+        if fmt not in formats:
+            raise ValidationError(
+                {'fmt': 'Must be one of {}.'.format(', '.join(formats))}
+            )
+
+        recipe = self.get_object()
+        if not recipe.image:
+            raise NotFound('Recipe has no image.')
+        try:
+            key, fh = get_rendition(recipe.image.name, *size, fmt)
+        except FileNotFoundError:
+            raise NotFound('Recipe image is missing.')
+        except ImageUnreadable:
+            raise NotFound('Recipe image could not be read.')
+        except RenditionBusy:
+            raise ThumbnailBusy()
+
+        return serve_file(
+            request,
+            fh.name,
+            etag=f'"{key}"',
+            cache_control='private, no-cache',
+            fh=fh
+        )
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Upload an image to a recipe"""
         recipe = self.get_object()
+        old_image = recipe.image.name
         serializer = self.get_serializer(
             recipe,
             data=request.data
         )
 
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                if old_image and old_image != recipe.image.name:
+                    PendingFileDeletion.objects.create(name=old_image)
+                runner.enqueue_on_commit(extract_image_metadata, recipe.id)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -111,14 +401,76 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(methods=['POST'], detail=True, url_path='image-upload-url')
+    def image_upload_url(self, request, pk=None):
+        """Return a URL to upload an image to directly, bypassing the app
+        server, then set on the recipe with confirm-image. No URL is given
+        when the same image is already stored, which is touched so it
+        isn't reaped before it is confirmed."""
+        self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        storage = get_recipe_image_storage()
+        upload = None
+        if storage.exists(data['name']):
+            storage.touch(data['name'])
+        else:
+            upload = storage.upload_url(
+                data['name'],
+                data['content_type'],
+                data['size'],
+                data['sha256'],
+                settings.IMAGE_UPLOAD_URL_EXPIRY
+            )
+            upload['url'] = request.build_absolute_uri(upload['url'])
+            upload['expires_in'] = settings.IMAGE_UPLOAD_URL_EXPIRY
+
+        return Response({'name': data['name'], 'upload': upload})
+
+    @action(methods=['POST'], detail=True, url_path='confirm-image')
+    def confirm_image(self, request, pk=None):
+        """Set a directly uploaded image on a recipe"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            recipe.set_image(serializer.validated_data['name'])
+            runner.enqueue_on_commit(extract_image_metadata, recipe.id)
+
+        return Response(
+            serializers.RecipeImageSerializer(
+                recipe, context=self.get_serializer_context()
+            ).data
+        )
+
     @action(methods=['POST'], detail=True, url_path='delete-image')
     def delete_image(self, request, pk=None):
         """Delete an image from a recipe"""
         recipe = self.get_object()
-        recipe.image.delete()
+        recipe.delete_image()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance):
-        """Delete a recipe object"""
-        instance.image.delete()
+        """Delete a recipe object, its image is queued for deletion"""
         instance.delete()
+
+
+class SyncView(APIView):
+    """Return the user's recipes, tags and ingredients changed since the
+    given sync token"""
+    authentication_classes = (ExpiringTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Return the changes since the `since` token, or everything if
+        no token is given"""
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ValidationError({'since': 'Invalid sync token.'})
+
+        return Response(build_sync_payload(request.user, since))
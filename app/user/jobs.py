@@ -0,0 +1,16 @@
+from core.catalogue import seed_starter_catalogue
+from core.models import AuthToken
+
+
+def issue_signup_tokens(user_ids):
+    """Issue the default device token of newly signed up users, so their
+    first login finds it instead of writing one"""
+    AuthToken.objects.issue_missing(user_ids)
+
+
+def seed_signup_catalogues(user_ids):
+    """Give newly signed up users the starter tags and ingredients. Names
+    a user already has are skipped, so seeding a user again adds nothing
+    and a missed one can be made up with the seed_starter_catalogue
+    command."""
+    seed_starter_catalogue(user_ids, skip_existing=True)
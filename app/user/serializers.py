@@ -1,7 +1,10 @@
 from django.contrib.auth import get_user_model, authenticate
 from django.utils.translation import ugettext_lazy as _
 
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
+
+from core.hashers import HashingBusy, hash_password, hashing_slot
+from core.models import AuthToken
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,18 +17,21 @@ class UserSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         """Create a new user with encrypted password and return it."""
-        return get_user_model().objects.create_user(**validated_data)
+        try:
+            return get_user_model().objects.create_user(**validated_data)
+        except HashingBusy:
+            raise exceptions.Throttled()
 
     def update(self, instance, validated_data):
         """Update a user, setting the password correctly and return it."""
         password = validated_data.pop('password', None)
-        user = super().update(instance, validated_data)
-
         if password:
-            user.set_password(password)
-            user.save()
+            try:
+                instance.password = hash_password(password)
+            except HashingBusy:
+                raise exceptions.Throttled()
 
-        return user
+        return super().update(instance, validated_data)
 
 
 class AuthTokenSerializer(serializers.Serializer):
@@ -35,17 +41,26 @@ class AuthTokenSerializer(serializers.Serializer):
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    device = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        max_length=255
+    )
 
     def validate(self, attrs):
         """Validate and authenticate the user."""
         email = attrs.get('email')
         password = attrs.get('password')
 
-        user = authenticate(
-            request=self.context.get('request'),
-            username=email,
-            password=password
-        )
+        try:
+            with hashing_slot():
+                user = authenticate(
+                    request=self.context.get('request'),
+                    username=email,
+                    password=password
+                )
+        except HashingBusy:
+            raise exceptions.Throttled()
         if not user:
             msg = _('Unable to authenticate with provided credentials')
             raise serializers.ValidationError(msg, code='authentication')
@@ -54,10 +69,11 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
     def create(self, validated_data):
-        """Create and return a new token."""
-        user = validated_data.get('user')
-        token = user.get_token()
-        return token
+        """Return the user's token for the device, issuing it if needed."""
+        return AuthToken.objects.get_or_create_token(
+            validated_data['user'],
+            device=validated_data.get('device', '')
+        )
 
     def update(self, instance, validated_data):
         """Update and return an existing token."""
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core.jobs import runner
+
+from user.jobs import issue_signup_tokens, seed_signup_catalogues
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def set_up_new_user(sender, instance, created, raw, **kwargs):
+    """Give a new user, however created, the starter catalogue and a token
+    once the user commits. The catalogue is seeded right then, before a
+    signup's response is sent, so the client never reads it empty; the
+    token is left to the job runner, as the first login issues it
+    otherwise."""
+    if not created or raw:
+        return
+
+    user_id = instance.pk
+    transaction.on_commit(lambda: seed_signup_catalogues([user_id]))
+    runner.enqueue_on_commit(issue_signup_tokens, user_id)
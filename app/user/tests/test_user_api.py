@@ -1,10 +1,18 @@
-from django.test import TestCase
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
 from django.urls import reverse
 
+from rest_framework.settings import api_settings
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.hashers import HashingBusy
+from core.models import AuthToken
+from core.throttling import reset_buckets
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -31,6 +39,7 @@ class PublicUserApiTests(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        reset_buckets()
 
     def test_create_valid_user_success(self):
         """Creating user with valid payload succeeds"""
@@ -43,6 +52,79 @@ class PublicUserApiTests(TestCase):
         self.assertTrue(user.check_password(TEST_USER['password']))
         self.assertNotIn('password', resp.data)
 
+    @override_settings(JOBS_EAGER=True, STARTER_CATALOGUE={
+        'tags': ['Vegan'],
+        'ingredients': [],
+    })
+    def test_user_set_up_however_created(self):
+        """Test that users created outside the API, like superusers, get
+        the starter catalogue and a token, once only"""
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user_model().objects.create_superuser(
+                'admin@unittest.com',
+                'password'
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            user.name = 'Admin'
+            user.save()
+
+        self.assertEqual(
+            list(user.tag_set.values_list('name', flat=True)),
+            ['Vegan']
+        )
+        self.assertEqual(AuthToken.objects.filter(user=user).count(), 1)
+
+    @override_settings(JOBS_EAGER=True, STARTER_CATALOGUE={
+        'tags': ['Vegan', 'Dessert'],
+        'ingredients': ['Salt'],
+    })
+    def test_create_user_seeds_starter_catalogue(self):
+        """Test that new users get the starter tags and ingredients once
+        the signup commits"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(CREATE_USER_URL, TEST_USER)
+        user = get_user_model().objects.get(email=TEST_USER['email'])
+        self.assertFalse(user.tag_set.exists())
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(
+            sorted(user.tag_set.values_list('name', flat=True)),
+            ['Dessert', 'Vegan']
+        )
+        self.assertEqual(
+            list(user.ingredient_set.values_list('name', flat=True)),
+            ['Salt']
+        )
+
+    @override_settings(JOBS_EAGER=True)
+    def test_create_user_issues_token_in_background(self):
+        """Test that signup issues the token the first login returns"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(CREATE_USER_URL, TEST_USER)
+        token = AuthToken.objects.get(user__email=TEST_USER['email'])
+
+        resp = self.client.post(TOKEN_URL, {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        })
+
+        self.assertEqual(resp.data['token'], token.key)
+        self.assertEqual(AuthToken.objects.count(), 1)
+
+    @patch('core.models.hash_password', side_effect=HashingBusy)
+    def test_create_user_hashing_busy(self, hash_password):
+        """Test that signup backs off when the hashing pool is busy"""
+        resp = self.client.post(CREATE_USER_URL, TEST_USER)
+
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertFalse(
+            get_user_model().objects.filter(
+                email=TEST_USER['email']
+            ).exists()
+        )
+
     def test_user_exists_400(self):
         """Creating user that already exists fails"""
         create_user(**TEST_USER)
@@ -109,6 +191,158 @@ class PublicUserApiTests(TestCase):
         self.assertNotIn('token', resp.data)
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_token_reused_per_device(self):
+        """Test that logging in again on a device returns the same token"""
+        create_user(**TEST_USER)
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password'],
+            'device': 'phone'
+        }
+        resp1 = self.client.post(TOKEN_URL, payload)
+        resp2 = self.client.post(TOKEN_URL, payload)
+        resp3 = self.client.post(TOKEN_URL, {**payload, 'device': 'tablet'})
+
+        self.assertEqual(resp1.data['token'], resp2.data['token'])
+        self.assertNotEqual(resp1.data['token'], resp3.data['token'])
+        self.assertEqual(AuthToken.objects.count(), 2)
+
+    def test_token_authenticates_user(self):
+        """Test that an issued token can be used to authenticate"""
+        create_user(**TEST_USER)
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        }
+        token = self.client.post(TOKEN_URL, payload).data['token']
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        resp = self.client.get(ME_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['email'], TEST_USER['email'])
+
+    def test_revoke_token(self):
+        """Test that a revoked token can no longer be used"""
+        create_user(**TEST_USER)
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        }
+        token = self.client.post(TOKEN_URL, payload).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.client.get(ME_URL)
+
+        resp = self.client.delete(TOKEN_URL)
+
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(AuthToken.objects.filter(key=token).exists())
+        resp = self.client.get(ME_URL)
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_create_token_with_stale_token(self):
+        """Test that logging in works while a revoked token is still sent"""
+        create_user(**TEST_USER)
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        }
+        token = self.client.post(TOKEN_URL, payload).data['token']
+        AuthToken.objects.filter(key=token).delete()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+        resp = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('token', resp.data)
+
+    def test_create_token_upgrades_password_hash(self):
+        """Test that logging in rehashes a legacy password hash"""
+        user = create_user(**TEST_USER)
+        user.password = make_password(
+            TEST_USER['password'],
+            hasher='pbkdf2_sha256'
+        )
+        user.save()
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        }
+        resp = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'argon2')
+        self.assertTrue(user.check_password(TEST_USER['password']))
+
+    def test_create_token_throttled_per_email(self):
+        """Test that repeated logins for one account are throttled"""
+        payload = {'email': TEST_USER['email'], 'password': 'wrong'}
+        with patch.dict(
+            api_settings.DEFAULT_THROTTLE_RATES,
+            {'login_email': '2/min', 'login_ip': '100/min'}
+        ):
+            for _ in range(2):
+                resp = self.client.post(TOKEN_URL, payload)
+                self.assertEqual(
+                    resp.status_code,
+                    status.HTTP_400_BAD_REQUEST
+                )
+            resp = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_create_token_email_not_a_string(self):
+        """Test that a login with an email that is not a string is refused
+        instead of failing in the throttle"""
+        for email in (1, ['a@unittest.com'], {'a': 1}):
+            resp = self.client.post(
+                TOKEN_URL,
+                {'email': email, 'password': 'wrong'},
+                format='json'
+            )
+
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_token_body_not_an_object(self):
+        """Test that a login whose body is not an object is refused instead
+        of failing in the throttle"""
+        for body in ([{'email': TEST_USER['email']}], 'a@unittest.com', 1):
+            resp = self.client.post(TOKEN_URL, body, format='json')
+
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_token_throttled_per_ip(self):
+        """Test that repeated logins from one address are throttled"""
+        with patch.dict(
+            api_settings.DEFAULT_THROTTLE_RATES,
+            {'login_email': '100/min', 'login_ip': '2/min'}
+        ):
+            for i in range(2):
+                self.client.post(
+                    TOKEN_URL,
+                    {'email': f'user{i}@unittest.com', 'password': 'wrong'}
+                )
+            resp = self.client.post(
+                TOKEN_URL,
+                {'email': 'other@unittest.com', 'password': 'wrong'}
+            )
+
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @patch('user.serializers.hashing_slot', side_effect=HashingBusy)
+    def test_create_token_hashing_busy(self, hashing_slot):
+        """Test that login backs off when every hashing slot is taken"""
+        create_user(**TEST_USER)
+        payload = {
+            'email': TEST_USER['email'],
+            'password': TEST_USER['password']
+        }
+        resp = self.client.post(TOKEN_URL, payload)
+
+        self.assertNotIn('token', resp.data)
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
     def test_retrieve_user_unauthorized(self):
         """Test that authentication is required for users"""
         resp = self.client.get(ME_URL)
@@ -147,6 +381,22 @@ class PrivateUserApiTests(TestCase):
             'email': TEST_USER['email'],
             'name': NEW_USER['name']}
         )
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password(NEW_USER['password']))
+
+    @patch('user.serializers.hash_password', side_effect=HashingBusy)
+    def test_update_password_hashing_busy(self, hash_password):
+        """Test that changing the password backs off when the hashing pool
+        is busy, leaving the profile unchanged"""
+        resp = self.client.patch(ME_URL, {
+            'name': NEW_USER['name'],
+            'password': NEW_USER['password']
+        })
+
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, TEST_USER['name'])
+        self.assertTrue(self.user.check_password(TEST_USER['password']))
 
     def test_update_user_profile_with_no_password(self):
         """Test updating the user profile for authenticated user"""
@@ -0,0 +1,28 @@
+import hashlib
+from collections.abc import Mapping
+
+from core.throttling import TokenBucketThrottle
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    """Limit login attempts coming from a single client address"""
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class LoginEmailThrottle(TokenBucketThrottle):
+    """Limit login attempts against a single account"""
+    scope = 'login_email'
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.data, Mapping):
+            return None
+
+        email = request.data.get('email')
+        if not isinstance(email, str) or not email.strip():
+            return None
+
+        ident = hashlib.sha1(email.strip().lower().encode()).hexdigest()
+        return f'throttle:{self.scope}:{ident}'
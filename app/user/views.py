@@ -1,8 +1,13 @@
-from rest_framework import generics, authentication, permissions
-from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework import generics, permissions, status
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.authentication import ExpiringTokenAuthentication
+from core.models import AuthToken
+from core.throttling import WorkerThrottle
+
 from user.serializers import UserSerializer, AuthTokenSerializer
+from user.throttles import LoginIPThrottle, LoginEmailThrottle
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -10,16 +15,45 @@ class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
 
 
-class CreateTokenView(ObtainAuthToken):
-    """Create a new auth token for user"""
+class CreateTokenView(generics.GenericAPIView):
+    """Create a new auth token for user, or revoke the current one"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    authentication_classes = (ExpiringTokenAuthentication,)
+    throttle_classes = (LoginIPThrottle, LoginEmailThrottle, WorkerThrottle)
+
+    def get_authenticators(self):
+        """Authenticate only requests revoking a token, so a stale token
+        sent along with a login does not refuse it"""
+        if self.request.method != 'DELETE':
+            return []
+
+        return super().get_authenticators()
+
+    def get_permissions(self):
+        """Require authentication only for revoking a token"""
+        if self.request.method == 'DELETE':
+            return [permissions.IsAuthenticated()]
+
+        return [permissions.AllowAny()]
+
+    def post(self, request, *args, **kwargs):
+        """Authenticate the user and return a token"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token = serializer.save()
+        return Response({'token': token.key, 'expires': token.expires})
+
+    def delete(self, request, *args, **kwargs):
+        """Revoke the token used to authenticate this request"""
+        AuthToken.objects.filter(key=request.auth).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (ExpiringTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
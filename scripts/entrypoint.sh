@@ -0,0 +1,35 @@
+#!/bin/sh
+# Container entrypoint. The first argument picks the role:
+#   web      serve the API with gunicorn, loading the app once before
+#            forking the workers; migrations are left to the migrate job
+#   migrate  wait for the database and apply migrations, then exit
+#   reaper   wait for the database and delete the files queued for deletion
+#   dev      migrate and run the development server
+# Anything else is run as a command, e.g. `sh -c "python manage.py test"`.
+set -e
+
+case "$1" in
+  web)
+    exec gunicorn app.wsgi:application \
+      --preload \
+      --bind "0.0.0.0:${PORT:-8000}" \
+      --workers "${WEB_WORKERS:-3}" \
+      --access-logfile -
+    ;;
+  migrate)
+    python manage.py wait_for_db
+    exec python manage.py migrate --noinput
+    ;;
+  reaper)
+    python manage.py wait_for_db
+    exec python manage.py reap_deleted_files --loop
+    ;;
+  dev)
+    python manage.py wait_for_db
+    python manage.py migrate
+    exec python manage.py runserver 0.0.0.0:8000
+    ;;
+  *)
+    exec "$@"
+    ;;
+esac
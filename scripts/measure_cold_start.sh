@@ -0,0 +1,27 @@
+#!/bin/sh
+# Measure the cold start of the web container: the time from starting it
+# to the first successful health check. Fails when it exceeds TARGET
+# seconds. The database and migrations are brought up first, so only the
+# web container's own start is measured.
+set -e
+
+TARGET="${TARGET:-5}"
+URL="${URL:-http://localhost:8000/healthz}"
+
+docker-compose build app
+docker-compose up -d db
+docker-compose run --rm migrate
+docker-compose rm --stop --force app >/dev/null
+
+start=$(date +%s.%N)
+docker-compose up -d --no-deps app
+until curl --silent --fail "$URL" >/dev/null; do
+  sleep 0.05
+done
+end=$(date +%s.%N)
+
+awk -v start="$start" -v end="$end" -v target="$TARGET" 'BEGIN {
+  elapsed = end - start
+  printf "cold start %.2fs (target %ss)\n", elapsed, target
+  exit elapsed > target
+}'